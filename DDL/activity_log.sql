@@ -9,5 +9,25 @@ CREATE TABLE activity_log (
     event_outcome TEXT,                        -- NEW: success / failed / abandoned / sent / ignored
     refill_reminder_response BOOLEAN,          -- NEW: True if reminder was responded to
     session_duration INTEGER,                  -- NEW: Time spent in session (in seconds)
-    attempt_count INTEGER                      -- NEW: Number of attempts made for this event
+    attempt_count INTEGER,                     -- NEW: Number of attempts made for this event
+    time_stamp_epoch INTEGER NOT NULL          -- NEW: time_stamp parsed once at load (seconds since 1970-01-01)
+);
+
+CREATE INDEX idx_activity_log_patient_id_time_stamp_epoch ON activity_log (patient_id, time_stamp_epoch);
+CREATE INDEX idx_activity_log_time_stamp_epoch ON activity_log (time_stamp_epoch);
+
+-- Rows whose time_stamp was missing or unparseable at load time
+CREATE TABLE activity_log_quarantine (
+    id TEXT,
+    patient_id INTEGER,
+    event_type TEXT,
+    supply_days INTEGER,
+    prescribed_medication_days INTEGER,
+    channel TEXT,
+    time_stamp TEXT,
+    event_outcome TEXT,
+    refill_reminder_response BOOLEAN,
+    session_duration INTEGER,
+    attempt_count INTEGER,
+    quarantine_reason TEXT
 );
@@ -0,0 +1,280 @@
+import configparser
+import json
+import logging
+import os
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pandas as pd
+from parallel_score_generator import patient_shard_ids
+from reviq_helper import load_df_to_sqlite, read_activity_log
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+# 1 keeps activity_log inside sqlite_db_path; more spreads it over that many shard files
+activity_log_shards = config.getint("SHARDING", "activity_log_shards", fallback=1)
+# 'patient_id' (hash partitions, fixed count) or 'month' (one shard per calendar month)
+activity_log_shard_by = config.get("SHARDING", "activity_log_shard_by", fallback="patient_id")
+activity_log_shard_dir = config.get("SHARDING", "activity_log_shard_dir",
+                                    fallback=os.path.join(os.path.dirname(sqlite_db_path), "activity_log_shards"))
+shard_workers = config.getint("SHARDING", "shard_workers", fallback=8)
+
+LAYOUT_FILE = "shards.json"
+
+# Columns of activity_log (DDL/activity_log.sql), for results over a shard directory with no shards yet
+ACTIVITY_LOG_COLUMNS = ['id', 'patient_id', 'event_type', 'supply_days', 'prescribed_medication_days', 'channel',
+                        'time_stamp', 'event_outcome', 'refill_reminder_response', 'session_duration',
+                        'attempt_count', 'time_stamp_epoch']
+
+# ----------------------------------------------------------------------------------------------------
+# Shard directory layout:
+#   shards.json                              {"scheme": ..., "n_shards": ..., "shards": {key: file},
+#                                             "retired": [files of the generation before]}
+#   activity_log_<key>.<generation>.db       one activity_log table per file
+# A full reload or a rebalance writes a new generation of files and then swaps shards.json,
+# so readers always see one complete generation.
+# ----------------------------------------------------------------------------------------------------
+
+
+def activity_log_is_sharded(db_path: str, table_name: str) -> bool:
+    """True when table_name in db_path is the activity_log that is configured to live in shards"""
+    return (table_name == "activity_log" and activity_log_shards > 1
+            and os.path.abspath(db_path) == os.path.abspath(sqlite_db_path))
+
+
+def read_layout(shard_dir: str) -> dict:
+    """The shard layout, or None when nothing has been written yet"""
+    try:
+        with open(os.path.join(shard_dir, LAYOUT_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_layout(shard_dir: str, layout: dict) -> None:
+    tmp_path = os.path.join(shard_dir, f".{LAYOUT_FILE}.{uuid.uuid4().hex}")
+    with open(tmp_path, "w") as f:
+        json.dump(layout, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(shard_dir, LAYOUT_FILE))
+
+
+def shard_keys(df: pd.DataFrame, scheme: str, n_shards: int) -> pd.Series:
+    """
+    Shard key of every activity row.
+
+    :param df: activity_log rows (time_stamp_epoch is needed for the month scheme)
+    :param scheme: 'patient_id' or 'month'
+    :param n_shards: number of hash partitions for the patient_id scheme
+    :return: pd.Series of keys aligned with df, e.g. 'p08-003' or 'm2025-03'
+    """
+    if scheme == "patient_id":
+        shards = patient_shard_ids(df['patient_id'], n_shards)
+        return pd.Series([f"p{n_shards:02d}-{shard:03d}" for shard in shards], index=df.index)
+    if scheme == "month":
+        months = pd.to_datetime(df['time_stamp_epoch'], unit='s').dt.strftime('%Y-%m')
+        return "m" + months
+    raise ValueError(f"Unknown activity_log shard scheme: {scheme}")
+
+
+def _fan_out(fn, items: list, workers: int = None) -> list:
+    """Run fn over items concurrently (SQLite releases the GIL while it reads) and keep their order"""
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers or shard_workers, len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
+def _append_partitions(df: pd.DataFrame, shard_dir: str, files: dict, scheme: str, n_shards: int,
+                       generation: str) -> None:
+    """Append df's rows to the shard files in files, adding a file of this generation for new keys"""
+    keys = shard_keys(df, scheme, n_shards)
+    groups = []
+    for key, part in df.groupby(keys, sort=True):
+        files.setdefault(key, f"activity_log_{key}.{generation}.db")
+        groups.append((os.path.join(shard_dir, files[key]), part))
+
+    _fan_out(lambda group: load_df_to_sqlite(df=group[1], table_name="activity_log",
+                                             sqlite_db_path=group[0], if_exists='append'), groups)
+
+
+def _concat(frames: list) -> pd.DataFrame:
+    """Concatenate shard results; empty ones are left out so they cannot change column dtypes"""
+    non_empty = [frame for frame in frames if len(frame)]
+    if not non_empty:
+        return frames[0] if frames else pd.DataFrame()
+    return pd.concat(non_empty, ignore_index=True)
+
+
+def _new_generation() -> str:
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def _swap_layout(shard_dir: str, layout: dict, previous: dict) -> None:
+    """
+    Point readers at the new generation. Files of the replaced generation are only retired and are
+    deleted at the next swap, so a reader that picked up the old layout can still finish its read.
+    """
+    previous = previous or {}
+    kept = set(layout["shards"].values())
+    layout["retired"] = [file_name for file_name in previous.get("shards", {}).values() if file_name not in kept]
+    _write_layout(shard_dir, layout)
+
+    for file_name in previous.get("retired", []):
+        if file_name not in kept:
+            path = os.path.join(shard_dir, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def write_shards(df: pd.DataFrame, shard_dir: str = None, if_exists: str = 'replace', scheme: str = None,
+                 n_shards: int = None) -> dict:
+    """
+    Store activity_log rows across shard files.
+
+    :param df: activity_log rows
+    :param shard_dir: shard directory (default [SHARDING] activity_log_shard_dir)
+    :param if_exists: 'replace' writes a new generation and swaps it in; 'append' adds to the current one
+    :param scheme: 'patient_id' or 'month' (default: the current layout's, else config)
+    :param n_shards: hash partitions for the patient_id scheme (default: current layout's, else config)
+    :return: the layout now in effect
+    """
+    shard_dir = shard_dir or activity_log_shard_dir
+    os.makedirs(shard_dir, exist_ok=True)
+    previous = read_layout(shard_dir)
+
+    if if_exists == 'append' and previous is not None:
+        layout = dict(previous, shards=dict(previous["shards"]))
+        _append_partitions(df, shard_dir, layout["shards"], layout["scheme"], layout["n_shards"], _new_generation())
+        _write_layout(shard_dir, layout)
+    else:
+        scheme = scheme or (previous or {}).get("scheme") or activity_log_shard_by
+        n_shards = n_shards or (previous or {}).get("n_shards") or activity_log_shards
+        layout = {"scheme": scheme, "n_shards": n_shards, "shards": {}}
+        _append_partitions(df, shard_dir, layout["shards"], scheme, n_shards, _new_generation())
+        _swap_layout(shard_dir, layout, previous)
+
+    logger.info(f"activity_log: {len(df)} rows written to {len(layout['shards'])} "
+                f"{layout['scheme']} shard(s) in {shard_dir}")
+    return layout
+
+
+def _month_key_range(start, end) -> tuple:
+    first = f"m{pd.Timestamp(start).strftime('%Y-%m')}" if start is not None else None
+    last = f"m{pd.Timestamp(end).strftime('%Y-%m')}" if end is not None else None
+    return first, last
+
+
+def shard_paths(shard_dir: str = None, start=None, end=None) -> list:
+    """
+    Shard files that can hold events in [start, end]; month shards outside the range are skipped.
+
+    :param shard_dir: shard directory (default [SHARDING] activity_log_shard_dir)
+    :param start: earliest event time of interest (None: unbounded)
+    :param end: latest event time of interest (None: unbounded)
+    :return: list of shard file paths
+    """
+    shard_dir = shard_dir or activity_log_shard_dir
+    layout = read_layout(shard_dir)
+    if layout is None:
+        return []
+
+    keys = sorted(layout["shards"])
+    if layout["scheme"] == "month":
+        first, last = _month_key_range(start, end)
+        keys = [key for key in keys if (first is None or key >= first) and (last is None or key <= last)]
+    return [os.path.join(shard_dir, layout["shards"][key]) for key in keys]
+
+
+def read_shards(shard_dir: str = None, start=None, end=None) -> pd.DataFrame:
+    """
+    Read activity_log rows with event time in [start, end] from every relevant shard concurrently.
+
+    :param shard_dir: shard directory (default [SHARDING] activity_log_shard_dir)
+    :param start: earliest event time to include (None: unbounded)
+    :param end: latest event time to include (None: unbounded)
+    :return: pd.DataFrame of the merged rows
+    """
+    # When no month shard overlaps the range, one shard is still read for the empty result's columns
+    paths = shard_paths(shard_dir, start=start, end=end) or shard_paths(shard_dir)[:1]
+    if not paths:
+        return pd.DataFrame(columns=ACTIVITY_LOG_COLUMNS)
+    frames = _fan_out(lambda path: read_activity_log(sqlite_db_path=path, start=start, end=end), paths)
+    return _concat(frames)
+
+
+def query_shards(sql: str, params: dict = None, shard_dir: str = None, per_patient: bool = False) -> pd.DataFrame:
+    """
+    Run one query against every shard concurrently and concatenate the results.
+
+    Concatenation is only a correct merge when each result row depends on a single shard, e.g.
+    a per-patient GROUP BY under the patient_id scheme; pass per_patient=True for such queries
+    so they are rejected under a scheme that splits a patient's events across shards.
+
+    :param sql: query against the shard's activity_log table
+    :param params: query parameters
+    :param shard_dir: shard directory (default [SHARDING] activity_log_shard_dir)
+    :param per_patient: the query aggregates per patient
+    :return: pd.DataFrame of the concatenated results
+    """
+    shard_dir = shard_dir or activity_log_shard_dir
+    layout = read_layout(shard_dir)
+    if per_patient and layout is not None and layout["scheme"] != "patient_id":
+        raise ValueError(f"Per-patient aggregation needs patient_id shards, not {layout['scheme']} shards")
+
+    def _query(path):
+        conn = sqlite3.connect(path)
+        try:
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+    paths = shard_paths(shard_dir)
+    if not paths:
+        # Nothing written yet: run the query on an empty activity_log so the result has its columns
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute(f"CREATE TABLE activity_log ({', '.join(ACTIVITY_LOG_COLUMNS)})")
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+    frames = _fan_out(_query, paths)
+    return _concat(frames)
+
+
+def rebalance_shards(n_shards: int = None, scheme: str = None, shard_dir: str = None) -> dict:
+    """
+    Repartition the stored activity_log into a new shard count or scheme.
+
+    Old shards are streamed one at a time into a new generation of files, so memory is bounded
+    by the largest shard; readers keep using the old generation until the layout is swapped.
+
+    :param n_shards: new number of hash partitions (patient_id scheme)
+    :param scheme: new scheme ('patient_id' or 'month')
+    :param shard_dir: shard directory (default [SHARDING] activity_log_shard_dir)
+    :return: the new layout
+    """
+    shard_dir = shard_dir or activity_log_shard_dir
+    previous = read_layout(shard_dir)
+    if previous is None:
+        raise ValueError(f"No activity_log shards in {shard_dir}")
+
+    layout = {"scheme": scheme or previous["scheme"], "n_shards": n_shards or previous["n_shards"], "shards": {}}
+    generation = _new_generation()
+    for path in shard_paths(shard_dir):
+        part = read_activity_log(sqlite_db_path=path)
+        _append_partitions(part, shard_dir, layout["shards"], layout["scheme"], layout["n_shards"], generation)
+        logger.info(f"Rebalanced {len(part)} rows from {os.path.basename(path)}")
+
+    _swap_layout(shard_dir, layout, previous)
+    logger.info(f"activity_log rebalanced from {previous['n_shards']} {previous['scheme']} to "
+                f"{layout['n_shards']} {layout['scheme']} shard(s): {len(layout['shards'])} files")
+    return layout
@@ -3,7 +3,12 @@ import logging
 import pandas as pd
 from tabulate import tabulate
 from behaviour_score_generator import score_generator, calculate_adherance_score
-from reviq_helper import read_table_from_sqlite, load_df_to_sqlite
+from parallel_score_generator import parallel_score_generator
+import behaviour_score_generator_sql
+from reviq_helper import read_table_from_sqlite, read_activity_log, publish_df_to_sqlite
+from patient_similarity_index import refresh_similarity_index
+from score_drift_monitor import record_scores, flush_monitors
+from cohort_rollups import refresh_cohort_rollups
 
 # Create a ConfigParser object
 config = configparser.ConfigParser()
@@ -22,41 +27,76 @@ src_dir = config["DEFAULT"]["input_file_dir"]
 input_patient_file_nm = config["DEFAULT"]["patient_file_name"]
 input_activity_log_file_nm = config["DEFAULT"]["activity_log_file_name"]
 sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+# Optional fixed as-of date for reproducible (or historical) scoring; empty means "now"
+score_as_of_date = config["DEFAULT"].get("score_as_of_date") or None
+# Worker processes for scoring; 1 keeps the single-process path, 0 uses every core
+score_workers = config["DEFAULT"].getint("score_workers", fallback=1)
+# 'pandas' pulls activity_log into memory; 'sql' aggregates it inside SQLite
+score_engine = config["DEFAULT"].get("score_engine", "pandas")
 
 
 
 df_patient = read_table_from_sqlite(sqlite_db_path=sqlite_db_path,
                                     table_name="patient_dtl")
 
-df_activity_log = read_table_from_sqlite(sqlite_db_path=sqlite_db_path,
-                                         table_name="activity_log")
-
-df_activity_log['time_stamp'] = pd.to_datetime(df_activity_log['time_stamp'], errors='coerce')
-
 df_income_range = read_table_from_sqlite(sqlite_db_path=sqlite_db_path,
                                          table_name="income_range_grade")
 
 print(tabulate(df_patient.head(), headers='keys', tablefmt='psql'))
-print(tabulate(df_activity_log.head(), headers='keys', tablefmt='psql'))
 print(tabulate(df_income_range.head(), headers='keys', tablefmt='psql'))
 
-df_patient_with_activity_score = score_generator(patients_df=df_patient,
-                                                 activity_df=df_activity_log,
-                                                 income_df=df_income_range)
-
-print(tabulate(df_patient_with_activity_score.head(), headers='keys', tablefmt='psql'))
-
-
-# **************************************** calculating adherance score **************************************
-
-df_patient_with_all_score = calculate_adherance_score(df_patient_with_activity_score)
+if score_engine == "sql":
+    # Per-patient aggregates are computed inside SQLite; only one row per patient is read back
+    df_patient_with_activity_score = behaviour_score_generator_sql.score_generator(sqlite_db_path=sqlite_db_path,
+                                                                                   patients_df=df_patient,
+                                                                                   as_of_date=score_as_of_date)
+    df_patient_with_all_score = calculate_adherance_score(df_patient_with_activity_score)
+else:
+    # Events after the as-of date are ignored by scoring, so they are not read at all;
+    # event times come from the integer time_stamp_epoch column, no text parsing needed
+    df_activity_log = read_activity_log(sqlite_db_path=sqlite_db_path, end=score_as_of_date)
+
+    print(tabulate(df_activity_log.head(), headers='keys', tablefmt='psql'))
+
+    if score_workers == 1:
+        df_patient_with_activity_score = score_generator(patients_df=df_patient,
+                                                         activity_df=df_activity_log,
+                                                         income_df=df_income_range,
+                                                         as_of_date=score_as_of_date)
+
+        print(tabulate(df_patient_with_activity_score.head(), headers='keys', tablefmt='psql'))
+
+        # **************************************** calculating adherance score **************************************
+
+        df_patient_with_all_score = calculate_adherance_score(df_patient_with_activity_score)
+    else:
+        # Activity and adherence scores computed together on hash-partitioned patient shards
+        df_patient_with_all_score = parallel_score_generator(patients_df=df_patient,
+                                                             activity_df=df_activity_log,
+                                                             income_df=df_income_range,
+                                                             n_workers=score_workers or None,
+                                                             as_of_date=score_as_of_date,
+                                                             with_adherence=True)
 
 # df_patient_with_all_score.to_csv("/Users/amlanjyotipatnaik/PycharmProjects/REVIQ/Output/patient_with_all_score.csv")
 
 logger.info("Loading df_patient_with_all_score to patient_matrix table..")
 
-load_df_to_sqlite(df=df_patient_with_all_score,
-                  table_name="patient_matrix",
-                  sqlite_db_path=sqlite_db_path)
+# Built under a shadow name and swapped in, so the agent and scorer keep reading the previous
+# patient_matrix until the new one is complete
+publish_df_to_sqlite(df=df_patient_with_all_score,
+                     table_name="patient_matrix",
+                     sqlite_db_path=sqlite_db_path)
 
 logger.info(f"Loading df_patient_with_all_score to patient_matrix table {df_patient_with_all_score.count()}..DONE")
+
+# Similar-patient index follows patient_matrix; only patients whose row changed are re-indexed
+refresh_similarity_index(df_patient_with_all_score)
+
+# Cohort rollups for the agent: only cohorts with a changed patient are recomputed
+refresh_cohort_rollups(df_patient_with_all_score)
+
+# Compare the freshly written scores with the training distributions. This is the whole population,
+# so it replaces the previous run's sketches rather than decaying into them
+record_scores(df_patient_with_all_score, source="patient_matrix", snapshot=True)
+flush_monitors()
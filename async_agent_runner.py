@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import configparser
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, List, Optional
+from dotenv import load_dotenv
+from langchain.chat_models import ChatOpenAI
+from langchain.schema import AIMessage, ChatGeneration, ChatResult, FunctionMessage
+from langchain.tools import StructuredTool, Tool
+from reviq_helper import get_sqlite_tools, build_agent
+from langchain_cohort_tool import cohort_scores_tool, cohort_top_patients_tool
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+
+prediction_tool_workers = config.getint("AGENT", "prediction_tool_workers", fallback=4)
+sql_tool_workers = config.getint("AGENT", "sql_tool_workers", fallback=8)
+tool_timeout_secs = config.getfloat("AGENT", "tool_timeout_secs", fallback=30)
+max_concurrent_sessions = config.getint("AGENT", "max_concurrent_sessions", fallback=32)
+session_timeout_secs = config.getfloat("AGENT", "session_timeout_secs", fallback=120)
+
+
+class BoundedToolExecutor:
+    """
+    Runs blocking tool calls on a bounded thread pool so they never block the event loop.
+
+    At most max_workers calls of this kind run at once; further calls queue. A call that has not
+    finished (queue wait included) within timeout_secs raises asyncio.TimeoutError for the caller.
+    The worker thread itself cannot be interrupted and finishes in the background.
+    """
+
+    def __init__(self, name: str, max_workers: int, timeout_secs: float):
+        self.name = name
+        self.timeout_secs = timeout_secs
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"reviq-{name}")
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(call, timeout=self.timeout_secs)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name} tool call timed out after {self.timeout_secs}s")
+            raise
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False)
+
+
+def make_async_tool(tool, executor: BoundedToolExecutor):
+    """
+    Wrap a LangChain tool so that its async entry point runs the sync tool on the executor.
+
+    A timeout is returned to the agent as the tool's observation rather than failing the session.
+    """
+    async def _arun(tool_input):
+        try:
+            return await executor.run(tool.run, tool_input)
+        except asyncio.TimeoutError:
+            return f"The {tool.name} tool timed out after {executor.timeout_secs} seconds. Try a narrower request."
+
+    if tool.args_schema is not None:
+        async def _arun_structured(**kwargs):
+            return await _arun(kwargs)
+
+        return StructuredTool(name=tool.name,
+                              description=tool.description,
+                              args_schema=tool.args_schema,
+                              func=lambda **kwargs: tool.run(kwargs),
+                              coroutine=_arun_structured)
+
+    return Tool(name=tool.name, description=tool.description, func=tool.run, coroutine=_arun)
+
+
+class ScriptedChatModel(ChatOpenAI):
+    """
+    Offline stand-in for the chat model that replays a fixed script of tool calls.
+
+    It subclasses ChatOpenAI only because the OpenAI-functions agent accepts nothing else;
+    generation is overridden and no request ever leaves the process.
+
+    Each step is {"tool": name, "args": {...}} or {"answer": text}. The step to emit is chosen by
+    how many tool results the conversation already holds, so one instance serves any number of
+    concurrent sessions deterministically.
+    """
+
+    script: List[dict]
+    openai_api_key: Optional[str] = "offline"
+
+    @property
+    def _llm_type(self) -> str:
+        return "reviq-scripted"
+
+    def _next_message(self, messages) -> AIMessage:
+        tool_results = sum(isinstance(message, FunctionMessage) for message in messages)
+        step = self.script[min(tool_results, len(self.script) - 1)]
+        if "tool" in step:
+            return AIMessage(content="", additional_kwargs={
+                "function_call": {"name": step["tool"], "arguments": json.dumps(step.get("args", {}))}
+            })
+        return AIMessage(content=step["answer"])
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        return self._generate(messages, stop=stop, **kwargs)
+
+
+class AsyncReviqAgent:
+    """
+    Asyncio front end for the REVIQ agent: many concurrent sessions, tools on bounded pools.
+    """
+
+    def __init__(self, llm, include_prediction_tools: bool = True):
+        self.prediction_executor = BoundedToolExecutor("prediction", prediction_tool_workers, tool_timeout_secs)
+        self.sql_executor = BoundedToolExecutor("sql", sql_tool_workers, tool_timeout_secs)
+        self._sessions = asyncio.Semaphore(max_concurrent_sessions)
+
+        # Cohort rollup tools only read precomputed tables, so they share the SQL pool
+        tools = [make_async_tool(tool, self.sql_executor)
+                 for tool in [cohort_scores_tool, cohort_top_patients_tool] + get_sqlite_tools(sqlite_db_path, llm)]
+        if include_prediction_tools:
+            # Imported here because importing the predictor tools starts H2O
+            from langchain_predictor_tool import (predict_and_explain_adherence_tool, explain_patient_scores_tool,
+                                                  find_similar_patients_tool, what_if_adherence_tool)
+            tools = [make_async_tool(tool, self.prediction_executor)
+                     for tool in (predict_and_explain_adherence_tool, explain_patient_scores_tool,
+                                  find_similar_patients_tool, what_if_adherence_tool)] + tools
+
+        self.agent = build_agent(llm=llm, tools=tools, verbose=False)
+
+    async def ask(self, question: str) -> str:
+        """Answer one question; at most max_concurrent_sessions run at a time"""
+        async with self._sessions:
+            try:
+                return await asyncio.wait_for(self.agent.arun(question), timeout=session_timeout_secs)
+            except asyncio.TimeoutError:
+                logger.warning(f"Session timed out after {session_timeout_secs}s: {question[:80]}")
+                return "Sorry, this request took too long to answer. Please try again."
+
+    async def ask_many(self, questions: List[str]) -> List[str]:
+        """Answer several questions concurrently, results in input order"""
+        return await asyncio.gather(*(self.ask(question) for question in questions))
+
+    def close(self) -> None:
+        self.prediction_executor.shutdown()
+        self.sql_executor.shutdown()
+
+
+def _offline_llm() -> ScriptedChatModel:
+    return ScriptedChatModel(script=[
+        {"tool": "sql_db_list_tables", "args": {"__arg1": ""}},
+        {"answer": "The REVIQ database tables are listed above."},
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run REVIQ agent sessions concurrently")
+    parser.add_argument("questions", nargs="*", default=["Which tables hold patient adherence data?"])
+    parser.add_argument("--offline", action="store_true", help="use the scripted local chat model")
+    args = parser.parse_args()
+
+    if args.offline:
+        chat_model = _offline_llm()
+    else:
+        load_dotenv()
+        chat_model = ChatOpenAI(model="gpt-4.1", temperature=0.7, openai_api_key=os.getenv("OPENAI_API_KEY"))
+
+    runner = AsyncReviqAgent(chat_model, include_prediction_tools=not args.offline)
+    try:
+        for question, answer in zip(args.questions, asyncio.run(runner.ask_many(args.questions))):
+            print(f"Q: {question}\nA: {answer}\n")
+    finally:
+        runner.close()
@@ -1,11 +1,126 @@
 import pandas as pd
 import numpy as np
 
+# Trailing windows (in days) for the rolling behaviour features
+ROLLING_WINDOWS = (30, 60, 90)
+
 def normalize_series(series, min_val, max_val):
     """Vectorized normalization for a Pandas Series"""
     return ((series - min_val) / (max_val - min_val + 1e-9)).clip(lower=0, upper=1)
 
-def score_generator(patients_df, activity_df, income_df):
+def event_timestamps(activity_df: pd.DataFrame, errors: str = 'coerce') -> pd.Series:
+    """Event times as datetime64, from the integer time_stamp_epoch written at ingestion when present"""
+    if 'time_stamp_epoch' in activity_df.columns:
+        return pd.to_datetime(activity_df['time_stamp_epoch'], unit='s').astype('datetime64[ns]')
+    return pd.to_datetime(activity_df['time_stamp'], errors=errors)
+
+def _activity_event_flags(activity_df: pd.DataFrame) -> pd.DataFrame:
+    """Per-event flags behind the short-refill, coverage-failure and reminder-ignore features"""
+    supply_days = activity_df['supply_days'].fillna(0)
+    prescribed_days = activity_df['prescribed_medication_days'].fillna(supply_days)
+    event_type = activity_df['event_type'].str.lower()
+    reminder_response = activity_df['refill_reminder_response'].fillna(False).astype(int).astype(bool)
+
+    return pd.DataFrame({
+        'patient_id': activity_df['patient_id'],
+        'time_stamp': event_timestamps(activity_df),
+        'short_refill': (supply_days < 0.7 * prescribed_days).astype(int),
+        'coverage_check_fail': (
+            event_type.eq('coverage_check') &
+            activity_df['event_outcome'].str.lower().isin(['failed', 'abandoned'])
+        ).astype(int),
+        'reminder_ignored': (event_type.eq('reminder') & ~reminder_response).astype(int),
+    })
+
+def rolling_window_features(activity_df: pd.DataFrame, as_of_dates, windows=ROLLING_WINDOWS) -> pd.DataFrame:
+    """
+    Trailing-window behaviour features for one or many as-of dates in a single pass.
+
+    Events are sorted by (patient_id, time_stamp) once and packed into one monotonic
+    int64 key per event, so every (as_of_date, window) pair is answered for all patients
+    with two binary searches and a cumulative-sum difference. A window covers
+    (as_of_date - N days, as_of_date]. Events with an unparseable time_stamp are skipped.
+
+    :param activity_df: activity_log rows
+    :param as_of_dates: a single date or an iterable of dates to evaluate
+    :param windows: window lengths in days
+    :return: pd.DataFrame with one row per (patient_id, as_of_date)
+    """
+    if isinstance(as_of_dates, (str, pd.Timestamp)) or not hasattr(as_of_dates, '__iter__'):
+        as_of_dates = [as_of_dates]
+    as_of_dates = [pd.Timestamp(d) for d in as_of_dates]
+
+    events = _activity_event_flags(activity_df).dropna(subset=['patient_id', 'time_stamp'])
+    events = events.sort_values(['patient_id', 'time_stamp'], kind='mergesort')
+
+    patient_codes, patient_ids = pd.factorize(events['patient_id'], sort=True)
+    seconds = events['time_stamp'].to_numpy().astype('datetime64[s]').astype(np.int64)
+    n_patients = len(patient_ids)
+
+    columns = {'patient_id': np.tile(np.asarray(patient_ids), len(as_of_dates)),
+               'as_of_date': np.repeat(np.array(as_of_dates, dtype='datetime64[ns]'), n_patients)}
+    if len(events) == 0:
+        for window in windows:
+            for name in ('event_count', 'short_refill_count', 'coverage_check_fail_rate', 'reminder_ignore_rate'):
+                columns[f'{name}_{window}d'] = np.zeros(0)
+        return pd.DataFrame(columns)
+
+    # Sorted (patient, time) pairs packed into one sortable key: patient_code * span + offset
+    t_min = seconds.min()
+    span = int(seconds.max() - t_min + 1)
+    keys = patient_codes.astype(np.int64) * span + (seconds - t_min)
+    block_start = np.arange(n_patients, dtype=np.int64) * span
+
+    # Prefix sums with a leading zero so that sum(left:right) = cum[right] - cum[left]
+    cumulative = {
+        flag: np.concatenate(([0], np.cumsum(events[flag].to_numpy(dtype=np.int64))))
+        for flag in ('short_refill', 'coverage_check_fail', 'reminder_ignored')
+    }
+
+    def _upper_bound(offset_seconds):
+        offset = np.clip(offset_seconds, -1, span - 1)
+        return np.searchsorted(keys, block_start + offset, side='right')
+
+    for window in windows:
+        event_count, short_refills, coverage_fails, reminders_ignored = [], [], [], []
+        for as_of in as_of_dates:
+            end_offset = int(as_of.to_datetime64().astype('datetime64[s]').astype(np.int64)) - int(t_min)
+            right = _upper_bound(end_offset)
+            left = _upper_bound(end_offset - window * 86400)
+            event_count.append(right - left)
+            short_refills.append(cumulative['short_refill'][right] - cumulative['short_refill'][left])
+            coverage_fails.append(cumulative['coverage_check_fail'][right] - cumulative['coverage_check_fail'][left])
+            reminders_ignored.append(cumulative['reminder_ignored'][right] - cumulative['reminder_ignored'][left])
+
+        count = np.concatenate(event_count)
+        safe_count = np.where(count > 0, count, 1)
+        columns[f'event_count_{window}d'] = count
+        columns[f'short_refill_count_{window}d'] = np.concatenate(short_refills)
+        columns[f'coverage_check_fail_rate_{window}d'] = np.where(count > 0, np.concatenate(coverage_fails) / safe_count, np.nan)
+        columns[f'reminder_ignore_rate_{window}d'] = np.where(count > 0, np.concatenate(reminders_ignored) / safe_count, np.nan)
+
+    return pd.DataFrame(columns)
+
+def score_generator(patients_df, activity_df, income_df, as_of_date=None, windows=None):
+    """
+    Generate the four activity scores for every patient.
+
+    :param patients_df: patient_dtl rows
+    :param activity_df: activity_log rows
+    :param income_df: income_range_grade rows
+    :param as_of_date: date recency is measured against; events after it are ignored.
+                       Defaults to now, which makes the result time dependent.
+    :param windows: optional window lengths in days (e.g. ROLLING_WINDOWS) for which
+                    rolling short-refill / coverage-failure / reminder-ignore features are added
+    :return: patients_df with the score columns appended
+    """
+    as_of = pd.Timestamp(as_of_date) if as_of_date is not None else pd.Timestamp.now()
+
+    # Handle timestamps
+    activity_df = activity_df.assign(time_stamp=event_timestamps(activity_df))
+    if as_of_date is not None:
+        activity_df = activity_df[activity_df['time_stamp'].isna() | (activity_df['time_stamp'] <= as_of)]
+
     # Merge patient and activity data
     df = patients_df.merge(activity_df, left_on='id', right_on='patient_id', how='inner')
 
@@ -40,9 +155,7 @@ def score_generator(patients_df, activity_df, income_df):
     ).astype(int)
     df['reminder_ignore_rate'] = df.groupby('patient_id')['reminder_ignored'].transform('mean')
 
-    # Handle timestamps
-    df['time_stamp'] = pd.to_datetime(df['time_stamp'], errors='coerce')
-    df['days_since_last'] = (pd.Timestamp.now() - df['time_stamp']).dt.days
+    df['days_since_last'] = (as_of - df['time_stamp']).dt.days
     df['days_since_last'] = df['days_since_last'].fillna(90)
 
     df['avg_reminder_response_delay'] = df.groupby('patient_id')['days_since_last'].transform('mean')
@@ -73,8 +186,9 @@ def score_generator(patients_df, activity_df, income_df):
         2
     )
 
-    # Get latest record per patient
-    latest_records = df.sort_values('time_stamp').groupby('patient_id').tail(1)
+    # Get latest record per patient; a stable sort picks the same one among equal time stamps
+    # however the rows were partitioned (see parallel_score_generator)
+    latest_records = df.sort_values('time_stamp', kind='mergesort').groupby('patient_id').tail(1)
 
     # Final dataframe with scores
     final_df = patients_df.merge(
@@ -88,6 +202,10 @@ def score_generator(patients_df, activity_df, income_df):
         left_on='id', right_on='patient_id', how='left'
     ).drop(columns=['patient_id'])
 
+    if windows:
+        rolling = rolling_window_features(activity_df, [as_of], windows).drop(columns=['as_of_date'])
+        final_df = final_df.merge(rolling, left_on='id', right_on='patient_id', how='left').drop(columns=['patient_id'])
+
     return final_df
 
 def normalize(val, min_val, max_val):
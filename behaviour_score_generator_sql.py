@@ -0,0 +1,254 @@
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+from behaviour_score_generator import normalize_series
+from reviq_helper import TS_TEXT_EPOCH_SQL, ensure_indexes, read_table_from_sqlite
+from activity_log_shards import activity_log_is_sharded, query_shards
+
+logger = logging.getLogger(__name__)
+
+# Event time in epoch seconds: the integer column written at ingestion, or for tables loaded before
+# it existed, parsed from text (unparseable values give NULL, the SQL equivalent of errors='coerce')
+_TS_EPOCH_SQL = "time_stamp_epoch"
+_TS_TEXT_SQL = TS_TEXT_EPOCH_SQL
+
+# Per-event flags and epoch seconds, mirroring the derived features of behaviour_score_generator.
+_EVENTS_SQL = """
+    SELECT
+        patient_id,
+        {ts} AS ts,
+        COALESCE(session_duration, 0) AS session_duration,
+        COALESCE(refill_reminder_response, 0) != 0 AS reminder_response,
+        COALESCE(supply_days, 0) < 0.7 * COALESCE(prescribed_medication_days, supply_days, 0) AS short_refill,
+        (LOWER(event_type) = 'coverage_check') IS 1 AS coverage_check,
+        (LOWER(event_type) = 'coverage_check' AND LOWER(event_outcome) IN ('failed', 'abandoned')) IS 1
+            AS coverage_check_fail,
+        (LOWER(event_type) = 'reminder' AND COALESCE(refill_reminder_response, 0) = 0) IS 1 AS reminder_ignored
+    FROM activity_log
+"""
+
+# Whole days between as-of and the event, floored like pandas' Timedelta.days (integer maths only)
+_DAYS_SINCE_SQL = "((:as_of - ts) - (((:as_of - ts) % 86400) + 86400) % 86400) / 86400"
+
+
+def _in_window(window) -> str:
+    return f"ts > :as_of - {int(window) * 86400} AND ts <= :as_of"
+
+
+def _event_count(window) -> str:
+    # Counts stay NULL for patients without any timestamped event, as in rolling_window_features
+    return f"SUM(CASE WHEN {_in_window(window)} THEN 1 WHEN ts IS NOT NULL THEN 0 END)"
+
+
+def _scoped_sql(ts_sql: str) -> str:
+    """Events up to as-of with their days_since_last and per-patient recency rank"""
+    return f"""
+        WITH events AS (
+            {_EVENTS_SQL.format(ts=ts_sql)}
+        ),
+        scoped AS (
+            SELECT *,
+                   COALESCE({_DAYS_SINCE_SQL}, 90) AS days_since_last,
+                   -- pandas sorts NaT last, so an event without a timestamp counts as the latest one
+                   ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY ts IS NULL DESC, ts DESC) AS recency_rank
+            FROM events
+            WHERE :apply_as_of = 0 OR ts IS NULL OR ts <= :as_of
+        )
+    """
+
+
+def _aggregate_sql(windows, ts_sql: str = _TS_EPOCH_SQL) -> str:
+    window_columns = []
+    for window in windows:
+        window_columns += [
+            f"{_event_count(window)} AS event_count_{window}d",
+            f"SUM(CASE WHEN {_in_window(window)} THEN short_refill WHEN ts IS NOT NULL THEN 0 END)"
+            f" AS short_refill_count_{window}d",
+            f"SUM(CASE WHEN {_in_window(window)} THEN coverage_check_fail END) * 1.0"
+            f" / NULLIF({_event_count(window)}, 0) AS coverage_check_fail_rate_{window}d",
+            f"SUM(CASE WHEN {_in_window(window)} THEN reminder_ignored END) * 1.0"
+            f" / NULLIF({_event_count(window)}, 0) AS reminder_ignore_rate_{window}d",
+        ]
+
+    return f"""
+        {_scoped_sql(ts_sql)}
+        SELECT
+            patient_id,
+            SUM(short_refill) AS short_refill_count,
+            SUM(coverage_check) AS coverage_check_attempts,
+            AVG(coverage_check_fail) AS coverage_check_fail_rate,
+            AVG(reminder_ignored) AS reminder_ignore_rate,
+            AVG(days_since_last) AS avg_reminder_response_delay,
+            MAX(CASE WHEN recency_rank = 1 THEN days_since_last END) AS latest_days_since_last,
+            MAX(CASE WHEN recency_rank = 1 THEN session_duration END) AS latest_session_duration,
+            MAX(CASE WHEN recency_rank = 1 THEN reminder_response END) AS latest_reminder_response
+            {''.join(', ' + column for column in window_columns)}
+        FROM scoped
+        GROUP BY patient_id
+    """
+
+
+def _partial_aggregate_sql(windows, ts_sql: str = _TS_EPOCH_SQL) -> str:
+    """
+    Per-patient aggregates of one shard in a mergeable form: sums and counts instead of averages
+    and rates, and the sort key of the shard's latest event. See _merge_partials.
+    """
+    window_columns = []
+    for window in windows:
+        window_columns += [
+            f"{_event_count(window)} AS event_count_{window}d",
+            f"SUM(CASE WHEN {_in_window(window)} THEN short_refill WHEN ts IS NOT NULL THEN 0 END)"
+            f" AS short_refill_count_{window}d",
+            f"SUM(CASE WHEN {_in_window(window)} THEN coverage_check_fail END) AS coverage_check_fail_sum_{window}d",
+            f"SUM(CASE WHEN {_in_window(window)} THEN reminder_ignored END) AS reminder_ignored_sum_{window}d",
+        ]
+
+    return f"""
+        {_scoped_sql(ts_sql)}
+        SELECT
+            patient_id,
+            COUNT(*) AS n_events,
+            SUM(short_refill) AS short_refill_count,
+            SUM(coverage_check) AS coverage_check_attempts,
+            SUM(coverage_check_fail) AS coverage_check_fail_sum,
+            SUM(reminder_ignored) AS reminder_ignored_sum,
+            SUM(days_since_last) AS days_since_last_sum,
+            MAX(CASE WHEN recency_rank = 1 THEN ts IS NULL END) AS latest_ts_is_null,
+            MAX(CASE WHEN recency_rank = 1 THEN ts END) AS latest_ts,
+            MAX(CASE WHEN recency_rank = 1 THEN days_since_last END) AS latest_days_since_last,
+            MAX(CASE WHEN recency_rank = 1 THEN session_duration END) AS latest_session_duration,
+            MAX(CASE WHEN recency_rank = 1 THEN reminder_response END) AS latest_reminder_response
+            {''.join(', ' + column for column in window_columns)}
+        FROM scoped
+        GROUP BY patient_id
+    """
+
+
+def _merge_partials(partials: pd.DataFrame, windows) -> pd.DataFrame:
+    """
+    Combine per-shard partial aggregates into the columns _aggregate_sql returns. A patient whose
+    events are spread over several shards gets one row, exactly as if all events were in one table.
+    """
+    partials = partials.astype({col: float for col in partials.columns if col != 'patient_id'})
+    sum_columns = ['n_events', 'short_refill_count', 'coverage_check_attempts', 'coverage_check_fail_sum',
+                   'reminder_ignored_sum', 'days_since_last_sum']
+    for window in windows:
+        sum_columns += [f"event_count_{window}d", f"short_refill_count_{window}d",
+                        f"coverage_check_fail_sum_{window}d", f"reminder_ignored_sum_{window}d"]
+    # min_count=1 keeps a sum NULL when it is NULL in every shard, as SUM does in SQL
+    sums = partials.groupby('patient_id', sort=False)[sum_columns].sum(min_count=1)
+
+    # The latest event overall is the latest of the shards' latest events (an event without a timestamp first)
+    latest = (partials.sort_values(['latest_ts_is_null', 'latest_ts'], ascending=False, kind='mergesort',
+                                   na_position='last')
+              .groupby('patient_id', sort=False).head(1)
+              .set_index('patient_id')[['latest_days_since_last', 'latest_session_duration',
+                                        'latest_reminder_response']])
+
+    df = pd.DataFrame(index=sums.index)
+    df['short_refill_count'] = sums['short_refill_count']
+    df['coverage_check_attempts'] = sums['coverage_check_attempts']
+    df['coverage_check_fail_rate'] = sums['coverage_check_fail_sum'] / sums['n_events']
+    df['reminder_ignore_rate'] = sums['reminder_ignored_sum'] / sums['n_events']
+    df['avg_reminder_response_delay'] = sums['days_since_last_sum'] / sums['n_events']
+    df = df.join(latest)
+    for window in windows:
+        event_count = sums[f"event_count_{window}d"]
+        df[f"event_count_{window}d"] = event_count
+        df[f"short_refill_count_{window}d"] = sums[f"short_refill_count_{window}d"]
+        df[f"coverage_check_fail_rate_{window}d"] = sums[f"coverage_check_fail_sum_{window}d"] / event_count.replace(0, np.nan)
+        df[f"reminder_ignore_rate_{window}d"] = sums[f"reminder_ignored_sum_{window}d"] / event_count.replace(0, np.nan)
+    return df.rename_axis('patient_id').reset_index()
+
+
+def aggregate_activity_features(sqlite_db_path: str, as_of_date=None, windows=None) -> pd.DataFrame:
+    """
+    Compute the per-patient activity aggregates inside SQLite.
+
+    :param sqlite_db_path: path to the SQLite database holding activity_log
+    :param as_of_date: date recency is measured against; events after it are ignored (default: now)
+    :param windows: optional rolling window lengths in days
+    :return: pd.DataFrame with one aggregate row per patient_id
+    """
+    as_of = pd.Timestamp(as_of_date) if as_of_date is not None else pd.Timestamp.now()
+    params = {
+        'as_of': int(as_of.to_datetime64().astype('datetime64[s]').astype(np.int64)),
+        'apply_as_of': int(as_of_date is not None),
+    }
+
+    if activity_log_is_sharded(sqlite_db_path, 'activity_log'):
+        # Shards are aggregated concurrently into mergeable partials, so the result stays exact
+        # even when a patient's events are spread over several shards (e.g. month sharding)
+        logger.info(f"Aggregating sharded activity_log (as of {as_of})")
+        partials = query_shards(_partial_aggregate_sql(windows or ()), params=params)
+        return _merge_partials(partials, windows or ())
+
+    ensure_indexes(sqlite_db_path, 'activity_log')
+
+    logger.info(f"Aggregating activity_log in SQLite at: {sqlite_db_path} (as of {as_of})")
+    conn = sqlite3.connect(sqlite_db_path)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info("activity_log")').fetchall()}
+    ts_sql = _TS_EPOCH_SQL if 'time_stamp_epoch' in columns else _TS_TEXT_SQL
+    df = pd.read_sql_query(_aggregate_sql(windows or (), ts_sql), conn, params=params)
+    conn.close()
+    # Columns that came back entirely NULL arrive as object dtype
+    return df.astype({col: float for col in df.columns if col != 'patient_id'})
+
+
+def score_generator(sqlite_db_path: str, patients_df: pd.DataFrame = None, as_of_date=None,
+                    windows=None) -> pd.DataFrame:
+    """
+    SQL-pushdown counterpart of behaviour_score_generator.score_generator.
+
+    Only one aggregate row per patient leaves SQLite; the score formulas are then applied
+    to those rows exactly as the pandas engine applies them to each patient's latest event.
+
+    :param sqlite_db_path: path to the SQLite database
+    :param patients_df: patient_dtl rows (read from the database when not given)
+    :param as_of_date: date recency is measured against (default: now)
+    :param windows: optional rolling window lengths in days
+    :return: patients_df with the score columns appended
+    """
+    if patients_df is None:
+        patients_df = read_table_from_sqlite(sqlite_db_path=sqlite_db_path, table_name="patient_dtl")
+
+    agg = aggregate_activity_features(sqlite_db_path, as_of_date=as_of_date, windows=windows)
+    df = patients_df[['id', 'annual_income_grade']].merge(agg, left_on='id', right_on='patient_id', how='inner')
+    annual_income_grade = pd.to_numeric(df['annual_income_grade'], errors='coerce')
+
+    # Score calculations (rounded to 2 decimals)
+    df['price_sensitivity_score'] = np.round(
+        normalize_series(annual_income_grade, 1, 4).rsub(1) * 0.6 +
+        normalize_series(df['short_refill_count'], 0, 5) * 0.4,
+        2
+    )
+
+    df['awareness_score'] = np.round(
+        normalize_series(df['latest_days_since_last'], 0, 90) * 0.4 +
+        normalize_series(df['latest_session_duration'], 0, 600) * 0.3 +
+        df['latest_reminder_response'] * 0.3,
+        2
+    )
+
+    df['coverage_confusion_score'] = np.round(
+        normalize_series(df['coverage_check_attempts'], 0, 5) * 0.5 +
+        df['coverage_check_fail_rate'].fillna(0) * 0.5,
+        2
+    )
+
+    df['refill_reminder_score'] = np.round(
+        df['reminder_ignore_rate'].fillna(0) * 0.5 +
+        normalize_series(df['avg_reminder_response_delay'].fillna(0), 0, 72) * 0.5,
+        2
+    )
+
+    score_columns = ['price_sensitivity_score', 'awareness_score', 'coverage_confusion_score', 'refill_reminder_score']
+    window_columns = [col for col in agg.columns if col.endswith(tuple(f'_{window}d' for window in windows or ()))]
+    # agg has one row per patient; duplicates here only come from repeated ids in patients_df
+    final_df = patients_df.merge(
+        df[['patient_id'] + score_columns + window_columns].drop_duplicates('patient_id'),
+        left_on='id', right_on='patient_id', how='left'
+    ).drop(columns=['patient_id'])
+
+    return final_df
@@ -1,14 +1,149 @@
+import configparser
 import pandas as pd
 import numpy as np
+from behaviour_score_generator import event_timestamps
 
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
 
-def score_generator(patients_df: pd.DataFrame, activity_df: pd.DataFrame, income_df: pd.DataFrame=None) -> pd.DataFrame:
+# Engine used when score_generator is called without one: 'vectorized' or 'apply'
+DEFAULT_ENGINE = config["DEFAULT"].get("behaviour_v1_engine", "vectorized")
+
+RISKY_JOBS = ['unemployed', 'retired', 'part-time']
+CONDITION_MAP = {"acute": 0, "chronic": 1}
+
+
+def score_generator(patients_df: pd.DataFrame, activity_df: pd.DataFrame, income_df: pd.DataFrame=None,
+                    engine: str = None, as_of_date=None) -> pd.DataFrame:
+    """
+    Generate the v1 behaviour feature set and scores.
+
+    :param patients_df: patient_dtl rows
+    :param activity_df: activity_log rows
+    :param income_df: income_range_grade rows
+    :param engine: 'vectorized' (grouped aggregations, for production scale) or 'apply'
+                   (the original row-wise implementation). Defaults to behaviour_v1_engine in config.ini.
+    :param as_of_date: date recency is measured against; events after it are ignored, as in
+                       behaviour_score_generator.score_generator (default: now, no events dropped)
+    :return: pd.DataFrame with patient, feature and score columns
+    """
+    engines = {
+        'vectorized': _score_generator_vectorized,
+        'apply': _score_generator_apply,
+    }
+    engine = engine or DEFAULT_ENGINE
+    if engine not in engines:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {sorted(engines)}")
+    return engines[engine](patients_df, activity_df, income_df, as_of_date)
+
+
+def _activity_as_of(activity_df: pd.DataFrame, as_of_date) -> pd.DataFrame:
+    """Copy of activity_df with parsed time_stamp, without the events after as_of_date"""
+    activity = activity_df.copy()
+    activity['time_stamp'] = event_timestamps(activity, errors='raise')
+    if as_of_date is not None:
+        activity = activity[activity['time_stamp'].isna() | (activity['time_stamp'] <= pd.Timestamp(as_of_date))]
+    return activity
+
+
+def _normalize_series(series: pd.Series, min_val, max_val) -> pd.Series:
+    """Vectorized counterpart of the row-wise normalize: clipped to [0, 1], missing -> 0"""
+    return ((series - min_val) / (max_val - min_val + 1e-9)).clip(lower=0, upper=1).fillna(0)
+
+
+def _score_generator_vectorized(patients_df: pd.DataFrame, activity_df: pd.DataFrame, income_df: pd.DataFrame=None,
+                                as_of_date=None) -> pd.DataFrame:
     # --- Merge income info into patient table ---
     patients = patients_df.merge(income_df, left_on='annual_income_grade', right_on='grade', how='left')
 
     # --- Preprocess activity log ---
-    activity = activity_df.copy()
-    activity['time_stamp'] = pd.to_datetime(activity['time_stamp'])
+    activity = _activity_as_of(activity_df, as_of_date)
+    activity = activity.sort_values(['patient_id', 'time_stamp'])
+
+    supply_days = activity['supply_days']
+    prescribed_days = activity['prescribed_medication_days']
+    activity['adherence_ratio'] = (supply_days / prescribed_days).where(supply_days.notna() & (prescribed_days > 0))
+    activity['supply_short'] = (supply_days <= 15).astype(int)
+    activity['is_refill'] = activity['event_type'].str.lower().str.contains('refill')
+    activity['reminder_responded'] = activity['refill_reminder_response'].fillna(False).astype(int)
+
+    # --- Aggregate behavioral metrics (built-in reducers only, no Python callbacks) ---
+    agg = activity.groupby('patient_id').agg(
+        num_short_refills=('supply_short', 'sum'),
+        num_refill_events=('is_refill', 'sum'),
+        short_supply_rate=('supply_short', 'mean'),
+        mean_adherence_ratio=('adherence_ratio', 'mean'),
+        avg_supply_days=('supply_days', 'mean'),
+        event_count=('time_stamp', 'count'),
+        last_activity=('time_stamp', 'max'),
+        first_activity=('time_stamp', 'min'),
+        unique_channels=('channel', 'nunique'),
+        reminder_response_count=('reminder_responded', 'sum')
+    ).reset_index()
+
+    refill_events = agg['num_refill_events'].astype(float)
+    agg['multiple_short_refills_rate'] = (agg['num_short_refills'] / refill_events.where(refill_events > 0)).fillna(0)
+
+    # Merge patient + activity features
+    df = patients.merge(agg, left_on='id', right_on='patient_id', how='left')
+
+    # Time features
+    now = pd.Timestamp(as_of_date) if as_of_date is not None else pd.Timestamp.now()
+    df['days_since_last'] = (now - df['last_activity']).dt.days
+    df['active_days_span'] = (df['last_activity'] - df['first_activity']).dt.days
+
+    # Income score: lower income → higher score
+    df['income_score'] = _normalize_series(1_000_000 - df['income_range_low'], 0, 1_000_000)
+
+    # Occupation risk (manual rule-based)
+    df['occupation_risk'] = np.where(df['occupation'].str.lower().isin(RISKY_JOBS), 1, 0.2)
+
+    df['condition_numeric'] = df['patient_condition'].map(CONDITION_MAP)
+    df['condition_score'] = _normalize_series(df['condition_numeric'], 0, 1)
+
+    df['age_score'] = _normalize_series(df['age'], 18, 100)
+    df['digital_access_score'] = (df['email'].notna() & df['phone'].notna()).astype(int)
+    df['channel_mismatch_score'] = 1 - _normalize_series(df['unique_channels'].fillna(0), 1, 5)
+    df['notification_gap_score'] = 1 - _normalize_series(df['reminder_response_count'], 0, 10)
+
+    # --- Final Behavioral Scores ---
+    df['score_price_sensitivity'] = (
+            df['short_supply_rate'].fillna(0) * 0.3 +
+            df['multiple_short_refills_rate'].fillna(0) * 0.2 +
+            (1 - df['mean_adherence_ratio'].fillna(1)) * 0.2 +
+            df['income_score'] * 0.2 +
+            df['occupation_risk'] * 0.1
+    )
+
+    df['score_awareness_gap'] = (
+            _normalize_series(df['days_since_last'].fillna(90), 0, 90) * 0.4 +
+            (1 - df['condition_score']) * 0.3 +
+            (1 - df['digital_access_score']) * 0.3
+    )
+
+    df['score_coverage_confusion'] = (
+            df['age_score'] * 0.4 +
+            (1 - df['digital_access_score']) * 0.3 +
+            df['channel_mismatch_score'] * 0.3
+    )
+
+    df['score_notification_response'] = (
+            df['notification_gap_score'] * 0.6 +
+            (1 - df['digital_access_score']) * 0.2 +
+            df['channel_mismatch_score'] * 0.2
+    )
+
+    return df
+
+
+def _score_generator_apply(patients_df: pd.DataFrame, activity_df: pd.DataFrame, income_df: pd.DataFrame=None,
+                           as_of_date=None) -> pd.DataFrame:
+    # --- Merge income info into patient table ---
+    patients = patients_df.merge(income_df, left_on='annual_income_grade', right_on='grade', how='left')
+
+    # --- Preprocess activity log ---
+    activity = _activity_as_of(activity_df, as_of_date)
     activity = activity.sort_values(['patient_id', 'time_stamp'])
 
     # Adherence ratio
@@ -51,7 +186,7 @@ def score_generator(patients_df: pd.DataFrame, activity_df: pd.DataFrame, income
     df = patients.merge(agg, left_on='id', right_on='patient_id', how='left')
 
     # Time features
-    now = pd.Timestamp.now()
+    now = pd.Timestamp(as_of_date) if as_of_date is not None else pd.Timestamp.now()
     df['days_since_last'] = (now - df['last_activity']).dt.days
     df['active_days_span'] = (df['last_activity'] - df['first_activity']).dt.days
 
@@ -109,7 +244,7 @@ def score_generator(patients_df: pd.DataFrame, activity_df: pd.DataFrame, income
 
     # 2. Awareness Gap Score
     df['score_awareness_gap'] = (
-            normalize(df['days_since_last'].fillna(90), 0, 90) * 0.4 +
+            normalize_series(df['days_since_last'].fillna(90), 0, 90) * 0.4 +
             (1 - df['condition_score']) * 0.3 +
             (1 - df['digital_access_score']) * 0.3
     )
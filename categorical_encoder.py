@@ -0,0 +1,88 @@
+import json
+import logging
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Explicit level for values a model never saw in training (H2O scores it like a missing value)
+UNSEEN_LEVEL = "__unseen__"
+
+# Running count of unseen levels per column since process start, for skew monitoring
+unseen_level_counts = Counter()
+
+
+def domains_path(model_path: str) -> str:
+    """Sidecar file holding a saved model's categorical training domains"""
+    return f"{model_path}.domains.json"
+
+
+def model_domains(model) -> dict:
+    """
+    Categorical training domains of an H2O model.
+
+    :param model: trained or loaded H2O model
+    :return: dict of {column: [levels]} for the model's categorical features
+    """
+    output = model._model_json['output']
+    features = output['names'][:-1]
+    return {name: list(domain) for name, domain in zip(features, output['domains'])
+            if domain is not None}
+
+
+def save_model_domains(model, model_path: str) -> str:
+    """Persist a model's categorical domains next to the saved model and return the file path"""
+    path = domains_path(model_path)
+    with open(path, "w") as f:
+        json.dump(model_domains(model), f)
+    return path
+
+
+def load_model_domains(model_path: str) -> dict:
+    """Read the domains sidecar of a saved model, or None when the model was saved without one"""
+    try:
+        with open(domains_path(model_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _level_key(values: pd.Series) -> pd.Series:
+    """Normalise raw values so 'female ', 'Female', 2 and 2.0 all match their training level"""
+    numeric = pd.to_numeric(values, errors='coerce')
+    integral = numeric.notna() & (numeric % 1 == 0)
+    keys = values.astype(str)
+    keys[integral] = numeric[integral].astype(np.int64).astype(str)
+    return keys.str.strip().str.lower()
+
+
+def encode_categoricals(df: pd.DataFrame, domains: dict) -> pd.DataFrame:
+    """
+    Map categorical inputs onto a model's training levels in one vectorized step per column.
+
+    Values are matched case- and whitespace-insensitively; anything that still does not match
+    becomes UNSEEN_LEVEL and is counted in unseen_level_counts. Missing values stay missing.
+
+    :param df: input rows
+    :param domains: {column: [levels]} as returned by model_domains / load_model_domains
+    :return: copy of df with categorical columns replaced by canonical level strings
+    """
+    df = df.copy()
+    for col, levels in domains.items():
+        if col not in df.columns:
+            continue
+        lookup = dict(zip(_level_key(pd.Series(levels, dtype=object)), levels))
+        missing = df[col].isna()
+        encoded = _level_key(df[col]).map(lookup)
+        unseen = encoded.isna() & ~missing
+
+        if unseen.any():
+            unseen_level_counts[col] += int(unseen.sum())
+            logger.warning(f"{int(unseen.sum())} unseen level(s) in '{col}', e.g. "
+                           f"{df.loc[unseen, col].astype(str).unique()[:5].tolist()}")
+        encoded[unseen] = UNSEEN_LEVEL
+        encoded[missing] = None
+        df[col] = encoded.astype(object)
+
+    return df
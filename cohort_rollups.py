@@ -0,0 +1,250 @@
+import configparser
+import logging
+import sqlite3
+import pandas as pd
+from reviq_helper import SWAP_BUSY_TIMEOUT_SECS, publish_df_to_sqlite
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+# Patients kept per cohort in each top-K list
+top_k = config.getint("COHORTS", "top_k", fallback=100)
+
+ROLLUP_TABLE = "cohort_rollup"
+TOP_PATIENTS_TABLE = "cohort_top_patients"
+# id, row fingerprint and cohorts of every patient the rollups were built from
+MEMBERS_TABLE = "cohort_rollup_members"
+
+COHORT_DIMENSIONS = ['state', 'occupation', 'patient_condition', 'annual_income_grade', 'gender']
+
+SCORE_COLUMNS = [
+    'adherence_score',
+    'refill_reminder_score',
+    'price_sensitivity_score',
+    'awareness_score',
+    'coverage_confusion_score'
+]
+
+QUANTILES = {'p10': 0.1, 'p25': 0.25, 'p50': 0.5, 'p75': 0.75, 'p90': 0.9}
+
+# ----------------------------------------------------------------------------------------------------
+# cohort_rollup:          one row per (dimension, cohort) with n_patients and, for every score,
+#                         <score>_mean and <score>_p10 .. <score>_p90
+# cohort_top_patients:    (dimension, cohort, score, direction, rank) -> id, value; the top_k lowest
+#                         and highest patients of every cohort on every score
+# cohort_rollup_members:  what the rollups currently reflect, used to find the changed cohorts
+# Changing COHORT_DIMENSIONS, SCORE_COLUMNS or [COHORTS] top_k needs a full rebuild:
+#   python cohort_rollups.py
+# ----------------------------------------------------------------------------------------------------
+
+
+def _cohort_values(values: pd.Series) -> pd.Series:
+    """Cohort labels as text, so income grade 2 and '2' are one cohort"""
+    return values.astype(object).where(values.notna(), 'unknown').astype(str)
+
+
+def _members(df: pd.DataFrame) -> pd.DataFrame:
+    members = pd.DataFrame({'id': df['id'].to_numpy()})
+    for dimension in COHORT_DIMENSIONS:
+        members[dimension] = _cohort_values(df[dimension]).to_numpy()
+    # Reinterpreted as signed so the fingerprint fits a SQLite INTEGER
+    members['fingerprint'] = pd.util.hash_pandas_object(
+        df[['id'] + COHORT_DIMENSIONS + SCORE_COLUMNS], index=False).to_numpy().view('int64')
+    return members
+
+
+def compute_rollups(df: pd.DataFrame, dimension: str) -> tuple:
+    """
+    Rollup rows and top-K rows of every cohort of one dimension.
+
+    :param df: patient_matrix rows (all rows of the cohorts to compute)
+    :param dimension: one of COHORT_DIMENSIONS
+    :return: (rollup rows, top-patient rows) as pd.DataFrames
+    """
+    cohorts = _cohort_values(df[dimension])
+    grouped = df[SCORE_COLUMNS].groupby(cohorts, sort=True)
+
+    rollup = grouped.size().rename('n_patients').to_frame()
+    means = grouped.mean().add_suffix('_mean')
+    for score in SCORE_COLUMNS:
+        rollup[f"{score}_mean"] = means[f"{score}_mean"]
+        quantiles = grouped[score].quantile(list(QUANTILES.values())).unstack()
+        for name, q in QUANTILES.items():
+            rollup[f"{score}_{name}"] = quantiles[q]
+    rollup = rollup.round(4).rename_axis('cohort').reset_index()
+    rollup.insert(0, 'dimension', dimension)
+
+    top_frames = []
+    for score in SCORE_COLUMNS:
+        for direction, ascending in (('lowest', True), ('highest', False)):
+            ranked = pd.DataFrame({'cohort': cohorts, 'id': df['id'], 'value': df[score]}).dropna(subset=['value'])
+            # id breaks ties so the lists are stable between refreshes
+            ranked = ranked.sort_values(['value', 'id'], ascending=[ascending, True], kind='mergesort')
+            ranked = ranked.groupby('cohort', sort=False).head(top_k)
+            ranked.insert(1, 'rank', ranked.groupby('cohort', sort=False).cumcount() + 1)
+            ranked.insert(0, 'dimension', dimension)
+            ranked.insert(2, 'score', score)
+            ranked.insert(3, 'direction', direction)
+            top_frames.append(ranked)
+    top = pd.concat(top_frames, ignore_index=True)
+    return rollup, top
+
+
+def build_cohort_rollups(df: pd.DataFrame, sqlite_db_path: str = sqlite_db_path) -> None:
+    """
+    Rebuild every rollup table from the full patient_matrix.
+
+    :param df: the full patient_matrix
+    :param sqlite_db_path: path to the SQLite database file
+    """
+    results = [compute_rollups(df, dimension) for dimension in COHORT_DIMENSIONS]
+    rollup = pd.concat([result[0] for result in results], ignore_index=True)
+    top = pd.concat([result[1] for result in results], ignore_index=True)
+
+    publish_df_to_sqlite(df=rollup, table_name=ROLLUP_TABLE, sqlite_db_path=sqlite_db_path)
+    publish_df_to_sqlite(df=top, table_name=TOP_PATIENTS_TABLE, sqlite_db_path=sqlite_db_path)
+    # Published last: if a rollup publish fails, the next refresh still sees the old members and redoes the work
+    publish_df_to_sqlite(df=_members(df), table_name=MEMBERS_TABLE, sqlite_db_path=sqlite_db_path)
+    logger.info(f"Built cohort rollups: {len(rollup)} cohort rows, {len(top)} top-patient rows")
+
+
+def _read_members(sqlite_db_path: str) -> pd.DataFrame:
+    """The members the stored rollups reflect, or None when any rollup table is missing"""
+    conn = sqlite3.connect(sqlite_db_path)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if not {ROLLUP_TABLE, TOP_PATIENTS_TABLE, MEMBERS_TABLE} <= tables:
+            return None
+        return pd.read_sql_query(f'SELECT * FROM "{MEMBERS_TABLE}"', conn)
+    finally:
+        conn.close()
+
+
+def _insert_rows(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame) -> None:
+    if df.empty:
+        return
+    column_list = ', '.join(f'"{col}"' for col in df.columns)
+    placeholders = ', '.join('?' * len(df.columns))
+    # object dtype turns numpy scalars into Python ints / floats, which sqlite3 can bind
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})', rows)
+
+
+def refresh_cohort_rollups(df: pd.DataFrame, sqlite_db_path: str = sqlite_db_path) -> dict:
+    """
+    Bring the rollup tables in line with df (the freshly published patient_matrix).
+
+    Only cohorts that gained, lost or changed a patient are recomputed, from df's rows of those
+    cohorts; their rows are replaced in one transaction, so readers see either the old or the new
+    rollups. The tables are built from scratch when they do not exist yet.
+
+    :param df: the full patient_matrix
+    :param sqlite_db_path: path to the SQLite database file
+    :return: {dimension: number of cohorts recomputed}
+    """
+    previous = _read_members(sqlite_db_path)
+    if previous is None:
+        build_cohort_rollups(df, sqlite_db_path)
+        return {dimension: df[dimension].nunique(dropna=False) for dimension in COHORT_DIMENSIONS}
+
+    members = _members(df)
+    merged = previous.merge(members, on='id', how='outer', suffixes=('_old', ''), indicator=True)
+    changed = merged[(merged['_merge'] != 'both') | (merged['fingerprint_old'] != merged['fingerprint'])]
+    if changed.empty:
+        logger.info("Cohort rollups are up to date")
+        return {dimension: 0 for dimension in COHORT_DIMENSIONS}
+
+    affected, rollup_frames, top_frames = {}, [], []
+    for dimension in COHORT_DIMENSIONS:
+        # A patient who moved cohort changes both the one they left and the one they joined
+        affected[dimension] = sorted(set(changed[f"{dimension}_old"].dropna()) | set(changed[dimension].dropna()))
+        in_affected = members[dimension].isin(affected[dimension]).to_numpy()
+        if in_affected.any():
+            rollup, top = compute_rollups(df[in_affected], dimension)
+            rollup_frames.append(rollup)
+            top_frames.append(top)
+
+    conn = sqlite3.connect(sqlite_db_path, timeout=SWAP_BUSY_TIMEOUT_SECS, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for dimension, cohorts in affected.items():
+            placeholders = ', '.join('?' * len(cohorts))
+            for table_name in (ROLLUP_TABLE, TOP_PATIENTS_TABLE):
+                conn.execute(f'DELETE FROM "{table_name}" WHERE dimension = ? AND cohort IN ({placeholders})',
+                             [dimension] + cohorts)
+        for rollup in rollup_frames:
+            _insert_rows(conn, ROLLUP_TABLE, rollup)
+        for top in top_frames:
+            _insert_rows(conn, TOP_PATIENTS_TABLE, top)
+
+        changed_ids = changed['id'].tolist()
+        conn.executemany(f'DELETE FROM "{MEMBERS_TABLE}" WHERE id = ?', [(int(i),) for i in changed_ids])
+        _insert_rows(conn, MEMBERS_TABLE, members[members['id'].isin(changed_ids)])
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    counts = {dimension: len(cohorts) for dimension, cohorts in affected.items()}
+    logger.info(f"Refreshed cohort rollups for {len(changed)} changed patient(s), cohorts recomputed: {counts}")
+    return counts
+
+
+def read_cohort_rollup(dimension: str, cohort: str = None, sqlite_db_path: str = sqlite_db_path) -> pd.DataFrame:
+    """
+    Precomputed cohort statistics.
+
+    :param dimension: one of COHORT_DIMENSIONS
+    :param cohort: a single cohort of the dimension (None: all of them)
+    :param sqlite_db_path: path to the SQLite database file
+    :return: pd.DataFrame of cohort_rollup rows
+    """
+    sql = f'SELECT * FROM "{ROLLUP_TABLE}" WHERE dimension = ?'
+    params = [dimension]
+    if cohort is not None:
+        sql += ' AND cohort = ?'
+        params.append(str(cohort))
+    conn = sqlite3.connect(sqlite_db_path)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def read_cohort_top_patients(dimension: str, score: str, direction: str, cohort: str = None, k: int = 10,
+                             sqlite_db_path: str = sqlite_db_path) -> pd.DataFrame:
+    """
+    Precomputed lowest / highest patients per cohort on one score.
+
+    :param dimension: one of COHORT_DIMENSIONS
+    :param score: one of SCORE_COLUMNS
+    :param direction: 'lowest' or 'highest'
+    :param cohort: a single cohort of the dimension (None: all of them)
+    :param k: patients per cohort, at most [COHORTS] top_k
+    :param sqlite_db_path: path to the SQLite database file
+    :return: pd.DataFrame with cohort, rank, id, value
+    """
+    sql = (f'SELECT cohort, rank, id, value FROM "{TOP_PATIENTS_TABLE}" '
+           f'WHERE dimension = ? AND score = ? AND direction = ? AND rank <= ?')
+    params = [dimension, score, direction, k]
+    if cohort is not None:
+        sql += ' AND cohort = ?'
+        params.append(str(cohort))
+    conn = sqlite3.connect(sqlite_db_path)
+    try:
+        return pd.read_sql_query(sql + ' ORDER BY cohort, rank', conn, params=params)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from reviq_helper import read_table_from_sqlite
+
+    build_cohort_rollups(read_table_from_sqlite(sqlite_db_path=sqlite_db_path, table_name="patient_matrix"))
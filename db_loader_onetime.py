@@ -1,7 +1,7 @@
 import pandas as pd
 import configparser
 import logging
-from reviq_helper import load_df_to_sqlite
+from reviq_helper import publish_df_to_sqlite, split_event_timestamps
 
 # Create a ConfigParser object
 config = configparser.ConfigParser()
@@ -33,9 +33,9 @@ def patient_dtl_loader() -> None:
 
     df_patient = pd.read_csv(f"{src_dir}/{input_patient_file_nm}")
 
-    load_df_to_sqlite(df=df_patient,
-                      table_name="patient_dtl",
-                      sqlite_db_path=sqlite_db_path)
+    publish_df_to_sqlite(df=df_patient,
+                         table_name="patient_dtl",
+                         sqlite_db_path=sqlite_db_path)
 
     logger.info(f"db load to patient_dtl done")
 
@@ -47,11 +47,23 @@ def activity_log_loader() -> None:
 
     df_activity_log = pd.read_csv(f"{src_dir}/{input_activity_log_file_nm}")
 
-    load_df_to_sqlite(df=df_activity_log,
-                      table_name="activity_log",
-                      sqlite_db_path=sqlite_db_path)
+    # Timestamps are parsed once here into the indexed integer time_stamp_epoch column;
+    # rows with a missing or unparseable time_stamp go to activity_log_quarantine
+    df_activity_log, df_quarantine = split_event_timestamps(df_activity_log, column="time_stamp")
 
-    logger.info(f"db load to patient_dtl done")
+    publish_df_to_sqlite(df=df_activity_log,
+                         table_name="activity_log",
+                         sqlite_db_path=sqlite_db_path)
+
+    publish_df_to_sqlite(df=df_quarantine,
+                         table_name="activity_log_quarantine",
+                         sqlite_db_path=sqlite_db_path)
+
+    if len(df_quarantine):
+        logger.warning(f"{len(df_quarantine)} activity_log row(s) quarantined: "
+                       f"{df_quarantine['quarantine_reason'].value_counts().to_dict()}")
+
+    logger.info(f"db load to activity_log done")
 
 
 def income_range_loader() -> None:
@@ -62,9 +74,9 @@ def income_range_loader() -> None:
 
     df_income_range = pd.read_csv(f"{src_dir}/{input_income_range_file_nm}")
 
-    load_df_to_sqlite(df=df_income_range,
-                      table_name="income_range_grade",
-                      sqlite_db_path=sqlite_db_path)
+    publish_df_to_sqlite(df=df_income_range,
+                         table_name="income_range_grade",
+                         sqlite_db_path=sqlite_db_path)
 
     logger.info(f"db load to income_range_grade done")
 
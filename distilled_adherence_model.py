@@ -0,0 +1,142 @@
+import json
+import logging
+import numpy as np
+import pandas as pd
+from categorical_encoder import encode_categoricals
+
+logger = logging.getLogger(__name__)
+
+# Raw patient attributes only: the student replaces the whole served chain (the four activity-score
+# GBMs feeding the leader), so scoring it needs no H2O round-trip at all
+STUDENT_NUMERIC_COLS = [
+    'age',
+    'no_of_dependant',
+    'annual_income_grade'
+]
+
+STUDENT_CATEGORICAL_COLS = ['gender', 'maritial_status', 'occupation', 'state', 'patient_condition']
+
+
+class DistilledAdherenceModel:
+    """
+    Compact ridge-regression student that imitates the AutoML adherence leader as served, i.e.
+    fed with the activity scores the GBMs predict from the patient's attributes.
+
+    Numeric inputs are standardised, categoricals are one-hot encoded against levels fixed at
+    fit time (unseen levels encode to all zeros), and scoring is a single matrix-vector product,
+    so a batch is scored in numpy without a JVM. The whole model serialises to a small JSON file.
+    """
+
+    def __init__(self, numeric_cols, categorical_levels, means, scales, coefficients, intercept, fidelity=None):
+        self.numeric_cols = list(numeric_cols)
+        self.categorical_levels = {col: list(levels) for col, levels in categorical_levels.items()}
+        self.means = np.asarray(means, dtype=float)
+        self.scales = np.asarray(scales, dtype=float)
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.intercept = float(intercept)
+        self.fidelity = fidelity or {}
+
+    @staticmethod
+    def _numeric_matrix(df: pd.DataFrame, numeric_cols) -> np.ndarray:
+        return np.column_stack([pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+                                for col in numeric_cols])
+
+    def _design_matrix(self, df: pd.DataFrame) -> np.ndarray:
+        numeric = (self._numeric_matrix(df, self.numeric_cols) - self.means) / self.scales
+        numeric = np.nan_to_num(numeric, nan=0.0)  # missing -> training mean
+
+        encoded = encode_categoricals(df[list(self.categorical_levels)], self.categorical_levels)
+        one_hot = []
+        for col, levels in self.categorical_levels.items():
+            codes = pd.Index(levels).get_indexer(encoded[col])  # -1 for levels not seen at fit time
+            block = np.zeros((len(df), len(levels)))
+            known = codes >= 0
+            block[np.flatnonzero(known), codes[known]] = 1.0
+            one_hot.append(block)
+
+        return np.hstack([numeric] + one_hot)
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame, teacher_predictions, numeric_cols=None, categorical_cols=None,
+            max_levels: int = 50, l2: float = 1e-3) -> "DistilledAdherenceModel":
+        """
+        Fit the student on the teacher's predictions.
+
+        :param df: training rows
+        :param teacher_predictions: leader predictions aligned with df
+        :param numeric_cols: numeric feature columns (default STUDENT_NUMERIC_COLS)
+        :param categorical_cols: categorical feature columns (default STUDENT_CATEGORICAL_COLS)
+        :param max_levels: keep only the most frequent levels per categorical column
+        :param l2: ridge penalty
+        :return: fitted DistilledAdherenceModel
+        """
+        numeric_cols = [col for col in (numeric_cols or STUDENT_NUMERIC_COLS) if col in df.columns]
+        categorical_cols = [col for col in (categorical_cols or STUDENT_CATEGORICAL_COLS) if col in df.columns]
+
+        numeric = cls._numeric_matrix(df, numeric_cols)
+        means = np.nanmean(numeric, axis=0)
+        scales = np.nanstd(numeric, axis=0)
+        scales[~(scales > 0)] = 1.0
+
+        categorical_levels = {
+            col: df[col].dropna().astype(str).value_counts().index[:max_levels].tolist()
+            for col in categorical_cols
+        }
+
+        student = cls(numeric_cols, categorical_levels, means, scales, np.zeros(0), 0.0)
+        X = student._design_matrix(df)
+        y = np.asarray(teacher_predictions, dtype=float)
+
+        # Ridge with an unpenalised intercept: centre, solve the normal equations, recover the intercept
+        x_mean = X.mean(axis=0)
+        y_mean = y.mean()
+        Xc = X - x_mean
+        gram = Xc.T @ Xc + l2 * len(y) * np.eye(X.shape[1])
+        student.coefficients = np.linalg.solve(gram, Xc.T @ (y - y_mean))
+        student.intercept = float(y_mean - x_mean @ student.coefficients)
+
+        logger.info(f"Fitted distilled adherence model with {X.shape[1]} weights on {len(y)} rows")
+        return student
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        """Score a batch of rows"""
+        missing = [col for col in self.numeric_cols + list(self.categorical_levels) if col not in df.columns]
+        if missing:
+            raise ValueError(f"Distilled adherence model needs columns {missing}")
+        return self._design_matrix(df) @ self.coefficients + self.intercept
+
+    def save(self, path: str) -> str:
+        with open(path, "w") as f:
+            json.dump({
+                'numeric_cols': self.numeric_cols,
+                'categorical_levels': self.categorical_levels,
+                'means': self.means.tolist(),
+                'scales': self.scales.tolist(),
+                'coefficients': self.coefficients.tolist(),
+                'intercept': self.intercept,
+                'fidelity': self.fidelity,
+            }, f)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "DistilledAdherenceModel":
+        with open(path) as f:
+            return cls(**json.load(f))
+
+
+def fidelity_report(student_predictions, teacher_predictions) -> dict:
+    """
+    How closely the student tracks the teacher.
+
+    :return: dict with rmse, mae, max_abs_error and r2 of student vs teacher
+    """
+    student_predictions = np.asarray(student_predictions, dtype=float)
+    teacher_predictions = np.asarray(teacher_predictions, dtype=float)
+    error = student_predictions - teacher_predictions
+    variance = np.sum((teacher_predictions - teacher_predictions.mean()) ** 2)
+    return {
+        'rmse': float(np.sqrt(np.mean(error ** 2))),
+        'mae': float(np.mean(np.abs(error))),
+        'max_abs_error': float(np.max(np.abs(error))),
+        'r2': float(1 - np.sum(error ** 2) / variance) if variance > 0 else float('nan'),
+    }
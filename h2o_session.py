@@ -0,0 +1,97 @@
+import configparser
+import logging
+import os
+import threading
+from contextlib import contextmanager
+import h2o
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+logger = logging.getLogger(__name__)
+
+max_mem_size = config.get("H2O", "max_mem_size", fallback="4G")
+nthreads = config.getint("H2O", "nthreads", fallback=-1)
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def init_h2o() -> None:
+    """
+    Start (or attach to) the H2O cluster once per process with the memory and thread
+    settings from the [H2O] section of config.ini. Safe to call from every module.
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        logger.info(f"Initializing H2O with max_mem_size={max_mem_size}, nthreads={nthreads}")
+        h2o.init(max_mem_size=max_mem_size, nthreads=nthreads)
+        _initialized = True
+
+
+def reconnect_h2o() -> None:
+    """
+    Open this process's own connection to the cluster the parent started. Call first thing in a
+    forked worker: the inherited connection's HTTP session, sockets and H2O session id belong to
+    the parent. Models and frames live in the cluster, so the parent's model handles stay valid.
+    """
+    url = h2o.connection().base_url
+    h2o.connect(url=url, verbose=False)
+    logger.info(f"Process {os.getpid()} connected to H2O at {url}")
+
+
+@contextmanager
+def h2o_frame_scope():
+    """
+    Track temporary H2OFrames and remove them from the cluster when the block exits.
+
+    Usage:
+        with h2o_frame_scope() as track:
+            frame = track(h2o.H2OFrame(df))
+            preds = track(model.predict(frame))
+            result = preds.as_data_frame()
+    """
+    frames = []
+
+    def track(frame):
+        frames.append(frame)
+        return frame
+
+    try:
+        yield track
+    finally:
+        for frame in reversed(frames):
+            try:
+                h2o.remove(frame, cascade=True)
+            except Exception as e:
+                logger.warning(f"Could not remove H2O frame {getattr(frame, 'frame_id', frame)}: {e}")
+
+
+def cluster_memory_stats() -> dict:
+    """
+    Memory usage of the H2O cluster, for health checks of long-running services.
+
+    :return: dict with per-node and total free/max memory (bytes), bytes held by stored keys
+             and the number of keys (frames, models) currently in the cluster
+    """
+    nodes = h2o.cluster().nodes
+    node_stats = [{
+        'node': node.get('h2o'),
+        'free_mem': node.get('free_mem', 0),
+        'max_mem': node.get('max_mem', 0),
+        'mem_value_size': node.get('mem_value_size', 0),
+    } for node in nodes]
+
+    total_max = sum(node['max_mem'] for node in node_stats)
+    total_free = sum(node['free_mem'] for node in node_stats)
+    return {
+        'nodes': node_stats,
+        'max_mem': total_max,
+        'free_mem': total_free,
+        'used_fraction': 1 - total_free / total_max if total_max else None,
+        'mem_value_size': sum(node['mem_value_size'] for node in node_stats),
+        'key_count': len(h2o.ls()),
+    }
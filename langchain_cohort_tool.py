@@ -0,0 +1,78 @@
+# langchain_cohort_tool.py
+from typing import Optional
+from langchain.tools import tool
+from tabulate import tabulate
+from cohort_rollups import (COHORT_DIMENSIONS, SCORE_COLUMNS, QUANTILES, top_k,
+                            read_cohort_rollup, read_cohort_top_patients)
+
+
+def _check_dimension_and_score(dimension: str, score: str) -> Optional[str]:
+    if dimension not in COHORT_DIMENSIONS:
+        return f"Unknown dimension {dimension}; use one of {COHORT_DIMENSIONS}."
+    if score not in SCORE_COLUMNS:
+        return f"Unknown score {score}; use one of {SCORE_COLUMNS}."
+    return None
+
+
+@tool
+def cohort_scores_tool(dimension: str, score: str = "adherence_score", cohort: Optional[str] = None,
+                       sort: str = "lowest", limit: int = 20) -> str:
+    """
+    Score statistics per patient cohort (patient count, mean and quantiles), precomputed from patient_matrix.
+    Use this instead of SQL for questions like "average adherence by state" or
+    "coverage confusion by condition".
+
+    Args:
+        dimension: cohort dimension: state, occupation, patient_condition, annual_income_grade or gender.
+        score: adherence_score, refill_reminder_score, price_sensitivity_score, awareness_score
+            or coverage_confusion_score.
+        cohort: a single cohort (e.g. "TX", "chronic"); omit for all cohorts of the dimension.
+        sort: "lowest" or "highest" mean first.
+        limit: number of cohorts to list.
+
+    Returns:
+        A table of cohorts with their patient count, mean and p10/p25/p50/p75/p90 of the score.
+    """
+    error = _check_dimension_and_score(dimension, score)
+    if error:
+        return error
+
+    rollup = read_cohort_rollup(dimension, cohort=cohort)
+    if rollup.empty:
+        return f"No {dimension} cohort {cohort} in the cohort rollups." if cohort else "Cohort rollups are not built yet."
+
+    columns = ['cohort', 'n_patients', f"{score}_mean"] + [f"{score}_{name}" for name in QUANTILES]
+    rollup = rollup.sort_values(f"{score}_mean", ascending=(sort != "highest"))[columns][:limit]
+    return (f"{score} by {dimension} ({len(rollup)} cohort(s)):\n" +
+            tabulate(rollup, headers='keys', tablefmt='psql', showindex=False))
+
+
+@tool
+def cohort_top_patients_tool(dimension: str, score: str = "adherence_score", direction: str = "lowest",
+                             cohort: Optional[str] = None, k: int = 10) -> str:
+    """
+    The patients with the lowest or highest score within each cohort, precomputed from patient_matrix.
+    Use this instead of SQL for questions like "worst 100 patients by occupation".
+
+    Args:
+        dimension: cohort dimension: state, occupation, patient_condition, annual_income_grade or gender.
+        score: adherence_score, refill_reminder_score, price_sensitivity_score, awareness_score
+            or coverage_confusion_score.
+        direction: "lowest" or "highest" scores.
+        cohort: a single cohort (e.g. "Nurse"); omit for every cohort of the dimension.
+        k: patients per cohort (at most the precomputed top_k, 100 by default).
+
+    Returns:
+        A table of cohort, rank, patient id and score value.
+    """
+    error = _check_dimension_and_score(dimension, score)
+    if error:
+        return error
+    if direction not in ("lowest", "highest"):
+        return 'direction must be "lowest" or "highest".'
+
+    top = read_cohort_top_patients(dimension, score, direction, cohort=cohort, k=min(k, top_k))
+    if top.empty:
+        return f"No {dimension} cohort {cohort} in the cohort rollups." if cohort else "Cohort rollups are not built yet."
+    return (f"{direction.capitalize()} {score} per {dimension} (top {min(k, top_k)}):\n" +
+            tabulate(top.rename(columns={'value': score}), headers='keys', tablefmt='psql', showindex=False))
@@ -1,13 +1,38 @@
 # langchain_predictor_tool.py
+import configparser
+import sqlite3
+from typing import Dict, List
 from langchain.tools import tool
 import pandas as pd
-from behaviour_score_generator import calculate_adherance_score
-from reviq_score_predictor import (
-    predict_refill_reminder_score,
-    predict_price_sensitivity_score,
-    predict_awareness_score,
-    predict_coverage_confusion_score
-)
+from tabulate import tabulate
+from patient_score_lookup import PatientScoreLookup
+from patient_similarity_index import find_similar_patients
+from what_if_simulator import simulate_what_if, base_patient_from_id
+from reviq_contribution_batch import CONTRIBUTIONS_TABLE, SCORE_NAMES, top_adherence_drivers
+from reviq_score_predictor import predict_all_scores
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+
+_lookups = {}
+
+
+def _lookup(table_name: str, columns=None) -> PatientScoreLookup:
+    """One long-lived indexed lookup per table, opened on first use"""
+    if table_name not in _lookups:
+        _lookups[table_name] = PatientScoreLookup(sqlite_db_path, table_name=table_name, columns=columns)
+    return _lookups[table_name]
+
+
+def _table_exists(table_name: str) -> bool:
+    conn = sqlite3.connect(sqlite_db_path)
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                            (table_name,)).fetchone() is not None
+    finally:
+        conn.close()
 
 @tool
 def predict_and_explain_adherence_tool(
@@ -54,12 +79,8 @@ def predict_and_explain_adherence_tool(
         "id": 0, "name": "", "address_line1": "", "address_line2": "", "email": "", "phone": 0
     }
 
-    df = pd.DataFrame([patient])
-    df = predict_refill_reminder_score(df)
-    df = predict_price_sensitivity_score(df)
-    df = predict_awareness_score(df)
-    df = predict_coverage_confusion_score(df)
-    df = calculate_adherance_score(df)
+    # One model snapshot for all four scores, so a hot swap mid-request cannot mix versions
+    df = predict_all_scores(pd.DataFrame([patient]))
 
     row = df.iloc[0]
     explanation = (
@@ -73,3 +94,107 @@ def predict_and_explain_adherence_tool(
     )
 
     return explanation
+
+
+@tool
+def explain_patient_scores_tool(patient_id: int, top_n: int = 3) -> str:
+    """
+    Explain which features drove an existing patient's scores, using precomputed contributions.
+
+    Args:
+        patient_id: id of the patient in patient_matrix.
+        top_n: number of top drivers to list per score.
+
+    Returns:
+        The patient's scores with the features that pushed each one up or down the most.
+    """
+    scores = _lookup("patient_matrix").get_patient(patient_id)
+    if scores is None:
+        return f"No patient with id {patient_id} in patient_matrix."
+
+    # The contribution batch may never have run; the lookup would fail creating its index
+    if CONTRIBUTIONS_TABLE in _lookups or _table_exists(CONTRIBUTIONS_TABLE):
+        contributions = _lookup(CONTRIBUTIONS_TABLE, columns='*').get_patients([patient_id])
+    else:
+        contributions = pd.DataFrame()
+    if contributions.empty:
+        return (f"Adherence score: {scores['adherence_score']}\n"
+                f"No precomputed feature contributions are available for patient {patient_id}.")
+
+    lines = [f"Adherence score: {scores['adherence_score']}"]
+    drivers = top_adherence_drivers(contributions, top_n=top_n)
+    lines.append("Main drivers of adherence (via activity scores): " +
+                 ", ".join(f"{feature} ({value:+.3f})" for feature, value in drivers.items()))
+
+    feature_cols = [col for col in contributions.columns if col not in ('id', 'score_name', 'BiasTerm')]
+    for score_name in SCORE_NAMES:
+        row = contributions.loc[contributions['score_name'] == score_name, feature_cols]
+        if row.empty:
+            continue
+        values = row.iloc[0]
+        top = values.reindex(values.abs().sort_values(ascending=False).index)[:top_n]
+        lines.append(f"{score_name.replace('_', ' ').capitalize()}: {scores[score_name]} - " +
+                     ", ".join(f"{feature} ({value:+.3f})" for feature, value in top.items()))
+
+    return "\n".join(lines)
+
+
+@tool
+def find_similar_patients_tool(patient_id: int, k: int = 5) -> str:
+    """
+    Find the existing patients most similar to a given patient, by profile and scores.
+    Use this instead of SQL for "patients like this one" questions.
+
+    Args:
+        patient_id: id of the patient in patient_matrix.
+        k: number of similar patients to return.
+
+    Returns:
+        The most similar patients with their scores, most similar first.
+    """
+    similar = find_similar_patients(patient_id, k=k)
+    if similar is None:
+        return f"No patient with id {patient_id} in patient_matrix."
+    if similar.empty:
+        return f"No similar patients found for patient {patient_id}."
+
+    lines = [f"Patients most similar to patient {patient_id}:"]
+    for row in similar.itertuples(index=False):
+        lines.append(f"id {row.id} (distance {row.distance:.3f}): adherence {row.adherence_score}, "
+                     f"refill reminder {row.refill_reminder_score}, price sensitivity {row.price_sensitivity_score}, "
+                     f"awareness {row.awareness_score}, coverage confusion {row.coverage_confusion_score}")
+    return "\n".join(lines)
+
+
+@tool
+def what_if_adherence_tool(patient_id: int, perturbations: Dict[str, List[str]], max_rows: int = 20) -> str:
+    """
+    Simulate how an existing patient's adherence would change under different attributes.
+    All variants are scored in one batch, so pass every value to compare in a single call.
+
+    Args:
+        patient_id: id of the patient in patient_matrix.
+        perturbations: feature -> list of values to try, e.g. {"annual_income_grade": ["3", "4"],
+            "no_of_dependant": ["-2"]}. On numeric features "+N"/"-N" is relative to the patient.
+            Features: age, gender, maritial_status, occupation, annual_income_grade,
+            patient_condition, no_of_dependant, state, city, zip_code.
+        max_rows: number of variants to list, largest adherence change first.
+
+    Returns:
+        A table of the variants with their predicted scores and adherence change vs the baseline.
+    """
+    base_patient = base_patient_from_id(patient_id)
+    if base_patient is None:
+        return f"No patient with id {patient_id} in patient_matrix."
+
+    try:
+        result = simulate_what_if(base_patient, perturbations)
+    except ValueError as e:
+        return str(e)
+
+    baseline, variants = result.iloc[:1], result.iloc[1:]
+    variants = variants.reindex(variants['adherence_delta'].abs().sort_values(ascending=False).index)[:max_rows]
+    table = pd.concat([baseline, variants])
+    return (f"What-if for patient {patient_id} ({len(result) - 1} variants, baseline adherence "
+            f"{baseline['adherence_score'].iloc[0]}):\n"
+            + tabulate(table, headers='keys', tablefmt='psql', showindex=False))
@@ -2,11 +2,12 @@
 import os
 import configparser
 import logging
-from langchain.agents import initialize_agent, AgentType
 from langchain.chat_models import ChatOpenAI
-from langchain_predictor_tool import predict_and_explain_adherence_tool
+from langchain_predictor_tool import (predict_and_explain_adherence_tool, explain_patient_scores_tool,
+                                      find_similar_patients_tool, what_if_adherence_tool)
+from langchain_cohort_tool import cohort_scores_tool, cohort_top_patients_tool
 from dotenv import load_dotenv
-from reviq_helper import get_sqlite_tools
+from reviq_helper import get_sqlite_tools, build_agent
 from langchain.schema import SystemMessage
 
 load_dotenv()
@@ -30,7 +31,8 @@ llm = ChatOpenAI(model="gpt-4.1",
                 openai_api_key=openai_api_key
                  )
 
-tools = [predict_and_explain_adherence_tool]
+tools = [predict_and_explain_adherence_tool, explain_patient_scores_tool, find_similar_patients_tool,
+         what_if_adherence_tool, cohort_scores_tool, cohort_top_patients_tool]
 
 # 👇 SQLite DB Tool
 sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
@@ -42,16 +44,7 @@ sql_tools = get_sqlite_tools(sqlite_db_path, llm)
 # 👇 Combine tools
 all_tools = tools + sql_tools
 
-agent = initialize_agent(
-    tools=all_tools,
-    llm=llm,
-    agent=AgentType.OPENAI_FUNCTIONS,
-    verbose=True,
-    agent_kwargs={
-        "system_message": """You are a healthcare assistant. Only answer questions related to patient behavior, 
-        medication adherence, and healthcare data. Reject any other topics."""
-    }
-)
+agent = build_agent(llm=llm, tools=all_tools)
 
 if __name__ == "__main__":
     # result = agent.run(
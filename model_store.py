@@ -0,0 +1,294 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+# Held while a manifest is read, changed and written back, so concurrent publishers don't lose versions
+MANIFEST_LOCK_FILE = ".manifest.lock"
+VERSIONS_DIR = "versions"
+
+# ----------------------------------------------------------------------------------------------------
+# Store layout (under model_saved_to_path):
+#   manifest.json                 {"active": <version>, "previous": <version>, "versions": {...}}
+#   versions/<version>/<files>    immutable once published
+# A store without manifest.json is the legacy flat layout: model files directly in the root.
+# ----------------------------------------------------------------------------------------------------
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(store_root: str) -> dict:
+    """The store manifest, or None for a legacy flat model directory"""
+    try:
+        with open(os.path.join(store_root, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(store_root: str, manifest: dict) -> None:
+    """Write the manifest atomically: readers see either the old or the new file, never a partial one"""
+    tmp_path = os.path.join(store_root, f".{MANIFEST_FILE}.{uuid.uuid4().hex}")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(store_root, MANIFEST_FILE))
+
+
+@contextmanager
+def _manifest_lock(store_root: str):
+    """Exclusive lock on the store's manifest, across processes"""
+    os.makedirs(store_root, exist_ok=True)
+    with open(os.path.join(store_root, MANIFEST_LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def version_dir(store_root: str, version: str) -> str:
+    return os.path.join(store_root, VERSIONS_DIR, version)
+
+
+def active_model_dir(store_root: str) -> str:
+    """Directory holding the active model files (the root itself for a legacy flat layout)"""
+    manifest = read_manifest(store_root)
+    if manifest is None or not manifest.get("active"):
+        return store_root
+    return version_dir(store_root, manifest["active"])
+
+
+def publish_files(store_root: str, files: dict, inherit_active: bool = True, activate: bool = True) -> str:
+    """
+    Publish model files as a new immutable version.
+
+    Files are copied into a hidden directory, checksummed, and the directory is renamed into
+    place in one step, so a version directory is always complete. The manifest is then swapped
+    atomically to point at it. The manifest lock is held throughout, so concurrent publishes
+    are serialized instead of overwriting each other's manifest entries.
+
+    :param store_root: model store root (model_saved_to_path)
+    :param files: {file name in the version: source path}
+    :param inherit_active: carry over active-version files not being replaced (e.g. publish a new
+                           distilled student without retraining the score models)
+    :param activate: make the new version active
+    :return: the new version id
+    """
+    with _manifest_lock(store_root):
+        return _publish_files(store_root, files, inherit_active, activate)
+
+
+def _publish_files(store_root: str, files: dict, inherit_active: bool, activate: bool) -> str:
+    manifest = read_manifest(store_root) or {"active": None, "previous": None, "versions": {}}
+    version = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+    os.makedirs(os.path.join(store_root, VERSIONS_DIR), exist_ok=True)
+    incoming_dir = os.path.join(store_root, VERSIONS_DIR, f".incoming-{version}")
+    os.makedirs(incoming_dir)
+
+    sources = {}
+    if inherit_active:
+        active_dir = active_model_dir(store_root)
+        if manifest["active"]:
+            inherited = manifest["versions"][manifest["active"]]["files"]
+        else:
+            # First publish over a legacy flat directory: carry over the model files sitting in the root
+            inherited = [name for name in os.listdir(store_root)
+                         if not name.startswith(".") and name not in (MANIFEST_FILE, MANIFEST_LOCK_FILE)
+                         and os.path.isfile(os.path.join(store_root, name))]
+        for name in inherited:
+            sources[name] = os.path.join(active_dir, name)
+    sources.update(files)
+
+    checksums = {}
+    for name, source in sources.items():
+        target = os.path.join(incoming_dir, name)
+        shutil.copy2(source, target)
+        checksums[name] = file_sha256(target)
+
+    os.rename(incoming_dir, version_dir(store_root, version))
+
+    manifest["versions"][version] = {"created_at": datetime.now().isoformat(), "files": checksums}
+    if activate:
+        manifest["previous"], manifest["active"] = manifest["active"], version
+    _write_manifest(store_root, manifest)
+
+    logger.info(f"Published model version {version} with {sorted(checksums)} (active: {manifest['active']})")
+    return version
+
+
+def activate_version(store_root: str, version: str) -> None:
+    """Point the manifest at an already published version"""
+    with _manifest_lock(store_root):
+        _activate_version(store_root, version)
+
+
+def _activate_version(store_root: str, version: str) -> None:
+    manifest = read_manifest(store_root)
+    if manifest is None or version not in manifest["versions"]:
+        raise ValueError(f"Unknown model version: {version}")
+    if manifest["active"] != version:
+        manifest["previous"], manifest["active"] = manifest["active"], version
+        _write_manifest(store_root, manifest)
+    logger.info(f"Active model version: {version}")
+
+
+def rollback(store_root: str) -> str:
+    """Re-activate the previously active version and return it"""
+    with _manifest_lock(store_root):
+        manifest = read_manifest(store_root)
+        if manifest is None or not manifest.get("previous"):
+            raise ValueError("No previous model version to roll back to")
+        previous = manifest["previous"]
+        _activate_version(store_root, previous)
+    return previous
+
+
+def verify_version(store_root: str, version: str, manifest: dict = None) -> None:
+    """Raise ValueError if any file of the version is missing or does not match its checksum"""
+    manifest = manifest or read_manifest(store_root)
+    for name, expected in manifest["versions"][version]["files"].items():
+        path = os.path.join(version_dir(store_root, version), name)
+        if not os.path.exists(path) or file_sha256(path) != expected:
+            raise ValueError(f"Checksum mismatch for {name} in model version {version}")
+
+
+class LoadedModels:
+    """Immutable snapshot of one model version: its directory and whatever the loader built from it"""
+
+    def __init__(self, version: str, path: str, models: dict):
+        self.version = version
+        self.path = path
+        self.models = models
+
+
+class ModelRegistry:
+    """
+    Serves the active model version and hot-swaps to a new one when the manifest changes.
+
+    Callers take a snapshot with current() and use it for the whole request, so a swap never
+    mixes versions inside a request and never drops one in flight: the old snapshot stays valid
+    until its last user lets go. A new version is verified and fully loaded before the swap;
+    if that fails the current version keeps serving. The previous snapshot is kept loaded so
+    a rollback swaps back without reloading; older snapshots are unloaded.
+
+    Versions can share loaded objects: a version published with inherit_active carries its
+    predecessor's files unchanged, and H2O registers a loaded model under the id stored in its
+    binary, so both versions hold the same cluster key. Unloading therefore goes by key, and only
+    keys no loaded snapshot still holds are freed.
+    """
+
+    def __init__(self, store_root: str, loader, check_interval_secs: float = 5.0, unloader=None,
+                 model_keys=None):
+        """
+        :param store_root: model store root
+        :param loader: function(model_dir) -> dict of loaded models for that directory
+        :param check_interval_secs: minimum time between manifest checks
+        :param unloader: function(keys) that frees loaded objects by key (e.g. removes H2O models
+                         from the cluster), called for keys no retained snapshot holds any more
+        :param model_keys: function(models) -> set of the keys loader registered; needed with unloader
+        """
+        self.store_root = store_root
+        self.loader = loader
+        self.unloader = unloader
+        self.model_keys = model_keys
+        self.check_interval_secs = check_interval_secs
+        self._lock = threading.Lock()
+        self._current = None
+        self._retained = {}
+        self._manifest_mtime = None
+        self._next_check = 0.0
+
+    def _manifest_state(self):
+        try:
+            return os.stat(os.path.join(self.store_root, MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self, manifest) -> LoadedModels:
+        if manifest is None or not manifest.get("active"):
+            return LoadedModels("legacy", self.store_root, self.loader(self.store_root))
+
+        version = manifest["active"]
+        if version in self._retained:
+            return self._retained[version]
+
+        verify_version(self.store_root, version, manifest)
+        path = version_dir(self.store_root, version)
+        logger.info(f"Loading model version {version} from {path}")
+        return LoadedModels(version, path, self.loader(path))
+
+    def refresh(self, force: bool = False) -> LoadedModels:
+        """Swap to the manifest's active version if it changed"""
+        with self._lock:
+            state = self._manifest_state()
+            if self._current is not None and not force and state == self._manifest_mtime:
+                return self._current
+
+            try:
+                loaded = self._load(read_manifest(self.store_root))
+            except Exception as e:
+                if self._current is None:
+                    raise
+                logger.error(f"Keeping model version {self._current.version}, new version failed to load: {e}")
+                self._manifest_mtime = state
+                return self._current
+
+            if self._current is None or loaded.version != self._current.version:
+                if self._current is not None:
+                    logger.info(f"Swapped model version {self._current.version} -> {loaded.version}")
+                    evicted = [snapshot for version, snapshot in self._retained.items()
+                               if version not in (loaded.version, self._current.version)]
+                    self._retained = {self._current.version: self._current}
+                    self._unload(evicted, keep=[loaded, self._current])
+                self._current = loaded
+            self._manifest_mtime = state
+            return self._current
+
+    def _unload(self, evicted: list, keep: list) -> None:
+        """Free the keys of the evicted snapshots that none of the kept snapshots holds"""
+        evicted = [snapshot for snapshot in evicted if snapshot.version != "legacy"]
+        if self.unloader is None or not evicted:
+            return
+        try:
+            in_use = set().union(*(self.model_keys(snapshot.models) for snapshot in keep))
+            keys = set().union(*(self.model_keys(snapshot.models) for snapshot in evicted)) - in_use
+            logger.info(f"Unloading model version(s) {[snapshot.version for snapshot in evicted]}: "
+                        f"{len(keys)} key(s) no longer in use")
+            if keys:
+                self.unloader(keys)
+        except Exception as e:
+            logger.warning(f"Could not unload model version(s) {[snapshot.version for snapshot in evicted]}: {e}")
+
+    def pin(self) -> None:
+        """
+        Stop checking the manifest and keep serving the current snapshot, e.g. in a forked worker
+        whose parent loads new versions and replaces the worker instead.
+        """
+        self._next_check = float('inf')
+
+    def current(self) -> LoadedModels:
+        """The active snapshot, checking the manifest at most every check_interval_secs"""
+        now = time.monotonic()
+        if self._current is None or now >= self._next_check:
+            self._next_check = now + self.check_interval_secs
+            return self.refresh()
+        return self._current
@@ -0,0 +1,133 @@
+import logging
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from behaviour_score_generator import score_generator, calculate_adherance_score
+
+logger = logging.getLogger(__name__)
+
+# Full input frames handed to forked workers. They are inherited copy-on-write when the
+# pool forks, so only the shard number travels to a worker and only its scored rows travel back.
+_shared_inputs = {}
+
+
+def patient_shard_ids(patient_ids, n_shards: int) -> np.ndarray:
+    """
+    Stable hash partition of patient ids into n_shards buckets.
+
+    Every id is hashed on its own: integral ids as int64, so that 7 and 7.0 (an id column that
+    picked up a NaN) land in the same shard on both the patient and the activity side, and
+    anything else as text. One odd id never changes the shard of the others.
+
+    :param patient_ids: array-like of patient ids
+    :param n_shards: number of shards
+    :return: np.ndarray of shard numbers aligned with patient_ids
+    """
+    ids = pd.Series(patient_ids).reset_index(drop=True)
+    numeric_ids = pd.to_numeric(ids, errors='coerce')
+    integral = (numeric_ids.notna() & (numeric_ids % 1 == 0)).to_numpy()
+
+    hashed = np.empty(len(ids), dtype=np.uint64)
+    hashed[integral] = pd.util.hash_array(numeric_ids[integral].to_numpy().astype(np.int64))
+    hashed[~integral] = pd.util.hash_array(ids[~integral].astype(str).to_numpy(dtype=object))
+    return (hashed % np.uint64(n_shards)).astype(np.int64)
+
+
+def _score_frames(patients_df, activity_df, income_df, options) -> pd.DataFrame:
+    df = score_generator(patients_df=patients_df,
+                         activity_df=activity_df,
+                         income_df=income_df,
+                         as_of_date=options['as_of_date'],
+                         windows=options['windows'])
+    if options['with_adherence']:
+        df = calculate_adherance_score(df)
+    return df
+
+
+def _score_shared_shard(shard: int) -> pd.DataFrame:
+    """Worker entry point for the fork path: slice this shard out of the inherited inputs"""
+    patient_rows = np.flatnonzero(_shared_inputs['patient_shards'] == shard)
+    activity_rows = np.flatnonzero(_shared_inputs['activity_shards'] == shard)
+
+    df = _score_frames(_shared_inputs['patients_df'].iloc[patient_rows],
+                       _shared_inputs['activity_df'].iloc[activity_rows],
+                       _shared_inputs['income_df'],
+                       _shared_inputs['options'])
+    df.index = patient_rows
+    return df
+
+
+def _score_pickled_shard(patients_df, activity_df, income_df, options, patient_rows) -> pd.DataFrame:
+    """Worker entry point where fork is unavailable: the shard frames arrive pickled"""
+    df = _score_frames(patients_df, activity_df, income_df, options)
+    df.index = patient_rows
+    return df
+
+
+def parallel_score_generator(patients_df: pd.DataFrame,
+                             activity_df: pd.DataFrame,
+                             income_df: pd.DataFrame,
+                             n_workers: int = None,
+                             as_of_date=None,
+                             windows=None,
+                             with_adherence: bool = False) -> pd.DataFrame:
+    """
+    Run score_generator (and optionally calculate_adherance_score) on a process pool.
+
+    patient_dtl and activity_log are hash-partitioned by patient id, so every patient's events
+    are scored by exactly one worker and the per-patient features are identical to a
+    single-process run. Results are returned in the row order of patients_df.
+
+    :param patients_df: patient_dtl rows
+    :param activity_df: activity_log rows
+    :param income_df: income_range_grade rows
+    :param n_workers: number of worker processes (default: all cores)
+    :param as_of_date: passed to score_generator; pinned to the parent's "now" when None
+                       so all shards measure recency against the same instant
+    :param windows: passed to score_generator
+    :param with_adherence: also compute adherence_score inside the workers
+    :return: pd.DataFrame in patients_df order
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    options = {
+        'as_of_date': as_of_date if as_of_date is not None else pd.Timestamp.now(),
+        'windows': windows,
+        'with_adherence': with_adherence,
+    }
+
+    if n_workers <= 1:
+        return _score_frames(patients_df, activity_df, income_df, options)
+
+    patient_shards = patient_shard_ids(patients_df['id'], n_workers)
+    activity_shards = patient_shard_ids(activity_df['patient_id'], n_workers)
+    logger.info(f"Scoring {len(patients_df)} patients / {len(activity_df)} events on {n_workers} shards")
+
+    if 'fork' in mp.get_all_start_methods():
+        _shared_inputs.update(patients_df=patients_df,
+                              activity_df=activity_df,
+                              income_df=income_df,
+                              patient_shards=patient_shards,
+                              activity_shards=activity_shards,
+                              options=options)
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('fork')) as pool:
+                results = list(pool.map(_score_shared_shard, range(n_workers)))
+        finally:
+            _shared_inputs.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = []
+            for shard in range(n_workers):
+                patient_rows = np.flatnonzero(patient_shards == shard)
+                activity_rows = np.flatnonzero(activity_shards == shard)
+                futures.append(pool.submit(_score_pickled_shard,
+                                           patients_df.iloc[patient_rows],
+                                           activity_df.iloc[activity_rows],
+                                           income_df,
+                                           options,
+                                           patient_rows))
+            results = [future.result() for future in futures]
+
+    return pd.concat(results).sort_index().reset_index(drop=True)
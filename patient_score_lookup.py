@@ -0,0 +1,112 @@
+import logging
+import sqlite3
+import threading
+import pandas as pd
+from reviq_helper import TABLE_INDEXES, create_indexes
+
+logger = logging.getLogger(__name__)
+
+SCORE_COLUMNS = [
+    'id',
+    'price_sensitivity_score',
+    'awareness_score',
+    'coverage_confusion_score',
+    'refill_reminder_score',
+    'adherence_score'
+]
+
+# Batched lookups always bind this many ids so every batch reuses one cached prepared statement
+ID_BATCH_SIZE = 500
+
+
+class PatientScoreLookup:
+    """
+    Point lookups of patient scores by id over an indexed patient_matrix.
+
+    The connection is kept open for the lifetime of the object and every query has a fixed
+    SQL text, so sqlite3's statement cache turns each lookup into a bind + index seek.
+    """
+
+    def __init__(self, sqlite_db_path: str, table_name: str = 'patient_matrix', columns: list = None):
+        """
+        :param sqlite_db_path: path to the SQLite database file
+        :param table_name: table holding one row per patient
+        :param columns: columns to return (default: id and all scores, '*' for every column)
+        """
+        self.table_name = table_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(sqlite_db_path, check_same_thread=False)
+
+        with self._conn:
+            create_indexes(self._conn, table_name, TABLE_INDEXES.get(table_name, ['id']))
+
+        if columns == '*':
+            columns = [row[1] for row in self._conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()]
+        self.columns = list(columns or SCORE_COLUMNS)
+
+        select_list = ', '.join(f'"{col}"' for col in self.columns)
+        self._single_sql = f'SELECT {select_list} FROM "{table_name}" WHERE id = ?'
+        placeholders = ', '.join('?' * ID_BATCH_SIZE)
+        self._batch_sql = f'SELECT {select_list} FROM "{table_name}" WHERE id IN ({placeholders})'
+        logger.info(f"PatientScoreLookup ready on {table_name} at {sqlite_db_path}")
+
+    def get_patient(self, patient_id) -> dict:
+        """
+        Fetch one patient's scores.
+
+        :param patient_id: patient id
+        :return: dict of column -> value, or None when the id is unknown
+        """
+        with self._lock:
+            row = self._conn.execute(self._single_sql, (patient_id,)).fetchone()
+        return dict(zip(self.columns, row)) if row is not None else None
+
+    def get_patients(self, patient_ids) -> pd.DataFrame:
+        """
+        Fetch scores for a list of patient ids.
+
+        :param patient_ids: iterable of patient ids
+        :return: pd.DataFrame with the rows found for those ids, in the order requested
+        """
+        patient_ids = list(dict.fromkeys(patient_ids))
+        rows = []
+        with self._lock:
+            for start in range(0, len(patient_ids), ID_BATCH_SIZE):
+                batch = patient_ids[start:start + ID_BATCH_SIZE]
+                # Pad with a repeated id so the statement text (and cached plan) never changes
+                batch = batch + [batch[-1]] * (ID_BATCH_SIZE - len(batch))
+                rows.extend(self._conn.execute(self._batch_sql, batch).fetchall())
+
+        df = pd.DataFrame(rows, columns=self.columns)
+        order = {patient_id: position for position, patient_id in enumerate(patient_ids)}
+        return df.sort_values('id', key=lambda ids: ids.map(order), kind='stable').reset_index(drop=True)
+
+    def find_patients(self, limit: int = 100, **filters) -> pd.DataFrame:
+        """
+        Fetch scores for patients matching equality filters on indexed columns.
+
+        :param limit: maximum number of rows to return
+        :param filters: column=value pairs, e.g. state='TX', patient_condition='chronic'
+        :return: pd.DataFrame of matching patients
+        """
+        indexed = {col for entry in TABLE_INDEXES.get(self.table_name, []) for col in
+                   ((entry,) if isinstance(entry, str) else entry)}
+        unknown = set(filters) - indexed
+        if unknown:
+            raise ValueError(f"Filters must be on indexed columns {sorted(indexed)}, got {sorted(unknown)}")
+
+        select_list = ', '.join(f'"{col}"' for col in self.columns)
+        where = ' AND '.join(f'"{col}" = ?' for col in sorted(filters)) or '1 = 1'
+        sql = f'SELECT {select_list} FROM "{self.table_name}" WHERE {where} LIMIT ?'
+        with self._lock:
+            rows = self._conn.execute(sql, [filters[col] for col in sorted(filters)] + [limit]).fetchall()
+        return pd.DataFrame(rows, columns=self.columns)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
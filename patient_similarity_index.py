@@ -0,0 +1,311 @@
+import configparser
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+import faiss
+import numpy as np
+import pandas as pd
+from categorical_encoder import encode_categoricals
+from patient_score_lookup import PatientScoreLookup, SCORE_COLUMNS
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+similarity_index_path = config.get("SIMILARITY", "index_path",
+                                   fallback=os.path.join(os.path.dirname(sqlite_db_path), "similar_patients.npz"))
+similarity_nprobe = config.getint("SIMILARITY", "nprobe", fallback=16)
+
+SIMILARITY_NUMERIC_COLS = [
+    'age',
+    'no_of_dependant',
+    'annual_income_grade',
+    'price_sensitivity_score',
+    'awareness_score',
+    'coverage_confusion_score',
+    'refill_reminder_score',
+    'adherence_score'
+]
+
+SIMILARITY_CATEGORICAL_COLS = ['gender', 'maritial_status', 'occupation', 'state', 'patient_condition']
+
+# Below this many patients an exact flat index is both fast enough and smaller to maintain;
+# above it vectors go into an inverted-file index with 8-bit scalar quantisation
+IVF_MIN_ROWS = 200_000
+
+# Raw categorical values remembered per column; beyond this, new values are encoded per call
+MAX_MEMO_VALUES = 10_000
+
+# Rebuild from scratch (retrain centroids and scaling) when more than this share of patients changed
+FULL_REBUILD_FRACTION = 0.5
+
+
+class PatientSimilarityIndex:
+    """
+    Nearest-neighbour index over encoded patient features and scores, keyed by patient id.
+
+    Numeric columns are standardised with the statistics of the build, categoricals are one-hot
+    encoded against the levels seen at build time, and every vector is stored under its patient
+    id. A fingerprint per patient lets update() touch only patients whose row changed.
+    """
+
+    def __init__(self, numeric_cols, categorical_levels, means, scales, index, fingerprints: pd.Series):
+        self.numeric_cols = list(numeric_cols)
+        self.categorical_levels = {col: list(levels) for col, levels in categorical_levels.items()}
+        self.means = np.asarray(means, dtype='float32')
+        self.scales = np.asarray(scales, dtype='float32')
+        self.index = index
+        self.fingerprints = fingerprints
+        self._level_codes = {col: {} for col in self.categorical_levels}
+        self._set_nprobe(similarity_nprobe)
+
+    @property
+    def feature_cols(self) -> list:
+        return self.numeric_cols + list(self.categorical_levels)
+
+    def _set_nprobe(self, nprobe: int) -> None:
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.nprobe = min(nprobe, ivf.nlist)
+
+    def encode(self, df: pd.DataFrame) -> np.ndarray:
+        """Feature matrix (float32, one row per patient) in the index's vector space"""
+        numeric = np.column_stack([pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='float32')
+                                   for col in self.numeric_cols])
+        numeric = np.nan_to_num((numeric - self.means) / self.scales, nan=0.0)  # missing -> build mean
+
+        one_hot = []
+        for col, levels in self.categorical_levels.items():
+            codes = self._category_codes(col, df[col])
+            block = np.zeros((len(df), len(levels)), dtype='float32')
+            known = codes >= 0
+            block[np.flatnonzero(known), codes[known]] = 1.0
+            one_hot.append(block)
+
+        return np.ascontiguousarray(np.hstack([numeric] + one_hot), dtype='float32')
+
+    def _category_codes(self, col: str, values: pd.Series) -> np.ndarray:
+        """
+        Level position of each value (-1 for missing or unseen). Each distinct raw value goes through
+        encode_categoricals once and is remembered, so a one-row query costs a few dict lookups.
+        """
+        memo = self._level_codes[col]
+        inverse, uniques = pd.factorize(values)
+        unknown = [value for value in uniques if value not in memo]
+        if unknown:
+            levels = self.categorical_levels[col]
+            positions = {level: position for position, level in enumerate(levels)}
+            encoded = encode_categoricals(pd.DataFrame({col: unknown}), {col: levels})[col]
+            if len(memo) < MAX_MEMO_VALUES:
+                memo.update({value: positions.get(level, -1) for value, level in zip(unknown, encoded)})
+            else:
+                memo = {**memo, **{value: positions.get(level, -1) for value, level in zip(unknown, encoded)}}
+
+        unique_codes = np.array([memo[value] for value in uniques] + [-1], dtype='int64')
+        return unique_codes[inverse]  # inverse is -1 for missing, which picks the trailing -1
+
+    def _fingerprint(self, df: pd.DataFrame) -> pd.Series:
+        hashes = pd.util.hash_pandas_object(df[self.feature_cols], index=False).to_numpy()
+        return pd.Series(hashes, index=df['id'].astype('int64').to_numpy())
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, max_levels: int = 50) -> "PatientSimilarityIndex":
+        """
+        Build the index from scratch.
+
+        :param df: patient_matrix rows (id, SIMILARITY_NUMERIC_COLS, SIMILARITY_CATEGORICAL_COLS)
+        :param max_levels: keep only the most frequent levels per categorical column
+        :return: PatientSimilarityIndex holding every row of df
+        """
+        numeric_cols = [col for col in SIMILARITY_NUMERIC_COLS if col in df.columns]
+        categorical_cols = [col for col in SIMILARITY_CATEGORICAL_COLS if col in df.columns]
+
+        numeric = np.column_stack([pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+                                   for col in numeric_cols])
+        means = np.nanmean(numeric, axis=0)
+        scales = np.nanstd(numeric, axis=0)
+        scales[~(scales > 0)] = 1.0
+
+        categorical_levels = {
+            col: df[col].dropna().astype(str).value_counts().index[:max_levels].tolist()
+            for col in categorical_cols
+        }
+
+        dimension = len(numeric_cols) + sum(len(levels) for levels in categorical_levels.values())
+        if len(df) < IVF_MIN_ROWS:
+            index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+        else:
+            nlist = min(65536, int(np.sqrt(len(df))))
+            index = faiss.IndexIVFScalarQuantizer(faiss.IndexFlatL2(dimension), dimension, nlist,
+                                                  faiss.ScalarQuantizer.QT_8bit)
+
+        similarity_index = cls(numeric_cols, categorical_levels, means, scales, index, pd.Series(dtype='uint64'))
+        vectors = similarity_index.encode(df)
+        if not index.is_trained:
+            sample = np.random.default_rng(0).choice(len(df), size=min(len(df), index.nlist * 64), replace=False)
+            index.train(vectors[np.sort(sample)])
+        index.add_with_ids(vectors, df['id'].to_numpy(dtype='int64'))
+        similarity_index.fingerprints = similarity_index._fingerprint(df)
+
+        logger.info(f"Built similarity index over {index.ntotal} patients ({type(index).__name__}, d={dimension})")
+        return similarity_index
+
+    def update(self, df: pd.DataFrame) -> dict:
+        """
+        Bring the index in line with the current patient_matrix, re-encoding only changed patients.
+
+        :param df: the full current patient_matrix
+        :return: counts of added, updated and removed patients
+        """
+        fingerprints = self._fingerprint(df)
+
+        added = ~fingerprints.index.isin(self.fingerprints.index)
+        updated = np.zeros(len(fingerprints), dtype=bool)
+        updated[~added] = (self.fingerprints.reindex(fingerprints.index[~added]).to_numpy()
+                           != fingerprints.to_numpy()[~added])
+        removed_ids = self.fingerprints.index.difference(fingerprints.index).to_numpy(dtype='int64')
+
+        changed = added | updated
+        stale_ids = np.concatenate([removed_ids, fingerprints.index.to_numpy(dtype='int64')[updated]])
+        if len(stale_ids):
+            self.index.remove_ids(stale_ids)
+        if changed.any():
+            rows = df.loc[changed]
+            self.index.add_with_ids(self.encode(rows), rows['id'].to_numpy(dtype='int64'))
+
+        self.fingerprints = fingerprints
+        counts = {'added': int(added.sum()), 'updated': int(updated.sum()), 'removed': len(removed_ids)}
+        logger.info(f"Updated similarity index: {counts}, {self.index.ntotal} patients")
+        return counts
+
+    def search(self, df: pd.DataFrame, k: int = 10, exclude_ids=None) -> pd.DataFrame:
+        """
+        Top-k most similar indexed patients for each row of df.
+
+        :param df: query rows with the index's feature columns
+        :param k: neighbours per query row
+        :param exclude_ids: patient ids never returned (e.g. the query patients themselves)
+        :return: pd.DataFrame with query_row, id, distance; nearest first within each query row
+        """
+        exclude = set() if exclude_ids is None else {int(patient_id) for patient_id in exclude_ids}
+        distances, ids = self.index.search(self.encode(df), k + len(exclude))
+
+        results = pd.DataFrame({
+            'query_row': np.repeat(np.arange(len(df)), ids.shape[1]),
+            'id': ids.ravel(),
+            'distance': distances.ravel(),
+        })
+        results = results[(results['id'] >= 0) & ~results['id'].isin(exclude)]
+        return results.groupby('query_row', sort=False).head(k).reset_index(drop=True)
+
+    def save(self, path: str) -> None:
+        """Write index, encoding and fingerprints to one file, replaced atomically"""
+        meta = {
+            'numeric_cols': self.numeric_cols,
+            'categorical_levels': self.categorical_levels,
+            'means': self.means.tolist(),
+            'scales': self.scales.tolist(),
+        }
+        buffer = io.BytesIO()
+        np.savez(buffer,
+                 index=faiss.serialize_index(self.index),
+                 meta=np.frombuffer(json.dumps(meta).encode(), dtype='uint8'),
+                 fingerprint_ids=self.fingerprints.index.to_numpy(dtype='int64'),
+                 fingerprints=self.fingerprints.to_numpy(dtype='uint64'))
+
+        tmp_path = os.path.join(os.path.dirname(os.path.abspath(path)), f".{os.path.basename(path)}.{uuid.uuid4().hex}")
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getbuffer())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        logger.info(f"Saved similarity index ({self.index.ntotal} patients) at: {path}")
+
+    @classmethod
+    def load(cls, path: str) -> "PatientSimilarityIndex":
+        with np.load(path) as data:
+            meta = json.loads(data['meta'].tobytes())
+            index = faiss.deserialize_index(data['index'])
+            fingerprints = pd.Series(data['fingerprints'], index=data['fingerprint_ids'])
+        return cls(meta['numeric_cols'], meta['categorical_levels'], meta['means'], meta['scales'],
+                   index, fingerprints)
+
+
+def refresh_similarity_index(df: pd.DataFrame, index_path: str = None) -> PatientSimilarityIndex:
+    """
+    Incrementally update the saved index to match df (the freshly loaded patient_matrix), or build
+    it when there is none yet or most patients changed.
+
+    :param df: the full patient_matrix
+    :param index_path: index file (default [SIMILARITY] index_path)
+    :return: the saved PatientSimilarityIndex
+    """
+    index_path = index_path or similarity_index_path
+    similarity_index = PatientSimilarityIndex.load(index_path) if os.path.exists(index_path) else None
+
+    if similarity_index is not None:
+        missing = [col for col in similarity_index.feature_cols if col not in df.columns]
+        if missing:
+            logger.info(f"patient_matrix no longer has {missing}, rebuilding the similarity index")
+            similarity_index = None
+
+    if similarity_index is None:
+        similarity_index = PatientSimilarityIndex.build(df)
+    else:
+        counts = similarity_index.update(df)
+        if counts['added'] + counts['updated'] > FULL_REBUILD_FRACTION * len(df):
+            similarity_index = PatientSimilarityIndex.build(df)
+
+    similarity_index.save(index_path)
+    return similarity_index
+
+
+_loaded = {}
+_load_lock = threading.Lock()
+_lookups = {}
+
+
+def load_similarity_index(index_path: str = None) -> PatientSimilarityIndex:
+    """The saved index, kept in memory and reloaded when the file is replaced"""
+    index_path = index_path or similarity_index_path
+    mtime = os.stat(index_path).st_mtime_ns
+    with _load_lock:
+        cached = _loaded.get(index_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, PatientSimilarityIndex.load(index_path))
+            _loaded[index_path] = cached
+            logger.info(f"Loaded similarity index ({cached[1].index.ntotal} patients) from {index_path}")
+    return cached[1]
+
+
+def _lookup(columns) -> PatientScoreLookup:
+    key = tuple(columns)
+    if key not in _lookups:
+        _lookups[key] = PatientScoreLookup(sqlite_db_path, table_name="patient_matrix", columns=list(columns))
+    return _lookups[key]
+
+
+def find_similar_patients(patient_id: int, k: int = 10, index_path: str = None) -> pd.DataFrame:
+    """
+    Patients most similar to an existing patient, by features and scores.
+
+    :param patient_id: id of the patient in patient_matrix
+    :param k: number of similar patients
+    :param index_path: index file (default [SIMILARITY] index_path)
+    :return: pd.DataFrame of id, distance and the SCORE_COLUMNS scores, nearest first;
+             None when the patient is unknown
+    """
+    similarity_index = load_similarity_index(index_path)
+    patient = _lookup(['id'] + similarity_index.feature_cols).get_patient(patient_id)
+    if patient is None:
+        return None
+
+    neighbours = similarity_index.search(pd.DataFrame([patient]), k=k, exclude_ids=[patient_id])
+    scores = _lookup(SCORE_COLUMNS).get_patients(neighbours['id'].tolist())
+    return neighbours[['id', 'distance']].merge(scores, on='id', how='left')
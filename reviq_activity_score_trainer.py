@@ -2,10 +2,16 @@ import h2o
 import configparser
 import logging
 import os
+import shutil
+import tempfile
 import pandas as pd
 from h2o.automl import H2OAutoML
 from reviq_helper import read_table_from_sqlite
 from h2o.estimators.gbm import H2OGradientBoostingEstimator
+from categorical_encoder import save_model_domains, domains_path
+from model_store import publish_files
+from score_drift_monitor import build_baseline, BASELINE_FILE
+from h2o_session import init_h2o
 
 # Create a ConfigParser object
 config = configparser.ConfigParser()
@@ -37,7 +43,7 @@ def train_activity_score_models(df: pd.DataFrame, target_columns, save_dir="h2o_
     :param save_dir: directory to save trained models
     :return: dict of {target_column: model_path}
     """
-    h2o.init(max_mem_size_GB=4)
+    init_h2o()
 
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
@@ -85,6 +91,9 @@ def train_activity_score_models(df: pd.DataFrame, target_columns, save_dir="h2o_
         model_path = h2o.save_model(model=gbm, path=save_dir, filename=model_name, force=True)
 
         logger.info(f"Saved GBM model for {target} at: {model_path}")
+
+        domains_file = save_model_domains(gbm, model_path)
+        logger.info(f"Saved categorical domains for {target} at: {domains_file}")
         saved_models[target] = model_path
 
     return saved_models
@@ -98,6 +107,21 @@ if __name__ == "__main__":
     training_targets = ["refill_reminder_score", "price_sensitivity_score", "awareness_score",
                         "coverage_confusion_score"]
 
-    models = train_activity_score_models(df=df_patient,
-                                         target_columns=training_targets,
-                                         save_dir=model_saved_to_path)
+    # Train into a private staging directory, then publish the files as a new immutable model version
+    staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=model_saved_to_path)
+    try:
+        models = train_activity_score_models(df=df_patient,
+                                             target_columns=training_targets,
+                                             save_dir=staging_dir)
+
+        files = {}
+        for model_path in models.values():
+            files[os.path.basename(model_path)] = model_path
+            files[os.path.basename(domains_path(model_path))] = domains_path(model_path)
+        # Score distributions of the training data, the reference the drift monitor compares against
+        files[BASELINE_FILE] = os.path.join(staging_dir, BASELINE_FILE)
+        build_baseline(df_patient, files[BASELINE_FILE])
+        version = publish_files(store_root=model_saved_to_path, files=files)
+        logger.info(f"Activity score models published as version {version}")
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
@@ -0,0 +1,118 @@
+import configparser
+import logging
+import os
+import h2o
+import pandas as pd
+from categorical_encoder import encode_categoricals, load_model_domains, model_domains
+from reviq_helper import (read_table_from_sqlite, load_df_to_sqlite, shadow_table_name,
+                          swap_in_table, TABLE_INDEXES)
+from h2o_session import init_h2o, h2o_frame_scope
+from model_store import active_model_dir
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+model_saved_to_path = config["DEFAULT"]["model_saved_to_path"]
+
+CONTRIBUTIONS_TABLE = "patient_score_contributions"
+
+SCORE_NAMES = ["refill_reminder_score", "price_sensitivity_score", "awareness_score", "coverage_confusion_score"]
+
+# Weight of each activity score in calculate_adherance_score, which uses (1 - score)
+ADHERENCE_WEIGHTS = {
+    "refill_reminder_score": 0.25,
+    "price_sensitivity_score": 0.2,
+    "awareness_score": 0.2,
+    "coverage_confusion_score": 0.15,
+}
+
+
+def compute_score_contributions(df: pd.DataFrame, model_path: str, score_name: str) -> pd.DataFrame:
+    """
+    Per-feature contributions (SHAP values) of one activity-score GBM for a batch of patients.
+
+    :param df: patient rows including id and the model's features
+    :param model_path: path to the saved H2O model
+    :param score_name: activity score the model predicts
+    :return: pd.DataFrame with id, score_name, one column per feature and BiasTerm
+    """
+    model = h2o.load_model(model_path)
+    features = model._model_json['output']['names'][:-1]
+    domains = load_model_domains(model_path) or model_domains(model)
+
+    encoded_df = encode_categoricals(df[features], domains)
+    with h2o_frame_scope() as track:
+        frame = track(h2o.H2OFrame(encoded_df, column_types={col: 'enum' for col in domains if col in features}))
+        contributions = track(model.predict_contributions(frame)).as_data_frame()
+
+    contributions.insert(0, 'score_name', score_name)
+    contributions.insert(0, 'id', df['id'].to_numpy())
+    return contributions
+
+
+def build_contributions_table(df: pd.DataFrame, chunk_size: int = 250_000) -> int:
+    """
+    Compute contributions of all four activity-score models for the whole population and store
+    them in patient_score_contributions, one row per (id, score_name), indexed on both. The
+    table is swapped in whole once every chunk is written.
+
+    :param df: patient_matrix rows
+    :param chunk_size: patients per H2O round-trip, bounds client and cluster memory
+    :return: number of rows written
+    """
+    rows_written = 0
+    model_dir = active_model_dir(model_saved_to_path)
+    # Chunks accumulate in a shadow table that replaces the live one only once it is complete
+    shadow_name = shadow_table_name(CONTRIBUTIONS_TABLE)
+    for score_name in SCORE_NAMES:
+        model_path = os.path.join(model_dir, config["MODEL_NAMES"][score_name])
+        logger.info(f"Computing contributions for {score_name} with {model_path}")
+
+        for start in range(0, len(df), chunk_size):
+            contributions = compute_score_contributions(df.iloc[start:start + chunk_size], model_path, score_name)
+            load_df_to_sqlite(df=contributions,
+                              table_name=shadow_name,
+                              sqlite_db_path=sqlite_db_path,
+                              if_exists='replace' if rows_written == 0 else 'append',
+                              index_columns=[])
+            rows_written += len(contributions)
+            logger.info(f"{CONTRIBUTIONS_TABLE}: {rows_written} rows written")
+
+    swap_in_table(sqlite_db_path, shadow_name, CONTRIBUTIONS_TABLE, index_columns=TABLE_INDEXES[CONTRIBUTIONS_TABLE])
+    return rows_written
+
+
+def top_adherence_drivers(contributions: pd.DataFrame, top_n: int = 3) -> pd.Series:
+    """
+    Combine one patient's per-score contributions into drivers of adherence_score.
+
+    adherence_score weighs each activity score as w * (1 - score), so a feature that pushes an
+    activity score up by c moves adherence by -w * c.
+
+    :param contributions: the patient's rows from patient_score_contributions
+    :param top_n: number of drivers to return
+    :return: pd.Series of feature -> contribution to adherence_score, largest magnitude first
+    """
+    feature_cols = [col for col in contributions.columns if col not in ('id', 'score_name', 'BiasTerm')]
+    weights = contributions['score_name'].map(ADHERENCE_WEIGHTS).fillna(0).to_numpy()
+    drivers = (contributions[feature_cols].mul(-weights, axis=0)).sum()
+    return drivers.reindex(drivers.abs().sort_values(ascending=False).index)[:top_n]
+
+
+if __name__ == "__main__":
+
+    init_h2o()
+
+    df_patient = read_table_from_sqlite(sqlite_db_path=sqlite_db_path, table_name="patient_matrix")
+
+    build_contributions_table(df_patient)
@@ -1,23 +1,99 @@
+import numpy as np
 import pandas as pd
 import sqlite3
 from typing import Union
 import logging
 from langchain.sql_database import SQLDatabase
 from langchain.agents.agent_toolkits import SQLDatabaseToolkit
-from langchain.agents import Tool
+from langchain.agents import Tool, initialize_agent, AgentType
+from langchain.schema import SystemMessage
 import os
+import time
+import uuid
 
 # Configure logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Indexes every load of these tables must (re)create. Each entry is a column or a tuple of columns.
+TABLE_INDEXES = {
+    'patient_matrix': ['id', 'state', 'patient_condition'],
+    'activity_log': [('patient_id', 'time_stamp_epoch'), 'time_stamp_epoch'],
+    'patient_score_contributions': [('id', 'score_name')],
+    'cohort_rollup': [('dimension', 'cohort')],
+    'cohort_top_patients': [('dimension', 'score', 'direction', 'cohort', 'rank')],
+    'cohort_rollup_members': ['id'],
+}
+
+# How long a swap waits for another writer (e.g. a concurrent load) before giving up
+SWAP_BUSY_TIMEOUT_SECS = 60
+
+# Shadow tables older than this are left over from a publish that died; younger ones may still be
+# filling (a full contributions batch takes hours) and belong to another publisher
+STALE_SHADOW_AGE_SECS = 24 * 3600
+
+
+def _is_sharded(sqlite_db_path: str, table_name: str) -> bool:
+    """Whether the table is stored in shard files instead of sqlite_db_path ([SHARDING] in config.ini)"""
+    if table_name != 'activity_log':
+        return False
+    from activity_log_shards import activity_log_is_sharded
+    return activity_log_is_sharded(sqlite_db_path, table_name)
+
+
+def create_indexes(conn: sqlite3.Connection, table_name: str, index_columns: list) -> None:
+    """
+    Create the given indexes on a table unless an index over the same columns already exists.
+
+    Parameters:
+        conn (sqlite3.Connection): Open connection to the database.
+        table_name (str): The table to index.
+        index_columns (list): Column names or tuples of column names, one entry per index.
+    """
+    table_columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()}
+    existing = set()
+    for index_row in conn.execute(f'PRAGMA index_list("{table_name}")').fetchall():
+        index_info = conn.execute(f'PRAGMA index_info("{index_row[1]}")').fetchall()
+        existing.add(tuple(info_row[2] for info_row in index_info))
+
+    for columns in index_columns:
+        columns = (columns,) if isinstance(columns, str) else tuple(columns)
+        if columns in existing:
+            continue
+        if not set(columns) <= table_columns:
+            # e.g. an activity_log loaded before time_stamp_epoch existed
+            logger.warning(f"Skipping index on {table_name}{columns}: column(s) missing")
+            continue
+        index_name = f"idx_{table_name}_{'_'.join(columns)}"
+        column_list = ', '.join(f'"{col}"' for col in columns)
+        logger.info(f"Creating index {index_name} on {table_name}({column_list})")
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list})')
+        existing.add(columns)
+
+
+def ensure_indexes(sqlite_db_path: str, table_name: str, index_columns: list = None) -> None:
+    """
+    Make sure a table carries its indexes (defaults to TABLE_INDEXES[table_name]).
+
+    Parameters:
+        sqlite_db_path (str): Path to the SQLite database file.
+        table_name (str): The table to index.
+        index_columns (list): Column names or tuples of column names, one entry per index.
+    """
+    if _is_sharded(sqlite_db_path, table_name):
+        return  # each shard file is indexed when it is written
+    index_columns = TABLE_INDEXES.get(table_name, []) if index_columns is None else index_columns
+    with sqlite3.connect(sqlite_db_path) as conn:
+        create_indexes(conn, table_name, index_columns)
+    conn.close()
 
 
 def load_df_to_sqlite(
     df: pd.DataFrame,
     table_name: str,
     sqlite_db_path: str,
-    if_exists: str = 'replace'  # Options: 'fail', 'replace', 'append'
+    if_exists: str = 'replace',  # Options: 'fail', 'replace', 'append'
+    index_columns: list = None
 ) -> None:
     """
     Load a DataFrame into a SQLite table.
@@ -28,15 +104,143 @@ def load_df_to_sqlite(
         sqlite_db_path (str): Path to the SQLite database file.
         if_exists (str): What to do if the table already exists. Options:
                          'fail', 'replace', 'append'. Default is 'replace'.
+        index_columns (list): Indexes to create after loading. Defaults to
+                              TABLE_INDEXES[table_name], since 'replace' drops them.
     """
+    if _is_sharded(sqlite_db_path, table_name):
+        from activity_log_shards import write_shards
+        write_shards(df, if_exists=if_exists)
+        return
+
+    index_columns = TABLE_INDEXES.get(table_name, []) if index_columns is None else index_columns
     logger.info(f"Connecting to SQLite DB at: {sqlite_db_path}")
     with sqlite3.connect(sqlite_db_path) as conn:
         logger.info(f"Loading DataFrame into table: {table_name}")
         df.to_sql(name=table_name, con=conn, if_exists=if_exists, index=False)
+        create_indexes(conn, table_name, index_columns)
         logger.info("DataFrame successfully loaded.")
     conn.close()
 
 
+def shadow_table_name(table_name: str) -> str:
+    """
+    Unique name under which a new version of a table is built before being swapped in. It carries
+    its creation time, so a later swap can tell a leftover shadow from one still being filled.
+    """
+    return f"{table_name}__shadow_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+
+
+def _drop_stale_shadows(conn: sqlite3.Connection, table_name: str, keep: str) -> None:
+    """
+    Drop shadow tables of table_name left behind by publishes that died before their swap: those
+    older than STALE_SHADOW_AGE_SECS, and those named before shadow names carried a creation time.
+    """
+    prefix = f"{table_name}__shadow_"
+    shadows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? ESCAPE '\\'",
+                           (prefix.replace('_', '\\_') + '%',)).fetchall()
+    cutoff = time.time() - STALE_SHADOW_AGE_SECS
+    for (name,) in shadows:
+        # Legacy names end in 8 hex digits, never a 10-digit epoch
+        created = name[len(prefix):].split('_')[0]
+        if name == keep or (created.isdigit() and len(created) > 8 and int(created) > cutoff):
+            continue
+        logger.warning(f"Dropping stale shadow table {name}")
+        conn.execute(f'DROP TABLE "{name}"')
+
+
+def _index_columns_of(conn: sqlite3.Connection, table_name: str, name_prefix: str) -> list:
+    """Column tuples of the table's indexes whose name starts with name_prefix"""
+    columns = []
+    for index_row in conn.execute(f'PRAGMA index_list("{table_name}")').fetchall():
+        if index_row[1].startswith(name_prefix):
+            index_info = conn.execute(f'PRAGMA index_info("{index_row[1]}")').fetchall()
+            columns.append((index_row[1], tuple(info_row[2] for info_row in index_info)))
+    return columns
+
+
+def swap_in_table(sqlite_db_path: str, shadow_name: str, table_name: str, index_columns: list = None) -> None:
+    """
+    Replace table_name with a fully built shadow table in one transaction.
+
+    The database is switched to WAL mode, so readers that started before the swap keep reading
+    the previous version and readers that start after it see the new one; nobody sees the
+    table missing or half written.
+
+    SQLite keeps index names through a table rename and has no index rename, so the indexes are
+    built inside the swap under the final table's names (idx_<table_name>_...). Any index the
+    shadow already had under its own name is rebuilt the same way. Readers are not blocked
+    meanwhile; other writers wait for the swap.
+
+    Parameters:
+        sqlite_db_path (str): Path to the SQLite database file.
+        shadow_name (str): The completed shadow table.
+        table_name (str): The table it replaces.
+        index_columns (list): Indexes the new table must carry. Defaults to TABLE_INDEXES[table_name].
+    """
+    index_columns = TABLE_INDEXES.get(table_name, []) if index_columns is None else index_columns
+    conn = sqlite3.connect(sqlite_db_path, isolation_level=None, timeout=SWAP_BUSY_TIMEOUT_SECS)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        _drop_stale_shadows(conn, table_name, keep=shadow_name)
+        shadow_indexes = _index_columns_of(conn, shadow_name, f"idx_{shadow_name}_")
+        for index_name, _ in shadow_indexes:
+            conn.execute(f'DROP INDEX "{index_name}"')
+        conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        conn.execute(f'ALTER TABLE "{shadow_name}" RENAME TO "{table_name}"')
+        create_indexes(conn, table_name, list(index_columns) + [columns for _, columns in shadow_indexes])
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    logger.info(f"Swapped {shadow_name} in as {table_name}")
+
+
+def publish_df_to_sqlite(
+    df: pd.DataFrame,
+    table_name: str,
+    sqlite_db_path: str,
+    index_columns: list = None
+) -> None:
+    """
+    Rebuild a table without downtime: load the DataFrame under a shadow name, then swap it in and
+    index it atomically (see swap_in_table). Unlike load_df_to_sqlite(if_exists='replace'), readers
+    keep serving the previous version for the whole rebuild.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to publish.
+        table_name (str): The table to replace.
+        sqlite_db_path (str): Path to the SQLite database file.
+        index_columns (list): Indexes to create on the new table. Defaults to TABLE_INDEXES[table_name].
+    """
+    if _is_sharded(sqlite_db_path, table_name):
+        # A new shard generation is written and swapped in, which is non-blocking in the same way
+        from activity_log_shards import write_shards
+        write_shards(df, if_exists='replace')
+        return
+
+    index_columns = TABLE_INDEXES.get(table_name, []) if index_columns is None else index_columns
+    shadow_name = shadow_table_name(table_name)
+
+    # Switching to WAL needs a moment without other connections; once set it persists in the file
+    with sqlite3.connect(sqlite_db_path, timeout=SWAP_BUSY_TIMEOUT_SECS) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    try:
+        load_df_to_sqlite(df=df, table_name=shadow_name, sqlite_db_path=sqlite_db_path,
+                          if_exists='fail', index_columns=[])
+        swap_in_table(sqlite_db_path, shadow_name, table_name, index_columns=index_columns)
+    except Exception:
+        with sqlite3.connect(sqlite_db_path, timeout=SWAP_BUSY_TIMEOUT_SECS) as conn:
+            conn.execute(f'DROP TABLE IF EXISTS "{shadow_name}"')
+        conn.close()
+        raise
+
+
 def read_table_from_sqlite(sqlite_db_path: str, table_name: str) -> pd.DataFrame:
     """
     Reads a table from a SQLite database and returns it as a pandas DataFrame.
@@ -48,6 +252,10 @@ def read_table_from_sqlite(sqlite_db_path: str, table_name: str) -> pd.DataFrame
     Returns:
         pd.DataFrame: DataFrame containing the table's contents.
     """
+    if _is_sharded(sqlite_db_path, table_name):
+        from activity_log_shards import read_shards
+        return read_shards()
+
     logger.info(f"Connecting to SQLite DB at: {sqlite_db_path}")
     # Connect to the SQLite database
     conn = sqlite3.connect(sqlite_db_path)
@@ -62,6 +270,83 @@ def read_table_from_sqlite(sqlite_db_path: str, table_name: str) -> pd.DataFrame
     return df
 
 
+# Epoch seconds parsed from the time_stamp text, for activity_log tables loaded before time_stamp_epoch
+# existed (unparseable values give NULL)
+TS_TEXT_EPOCH_SQL = "CAST(strftime('%s', time_stamp) AS INTEGER)"
+
+
+def to_epoch_seconds(value) -> int:
+    """Seconds since 1970-01-01 for a date/timestamp (naive timestamps are taken as stored, like strftime('%s'))"""
+    return int(pd.Timestamp(value).to_datetime64().astype('datetime64[s]').astype(np.int64))
+
+
+def split_event_timestamps(df: pd.DataFrame, column: str = 'time_stamp') -> tuple:
+    """
+    Parse an event-time text column once into integer epoch seconds.
+
+    Rows whose timestamp is missing or cannot be parsed are split off for quarantine instead of
+    being coerced to NaT, so downstream readers never have to parse or second-guess the column.
+
+    Args:
+        df (pd.DataFrame): Raw event rows.
+        column (str): Text timestamp column.
+
+    Returns:
+        tuple: (rows with an added '<column>_epoch' int64 column,
+                rejected rows with a 'quarantine_reason' column)
+    """
+    parsed = pd.to_datetime(df[column], errors='coerce')
+    bad = parsed.isna().to_numpy()
+
+    accepted = df[~bad].copy()
+    accepted[f"{column}_epoch"] = parsed[~bad].to_numpy().astype('datetime64[s]').astype(np.int64)
+
+    rejected = df[bad].copy()
+    rejected['quarantine_reason'] = np.where(rejected[column].isna(), f"missing {column}", f"unparseable {column}")
+    return accepted, rejected
+
+
+def read_activity_log(sqlite_db_path: str, start=None, end=None) -> pd.DataFrame:
+    """
+    Read activity_log rows whose event time falls in [start, end], using the time_stamp_epoch index.
+    A legacy table without time_stamp_epoch is filtered on its parsed time_stamp text instead (a full scan).
+
+    Args:
+        sqlite_db_path (str): Path to the SQLite database file.
+        start: Earliest event time to include (None: unbounded).
+        end: Latest event time to include (None: unbounded).
+
+    Returns:
+        pd.DataFrame: The matching activity_log rows.
+    """
+    if _is_sharded(sqlite_db_path, 'activity_log'):
+        from activity_log_shards import read_shards
+        return read_shards(start=start, end=end)
+
+    conn = sqlite3.connect(sqlite_db_path)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info("activity_log")').fetchall()}
+    ts_sql = "time_stamp_epoch" if 'time_stamp_epoch' in columns else TS_TEXT_EPOCH_SQL
+
+    conditions, params = [], {}
+    if start is not None:
+        conditions.append(f"{ts_sql} >= :start")
+        params['start'] = to_epoch_seconds(start)
+    if end is not None:
+        conditions.append(f"{ts_sql} <= :end")
+        params['end'] = to_epoch_seconds(end)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    logger.info(f"Reading activity_log{where} from {sqlite_db_path} {params}")
+    df = pd.read_sql_query(f"SELECT * FROM activity_log{where}", conn, params=params)
+    conn.close()
+    return df
+
+
+AGENT_SYSTEM_MESSAGE = """You are a healthcare assistant. Only answer questions related to patient behavior, 
+        medication adherence, and healthcare data. Reject any other topics.
+        For scores by state, occupation, condition, income grade or gender, prefer the cohort tools
+        over aggregating patient_matrix with SQL."""
+
 
 def get_sqlite_tools(db_path: str, llm) -> list:
 
@@ -69,3 +354,26 @@ def get_sqlite_tools(db_path: str, llm) -> list:
     toolkit = SQLDatabaseToolkit(db=db, llm=llm)
     return toolkit.get_tools()
 
+
+def build_agent(llm, tools: list, verbose: bool = True):
+    """
+    Build the REVIQ OpenAI-functions agent over the given tools.
+
+    Args:
+        llm: Chat model driving the agent.
+        tools (list): Tools the agent may call.
+        verbose (bool): Log the agent's intermediate steps.
+
+    Returns:
+        AgentExecutor: The agent.
+    """
+    return initialize_agent(
+        tools=tools,
+        llm=llm,
+        agent=AgentType.OPENAI_FUNCTIONS,
+        verbose=verbose,
+        agent_kwargs={
+            "system_message": SystemMessage(content=AGENT_SYSTEM_MESSAGE)
+        }
+    )
+
@@ -0,0 +1,98 @@
+import configparser
+import logging
+import os
+import shutil
+import tempfile
+import time
+import h2o
+from reviq_helper import read_table_from_sqlite
+from distilled_adherence_model import DistilledAdherenceModel, fidelity_report
+from h2o_session import init_h2o, h2o_frame_scope
+from model_store import active_model_dir, publish_files
+from reviq_score_predictor import predict_activity_scores
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+model_saved_to_path = config["DEFAULT"]["model_saved_to_path"]
+
+categorical_cols = ['gender', 'maritial_status', 'occupation', 'state', 'patient_condition']
+
+
+def distill_adherence_leader(df, leader_path: str, student_path: str, holdout_fraction: float = 0.2,
+                             seed: int = 123) -> dict:
+    """
+    Train a compact student on the AutoML leader's predictions and save it.
+
+    The leader is scored as it is served: on the activity scores the active GBMs predict for each
+    patient, not the ones stored in patient_matrix. The student learns that whole chain from the
+    patient's attributes, so serving it skips the four GBMs as well as the leader.
+
+    :param df: patient_matrix rows
+    :param leader_path: path of the saved AutoML leader
+    :param student_path: where to write the student model (JSON)
+    :param holdout_fraction: share of rows held out to measure how closely the student tracks the leader
+    :param seed: sampling seed for the holdout split
+    :return: fidelity report (student vs leader on the holdout, plus timings)
+    """
+    init_h2o()
+    leader = h2o.load_model(leader_path)
+    logger.info(f"Loaded AutoML leader {leader.model_id} from {leader_path}")
+
+    started = time.perf_counter()
+    served = predict_activity_scores(df)
+    with h2o_frame_scope() as track:
+        hf = track(h2o.H2OFrame(served))
+        for col in categorical_cols:
+            if col in df.columns:
+                hf[col] = hf[col].asfactor()
+
+        teacher = track(leader.predict(hf)).as_data_frame().iloc[:, 0].to_numpy()
+    # GBMs plus leader: what the student replaces
+    leader_secs = time.perf_counter() - started
+
+    holdout = df.sample(frac=holdout_fraction, random_state=seed).index
+    is_holdout = df.index.isin(holdout)
+
+    student = DistilledAdherenceModel.fit(df[~is_holdout], teacher[~is_holdout])
+
+    started = time.perf_counter()
+    student_predictions = student.predict(df)
+    student_secs = time.perf_counter() - started
+
+    report = fidelity_report(student_predictions[is_holdout], teacher[is_holdout])
+    report.update(leader_predict_secs=leader_secs, student_predict_secs=student_secs, rows=len(df))
+    student.fidelity = report
+    student.save(student_path)
+
+    logger.info(f"Student vs leader on holdout: {report}")
+    logger.info(f"Saved distilled adherence model at: {student_path}")
+    return report
+
+
+if __name__ == "__main__":
+
+    df_patient = read_table_from_sqlite(sqlite_db_path=sqlite_db_path, table_name="patient_matrix")
+
+    student_name = config["MODEL_NAMES"]["adherence_score_student"]
+    staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=model_saved_to_path)
+    try:
+        distill_adherence_leader(df=df_patient,
+                                 leader_path=os.path.join(active_model_dir(model_saved_to_path),
+                                                          config["MODEL_NAMES"]["adherence_score_leader"]),
+                                 student_path=os.path.join(staging_dir, student_name))
+        version = publish_files(store_root=model_saved_to_path,
+                                files={student_name: os.path.join(staging_dir, student_name)})
+        logger.info(f"Distilled adherence model published as version {version}")
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
@@ -1,8 +1,13 @@
 import configparser
 import logging
+import os
+import shutil
+import tempfile
 import h2o
 from h2o.automl import H2OAutoML
 from reviq_helper import read_table_from_sqlite
+from h2o_session import init_h2o
+from model_store import publish_files
 
 # ---------- STEP 1: Load data from SQLite ----------
 
@@ -23,6 +28,7 @@ src_dir = config["DEFAULT"]["input_file_dir"]
 input_patient_file_nm = config["DEFAULT"]["patient_file_name"]
 input_activity_log_file_nm = config["DEFAULT"]["activity_log_file_name"]
 sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+model_saved_to_path = config["DEFAULT"]["model_saved_to_path"]
 
 # ---------- STEP 1: Read patient info with score from database ----------
 
@@ -32,7 +38,7 @@ df_patient = read_table_from_sqlite(sqlite_db_path=sqlite_db_path,
 # ---- Step 3: Convert to H2OFrame ----
 # Initialize H2O cluster
 # Start H2O
-h2o.init(max_mem_size_GB=4)
+init_h2o()
 hf = h2o.H2OFrame(df_patient)
 
 # ---- Step 4: Define target and features ----
@@ -63,6 +69,13 @@ print(lb.head(rows=10))
 perf = aml.leader.model_performance(test_data=test)
 print(perf)
 
-# Optional: Save the model
-# model_path = h2o.save_model(model=aml.leader, path="best_model", force=True)
+# Publish the leader so reviq_model_distiller can train a compact student on its predictions
+staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=model_saved_to_path)
+try:
+    model_path = h2o.save_model(model=aml.leader, path=staging_dir,
+                                filename=config["MODEL_NAMES"]["adherence_score_leader"], force=True)
+    version = publish_files(store_root=model_saved_to_path, files={os.path.basename(model_path): model_path})
+    logger.info(f"Published AutoML leader {aml.leader.model_id} as model version {version}")
+finally:
+    shutil.rmtree(staging_dir, ignore_errors=True)
 
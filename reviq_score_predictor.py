@@ -3,8 +3,14 @@ import os
 import configparser
 import logging
 import pandas as pd
+from functools import lru_cache
 from tabulate import tabulate
 from behaviour_score_generator import calculate_adherance_score
+from categorical_encoder import encode_categoricals, load_model_domains, model_domains
+from distilled_adherence_model import DistilledAdherenceModel
+from h2o_session import init_h2o, h2o_frame_scope
+from model_store import ModelRegistry, LoadedModels
+from score_drift_monitor import record_scores
 
 # Create a ConfigParser object
 config = configparser.ConfigParser()
@@ -22,23 +28,56 @@ model_saved_to_path = config["DEFAULT"]["model_saved_to_path"]
 logger.info(f"model_saved_to_path: {model_saved_to_path}")
 
 # Initialize H2O (do once at start)
-h2o.init()
+init_h2o()
 
-def _predict_score(patient_input, model_path: str, score_column_name: str) -> pd.DataFrame:
+
+SCORE_NAMES = ["refill_reminder_score", "price_sensitivity_score", "awareness_score", "coverage_confusion_score"]
+
+
+def _load_score_models(model_dir: str) -> dict:
+    """Load the four activity-score models of one model version, with their training domains"""
+    models = {}
+    for score_name in SCORE_NAMES:
+        model_path = os.path.join(model_dir, config["MODEL_NAMES"][score_name])
+        model = h2o.load_model(model_path)
+        models[score_name] = {
+            'model': model,
+            'features': model._model_json['output']['names'][:-1],
+            'domains': load_model_domains(model_path) or model_domains(model),
+        }
+    return models
+
+
+def _score_model_keys(models: dict) -> set:
+    """H2O keys of one version's models (the model ids saved in their binaries)"""
+    return {entry['model'].model_id for entry in models.values()}
+
+
+def _remove_h2o_models(model_ids: set) -> None:
+    """Remove models no loaded version uses any more from the H2O cluster"""
+    for model_id in model_ids:
+        try:
+            h2o.remove(model_id)
+        except Exception as e:
+            logger.warning(f"Could not remove H2O model {model_id}: {e}")
+
+
+# Serves the active version of the model store and hot-swaps when its manifest changes
+model_registry = ModelRegistry(model_saved_to_path, loader=_load_score_models,
+                               unloader=_remove_h2o_models, model_keys=_score_model_keys,
+                               check_interval_secs=config["DEFAULT"].getfloat("model_check_interval_secs", fallback=5))
+
+
+def _predict_score(patient_input, score_name: str, score_column_name: str, models: LoadedModels = None) -> pd.DataFrame:
     """
     Predict scores using a model, and return input DataFrame with score_column_name appended.
 
     :param patient_input: pd.Series (single row) or pd.DataFrame (multiple rows)
-    :param model_path: path to the saved H2O model
+    :param score_name: which activity-score model to use
     :param score_column_name: name of the column to append with predictions
+    :param models: model snapshot to use (default: the registry's active version)
     :return: pd.DataFrame with prediction column added
     """
-    categorical_cols = [
-        'city', 'zip_code', 'state', 'gender', 'maritial_status',
-        'occupation', 'patient_condition', 'annual_income_grade',
-        'no_of_dependant'
-    ]
-
     # Convert Series to single-row DataFrame
     if isinstance(patient_input, pd.Series):
         patient_df = pd.DataFrame([patient_input])
@@ -47,52 +86,94 @@ def _predict_score(patient_input, model_path: str, score_column_name: str) -> pd
     else:
         raise TypeError("patient_input must be a pandas Series or DataFrame")
 
-    model = h2o.load_model(model_path)
-    patient_h2o = h2o.H2OFrame(patient_df)
-
-    for col in categorical_cols:
-        if col in patient_df.columns:
-            patient_h2o[col] = patient_h2o[col].asfactor()
-
-    features = model._model_json['output']['names'][:-1]
+    entry = (models or model_registry.current()).models[score_name]
+    model, features, domains = entry['model'], entry['features'], entry['domains']
     logger.info(f"Using features: {features}")
 
-    preds = model.predict(patient_h2o[features])
-    patient_df[score_column_name] = preds.as_data_frame().iloc[:, 0].round(2)
+    # Pre-encode categoricals against the training domains and upload them directly as enums
+    encoded_df = encode_categoricals(patient_df[features], domains)
+
+    # Uploaded input and predictions are removed from the cluster once the scores are pulled back
+    with h2o_frame_scope() as track:
+        patient_h2o = track(h2o.H2OFrame(encoded_df, column_types={col: 'enum' for col in domains if col in features}))
+        preds = track(model.predict(patient_h2o))
+        patient_df[score_column_name] = preds.as_data_frame().iloc[:, 0].round(2)
 
     return patient_df
 
 
 
-def predict_refill_reminder_score(patient_input) -> pd.DataFrame:
-    model_path = os.path.join(model_saved_to_path, config["MODEL_NAMES"]["refill_reminder_score"])
-    return _predict_score(patient_input, model_path, score_column_name="refill_reminder_score")
+def predict_refill_reminder_score(patient_input, models: LoadedModels = None) -> pd.DataFrame:
+    return _predict_score(patient_input, "refill_reminder_score", score_column_name="refill_reminder_score", models=models)
 
-def predict_price_sensitivity_score(patient_input) -> pd.DataFrame:
-    model_path = os.path.join(model_saved_to_path, config["MODEL_NAMES"]["price_sensitivity_score"])
-    return _predict_score(patient_input, model_path, score_column_name="price_sensitivity_score")
+def predict_price_sensitivity_score(patient_input, models: LoadedModels = None) -> pd.DataFrame:
+    return _predict_score(patient_input, "price_sensitivity_score", score_column_name="price_sensitivity_score", models=models)
 
-def predict_awareness_score(patient_input) -> pd.DataFrame:
-    model_path = os.path.join(model_saved_to_path, config["MODEL_NAMES"]["awareness_score"])
-    return _predict_score(patient_input, model_path, score_column_name="awareness_score")
+def predict_awareness_score(patient_input, models: LoadedModels = None) -> pd.DataFrame:
+    return _predict_score(patient_input, "awareness_score", score_column_name="awareness_score", models=models)
 
-def predict_coverage_confusion_score(patient_input) -> pd.DataFrame:
-    model_path = os.path.join(model_saved_to_path, config["MODEL_NAMES"]["coverage_confusion_score"])
-    return _predict_score(patient_input, model_path, score_column_name="coverage_confusion_score")
+def predict_coverage_confusion_score(patient_input, models: LoadedModels = None) -> pd.DataFrame:
+    return _predict_score(patient_input, "coverage_confusion_score", score_column_name="coverage_confusion_score", models=models)
 
 
-def predict_all_scores(patient_input: pd.DataFrame) -> pd.DataFrame:
+@lru_cache(maxsize=None)
+def _load_student(model_path: str) -> DistilledAdherenceModel:
+    return DistilledAdherenceModel.load(model_path)
+
+
+def predict_activity_scores(patient_input, models: LoadedModels = None) -> pd.DataFrame:
+    """
+    Predict the four activity scores with one model snapshot.
+
+    :param patient_input: pd.Series (single row) or pd.DataFrame (multiple rows)
+    :param models: model snapshot to use (default: the registry's active version)
+    :return: pd.DataFrame with the four activity-score columns appended
+    """
+    models = models or model_registry.current()
+    df = predict_refill_reminder_score(patient_input, models=models)
+    df = predict_price_sensitivity_score(df, models=models)
+    df = predict_awareness_score(df, models=models)
+    return predict_coverage_confusion_score(df, models=models)
+
+
+def predict_adherence_score_distilled(patient_input: pd.DataFrame, models: LoadedModels = None) -> pd.DataFrame:
+    """
+    Score adherence with the distilled student of the AutoML leader. The student reads only the
+    patient's attributes, so this is numpy only: no activity-score GBMs, no H2O round-trip.
+
+    :param patient_input: patient rows (attributes only; activity scores are not needed)
+    :param models: model snapshot whose directory holds the student (default: active version)
+    :return: pd.DataFrame with adherence_score appended
+    """
+    model_dir = (models or model_registry.current()).path
+    model_path = os.path.join(model_dir, config["MODEL_NAMES"]["adherence_score_student"])
+    df = patient_input.copy()
+    df['adherence_score'] = _load_student(model_path).predict(df).round(2)
+    return df
+
+
+def predict_all_scores(patient_input: pd.DataFrame, adherence_model: str = "formula",
+                       monitor: bool = True) -> pd.DataFrame:
     """
     Predicts all activity scores and calculates the adherence score.
 
     :param patient_input: Input patient data (single row or batch)
+    :param adherence_model: 'formula' (calculate_adherance_score) or 'distilled' (student of the AutoML leader).
+                            The four activity scores are part of the result, so the GBMs run either way;
+                            for adherence alone without H2O use predict_adherence_score_distilled
+    :param monitor: feed the scores to the 'predictor' drift monitor; pass False for synthetic
+                    inputs (what-if grids, examples) that are not real scoring traffic
     :return: DataFrame with activity and adherence scores
     """
-    df = predict_refill_reminder_score(patient_input)
-    df = predict_price_sensitivity_score(df)
-    df = predict_awareness_score(df)
-    df = predict_coverage_confusion_score(df)
-    df = calculate_adherance_score(df)
+    # One snapshot for the whole request, so a concurrent hot-swap never mixes model versions
+    models = model_registry.current()
+    df = predict_activity_scores(patient_input, models=models)
+    if adherence_model == "distilled":
+        df = predict_adherence_score_distilled(df, models=models)
+    else:
+        df = calculate_adherance_score(df)
+    if monitor:
+        record_scores(df, source="predictor", model_dir=models.path)
     return df
 
 
@@ -138,12 +219,11 @@ if __name__ == "__main__":
 
 
     # Predict scores
-    model_dir = model_saved_to_path
     refill = predict_refill_reminder_score(new_patient_df)
     price = predict_price_sensitivity_score(new_patient_df)
     aware = predict_awareness_score(new_patient_df)
     confuse = predict_coverage_confusion_score(new_patient_df)
-    all_score = predict_all_scores(new_patient_df)
+    all_score = predict_all_scores(new_patient_df, monitor=False)
 
     print(f"Refill Reminder Score: {tabulate(refill.head())}")
     print(f"Price Sensitivity Score: {tabulate(price.head())}")
@@ -0,0 +1,371 @@
+import configparser
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from model_store import active_model_dir
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+model_saved_to_path = config["DEFAULT"]["model_saved_to_path"]
+drift_state_dir = config.get("DRIFT", "state_dir",
+                             fallback=os.path.join(os.path.dirname(sqlite_db_path), "drift_state"))
+# Rows after which an observation's weight has halved; the sketch tracks the recent distribution
+half_life_rows = config.getfloat("DRIFT", "half_life_rows", fallback=50_000)
+psi_threshold = config.getfloat("DRIFT", "psi_threshold", fallback=0.2)
+ks_threshold = config.getfloat("DRIFT", "ks_threshold", fallback=0.1)
+flush_interval_secs = config.getfloat("DRIFT", "flush_interval_secs", fallback=30)
+
+MONITORED_SCORES = [
+    'price_sensitivity_score',
+    'awareness_score',
+    'coverage_confusion_score',
+    'refill_reminder_score',
+    'adherence_score'
+]
+
+BASELINE_FILE = "score_baseline.json"
+
+# Scores live in [0, 1] and are rounded to 2 decimals, so 100 equal bins resolve every value
+N_BINS = 100
+SCORE_RANGE = (0.0, 1.0)
+
+# Floor for empty bins in PSI, which is undefined for a zero proportion
+PSI_EPSILON = 1e-4
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+# Set in forked scoring workers so each one keeps its own state file (see use_worker_state)
+_state_suffix = ""
+
+
+class ScoreSketch:
+    """
+    Fixed-size, mergeable summary of one score's distribution.
+
+    Counts go into N_BINS equal bins over SCORE_RANGE plus an underflow and an overflow bin, with
+    running moments and extremes. Memory is constant however many rows are added. Quantiles are
+    interpolated within a bin, so they are exact to 1 / N_BINS. With decay < 1 every new row
+    scales the existing weight by decay, so the sketch follows the recent distribution without
+    keeping any history.
+    """
+
+    def __init__(self, counts=None, total=0.0, weighted_sum=0.0, weighted_sq_sum=0.0, missing=0.0,
+                 minimum=None, maximum=None, rows_seen=0):
+        self.counts = np.zeros(N_BINS + 2) if counts is None else np.asarray(counts, dtype=float)
+        self.total = float(total)
+        self.weighted_sum = float(weighted_sum)
+        self.weighted_sq_sum = float(weighted_sq_sum)
+        self.missing = float(missing)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.rows_seen = int(rows_seen)
+
+    @staticmethod
+    def _bin_index(values: np.ndarray) -> np.ndarray:
+        low, high = SCORE_RANGE
+        # The nudge keeps 2-decimal scores off float bin edges (0.29 * 100 == 28.999999999999996)
+        index = np.floor((values - low) / (high - low) * N_BINS + 1e-9).astype(np.int64) + 1
+        index[values == high] = N_BINS  # the top edge belongs to the last regular bin
+        return np.clip(index, 0, N_BINS + 1)
+
+    def update(self, values, decay: float = 1.0) -> None:
+        values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+        present = values[~np.isnan(values)]
+        n = len(values)
+        if n == 0:
+            return
+
+        if decay < 1.0:
+            # Row i of this batch ends up with weight decay ** (n - 1 - i); older weight shrinks by decay ** n
+            shrink = decay ** n
+            self.counts *= shrink
+            self.total *= shrink
+            self.weighted_sum *= shrink
+            self.weighted_sq_sum *= shrink
+            self.missing *= shrink
+            weights = decay ** np.arange(n - 1, -1, -1, dtype=float)
+        else:
+            weights = np.ones(n)
+
+        present_weights = weights[~np.isnan(values)]
+        np.add.at(self.counts, self._bin_index(present), present_weights)
+        self.total += present_weights.sum()
+        self.weighted_sum += (present * present_weights).sum()
+        self.weighted_sq_sum += (present * present * present_weights).sum()
+        self.missing += weights[np.isnan(values)].sum()
+        if len(present):
+            self.minimum = float(present.min()) if self.minimum is None else min(self.minimum, float(present.min()))
+            self.maximum = float(present.max()) if self.maximum is None else max(self.maximum, float(present.max()))
+        self.rows_seen += n
+
+    def merge(self, other: "ScoreSketch") -> "ScoreSketch":
+        extremes = [value for value in (self.minimum, other.minimum) if value is not None]
+        peaks = [value for value in (self.maximum, other.maximum) if value is not None]
+        return ScoreSketch(self.counts + other.counts, self.total + other.total,
+                           self.weighted_sum + other.weighted_sum, self.weighted_sq_sum + other.weighted_sq_sum,
+                           self.missing + other.missing, min(extremes) if extremes else None,
+                           max(peaks) if peaks else None, self.rows_seen + other.rows_seen)
+
+    def proportions(self) -> np.ndarray:
+        return self.counts / self.total if self.total > 0 else np.zeros_like(self.counts)
+
+    def mean(self) -> float:
+        return self.weighted_sum / self.total if self.total > 0 else float('nan')
+
+    def std(self) -> float:
+        if self.total <= 0:
+            return float('nan')
+        return float(np.sqrt(max(self.weighted_sq_sum / self.total - self.mean() ** 2, 0.0)))
+
+    def quantile(self, q: float) -> float:
+        """Approximate q-quantile, interpolated linearly inside the bin that crosses q"""
+        if self.total <= 0:
+            return float('nan')
+        cumulative = np.cumsum(self.counts)
+        target = q * self.total
+        index = int(np.searchsorted(cumulative, target, side='left'))
+        if index == 0:
+            return self.minimum
+        if index == N_BINS + 1:
+            return self.maximum
+        low, high = SCORE_RANGE
+        width = (high - low) / N_BINS
+        below = cumulative[index - 1]
+        fraction = (target - below) / self.counts[index] if self.counts[index] > 0 else 0.0
+        return low + (index - 1 + fraction) * width
+
+    def to_dict(self) -> dict:
+        return {
+            'counts': self.counts.tolist(), 'total': self.total, 'weighted_sum': self.weighted_sum,
+            'weighted_sq_sum': self.weighted_sq_sum, 'missing': self.missing,
+            'minimum': self.minimum, 'maximum': self.maximum, 'rows_seen': self.rows_seen,
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "ScoreSketch":
+        return cls(**state)
+
+
+def population_stability_index(expected: ScoreSketch, actual: ScoreSketch) -> float:
+    """PSI between two sketches over their shared bins (0.1: minor shift, 0.2+: significant shift)"""
+    p = np.maximum(expected.proportions(), PSI_EPSILON)
+    q = np.maximum(actual.proportions(), PSI_EPSILON)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def ks_statistic(expected: ScoreSketch, actual: ScoreSketch) -> float:
+    """Kolmogorov-Smirnov distance: largest gap between the two binned CDFs"""
+    return float(np.max(np.abs(np.cumsum(expected.proportions()) - np.cumsum(actual.proportions()))))
+
+
+def build_baseline(df: pd.DataFrame, path: str) -> dict:
+    """
+    Sketch the training data's score distributions and save them as the drift baseline.
+
+    :param df: the patient_matrix rows the models are trained on
+    :param path: where to write the baseline (published next to the models as BASELINE_FILE)
+    :return: {score: ScoreSketch}
+    """
+    baseline = {}
+    for score in MONITORED_SCORES:
+        if score in df.columns:
+            baseline[score] = ScoreSketch()
+            baseline[score].update(df[score])
+    with open(path, 'w') as f:
+        json.dump({score: sketch.to_dict() for score, sketch in baseline.items()}, f)
+    logger.info(f"Saved score drift baseline over {len(df)} rows at: {path}")
+    return baseline
+
+
+def load_baseline(path: str) -> dict:
+    """The baseline sketches saved by build_baseline, or None when there is no baseline"""
+    try:
+        with open(path) as f:
+            return {score: ScoreSketch.from_dict(state) for score, state in json.load(f).items()}
+    except FileNotFoundError:
+        return None
+
+
+class DriftMonitor:
+    """
+    Streaming drift monitor for the score columns of one source (e.g. 'patient_matrix', 'predictor').
+
+    update() folds a batch into decaying sketches in O(rows) time and constant memory, or, for a
+    snapshot of the whole population (a full patient_matrix), replaces them with its unweighted
+    distribution: decaying per row would weight the snapshot by row order. State is
+    written to state_dir at most every flush_interval_secs, so successive runs carry on from it
+    rather than rescanning history. report() compares the sketches with the training baseline.
+    """
+
+    def __init__(self, source: str, baseline_path: str, state_dir: str = None, decay: float = None,
+                 state_suffix: str = ""):
+        """
+        :param source: name of the monitored stream, one state file per source
+        :param baseline_path: baseline written at training time (score_baseline.json of a model version)
+        :param state_dir: where the sketches persist (default [DRIFT] state_dir)
+        :param decay: per-row weight decay (default from [DRIFT] half_life_rows)
+        :param state_suffix: distinguishes the state files of processes monitoring the same source
+        """
+        self.source = source
+        self.baseline_path = baseline_path
+        self.state_path = os.path.join(state_dir or drift_state_dir, f"drift_state_{source}{state_suffix}.json")
+        self.decay = decay if decay is not None else 0.5 ** (1.0 / half_life_rows)
+        self._lock = threading.Lock()
+        self._next_flush = 0.0
+        self._dirty = False
+
+        self.sketches = {score: ScoreSketch() for score in MONITORED_SCORES}
+        try:
+            with open(self.state_path) as f:
+                for score, state in json.load(f).items():
+                    self.sketches[score] = ScoreSketch.from_dict(state)
+        except FileNotFoundError:
+            pass
+
+    def update(self, df: pd.DataFrame, snapshot: bool = False) -> None:
+        """
+        Fold one batch of scored rows into the sketches.
+
+        :param df: scored rows
+        :param snapshot: df is the whole population; the sketches are rebuilt from it with equal weights
+        """
+        with self._lock:
+            for score in MONITORED_SCORES:
+                if score in df.columns:
+                    if snapshot:
+                        self.sketches[score] = ScoreSketch()
+                        self.sketches[score].update(df[score])
+                    else:
+                        self.sketches[score].update(df[score], decay=self.decay)
+            self._dirty = True
+            if time.monotonic() >= self._next_flush:
+                self._flush()
+
+    def _flush(self) -> None:
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.{uuid.uuid4().hex}"
+        with open(tmp_path, 'w') as f:
+            json.dump({score: sketch.to_dict() for score, sketch in self.sketches.items()}, f)
+        os.replace(tmp_path, self.state_path)
+        self._next_flush = time.monotonic() + flush_interval_secs
+        self._dirty = False
+
+        report = self.report()
+        drifted = report[report['drifted']]
+        if not drifted.empty:
+            logger.warning(f"Score drift on {self.source}: " + ", ".join(
+                f"{row.score} (PSI {row.psi:.3f}, KS {row.ks:.3f})" for row in drifted.itertuples()))
+
+    def flush(self) -> None:
+        """Persist the sketches now (e.g. at the end of a batch job)"""
+        with self._lock:
+            if self._dirty:
+                self._flush()
+
+    def report(self) -> pd.DataFrame:
+        """
+        Current drift of every monitored score against the training baseline.
+
+        :return: pd.DataFrame with score, rows_seen, psi, ks, baseline and current mean / median / p90,
+                 and drifted (PSI or KS above the [DRIFT] thresholds)
+        """
+        baseline = load_baseline(self.baseline_path) or {}
+        rows = []
+        for score in MONITORED_SCORES:
+            current, expected = self.sketches[score], baseline.get(score)
+            if expected is None or current.total <= 0:
+                psi = ks = float('nan')
+            else:
+                psi, ks = population_stability_index(expected, current), ks_statistic(expected, current)
+            rows.append({
+                'score': score,
+                'rows_seen': current.rows_seen,
+                'psi': psi,
+                'ks': ks,
+                'baseline_mean': expected.mean() if expected else float('nan'),
+                'current_mean': current.mean(),
+                'baseline_p50': expected.quantile(0.5) if expected else float('nan'),
+                'current_p50': current.quantile(0.5),
+                'baseline_p90': expected.quantile(0.9) if expected else float('nan'),
+                'current_p90': current.quantile(0.9),
+            })
+        report = pd.DataFrame(rows)
+        report['drifted'] = (report['psi'] > psi_threshold) | (report['ks'] > ks_threshold)
+        return report
+
+
+def record_scores(df: pd.DataFrame, source: str, model_dir: str = None, snapshot: bool = False) -> None:
+    """
+    Fold a batch of scores into the drift monitor of source. Never raises: drift monitoring
+    must not fail the write or prediction it observes.
+
+    :param df: scored rows (any of MONITORED_SCORES that are present are tracked)
+    :param source: 'patient_matrix' for loader writes, 'predictor' for predict_all_scores results
+    :param model_dir: model version whose baseline to compare with (default: the active version)
+    :param snapshot: df is the full population (e.g. the whole patient_matrix) rather than a batch
+                     of a stream; it replaces the sketches instead of being decayed into them
+    """
+    try:
+        with _monitors_lock:
+            if source not in _monitors:
+                _monitors[source] = DriftMonitor(source, baseline_path=None, state_suffix=_state_suffix)
+            monitor = _monitors[source]
+        monitor.baseline_path = os.path.join(model_dir or active_model_dir(model_saved_to_path), BASELINE_FILE)
+        monitor.update(df, snapshot=snapshot)
+    except Exception as e:
+        logger.warning(f"Score drift monitor update for {source} failed: {e}")
+
+
+def flush_monitors() -> None:
+    """Persist every monitor's pending state (call at the end of a batch job)"""
+    for monitor in list(_monitors.values()):
+        monitor.flush()
+
+
+def use_worker_state(worker_id: int) -> None:
+    """
+    Give this process its own state files, for forked workers that would otherwise overwrite each
+    other's. Worker ids are reused across restarts, so a replacement worker carries on from its
+    predecessor's sketches; drift_report merges the files of all workers.
+    """
+    global _state_suffix
+    with _monitors_lock:
+        _state_suffix = f".w{worker_id}"
+        _monitors.clear()
+
+
+def drift_report(source: str, model_dir: str = None, state_dir: str = None) -> pd.DataFrame:
+    """
+    Drift report of source from its persisted state, e.g. for another process or a scheduled check.
+
+    :param source: monitored stream name
+    :param model_dir: model version whose baseline to compare with (default: the active version)
+    :param state_dir: where the sketches persist (default [DRIFT] state_dir)
+    :return: pd.DataFrame as returned by DriftMonitor.report
+    """
+    baseline_path = os.path.join(model_dir or active_model_dir(model_saved_to_path), BASELINE_FILE)
+    monitor = DriftMonitor(source, baseline_path, state_dir=state_dir)
+    for path in sorted(glob.glob(os.path.join(state_dir or drift_state_dir, f"drift_state_{source}.w*.json"))):
+        with open(path) as f:
+            for score, state in json.load(f).items():
+                monitor.sketches[score] = monitor.sketches[score].merge(ScoreSketch.from_dict(state))
+    return monitor.report()
+
+
+if __name__ == "__main__":
+    from tabulate import tabulate
+
+    for source in ("patient_matrix", "predictor"):
+        print(f"Score drift for {source}:")
+        print(tabulate(drift_report(source), headers='keys', tablefmt='psql', showindex=False))
@@ -0,0 +1,421 @@
+import argparse
+import configparser
+import gc
+import json
+import logging
+import os
+import re
+import selectors
+import signal
+import sqlite3
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+import h2o
+import numpy as np
+import pandas as pd
+from h2o_session import reconnect_h2o
+from patient_similarity_index import find_similar_patients, load_similarity_index, similarity_index_path
+from reviq_helper import read_table_from_sqlite
+from reviq_score_predictor import model_registry, predict_adherence_score_distilled, predict_all_scores, _load_student
+from score_drift_monitor import record_scores, use_worker_state, flush_monitors
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+server_host = config.get("SERVER", "host", fallback="127.0.0.1")
+server_port = config.getint("SERVER", "port", fallback=8088)
+# 0: one worker per CPU core
+server_workers = config.getint("SERVER", "workers", fallback=0)
+# How long a stopping worker may finish its request before it is killed
+worker_stop_timeout_secs = config.getfloat("SERVER", "worker_stop_timeout_secs", fallback=30)
+model_check_interval_secs = config["DEFAULT"].getfloat("model_check_interval_secs", fallback=5)
+
+SCORE_COLUMNS = [
+    'price_sensitivity_score',
+    'awareness_score',
+    'coverage_confusion_score',
+    'refill_reminder_score',
+    'adherence_score'
+]
+
+# How often an idle worker wakes up to check whether it was asked to stop
+WORKER_POLL_SECS = 0.5
+
+# A worker that dies sooner than this after starting counts as a failed start; its restarts back
+# off exponentially up to MAX_RESPAWN_DELAY_SECS so e.g. an unreachable H2O cluster is not hammered
+MIN_WORKER_UPTIME_SECS = 10
+MAX_RESPAWN_DELAY_SECS = 60
+
+# Signals whose handlers differ between parent and worker; blocked across fork() so the child can
+# never run the parent's handlers before it has installed its own
+SUPERVISOR_SIGNALS = {signal.SIGTERM, signal.SIGINT, signal.SIGHUP}
+
+# ----------------------------------------------------------------------------------------------------
+# Prefork layout:
+#   parent   binds the listening socket, starts H2O and loads the active model version (into the
+#            H2O cluster), its categorical domains, the distilled student and the reference tables,
+#            then gc.freeze()s and forks the workers. It only supervises afterwards: respawns dead
+#            workers and, when the model store activates a new version, patient_matrix is
+#            republished (a shadow-table swap) or on SIGHUP, reloads and replaces the workers one
+#            at a time. In-place UPDATEs of patient_matrix are not noticed; send SIGHUP after them.
+#   workers  accept on the shared socket, open their own H2O connection and serve requests from
+#            the parent's copy-on-write memory; they never load models themselves.
+# ----------------------------------------------------------------------------------------------------
+
+
+class ReferenceScores:
+    """
+    Scores of every patient in patient_matrix, held in plain numpy arrays.
+
+    Numeric array buffers carry no per-element Python objects, so reads never touch their pages
+    and forked workers keep sharing the parent's copy instead of faulting in their own.
+    A snapshot: the supervisor reloads it when patient_matrix is republished (see run()).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        order = np.argsort(df['id'].to_numpy(dtype=np.int64), kind='stable')
+        self.ids = df['id'].to_numpy(dtype=np.int64)[order]
+        self.scores = df[SCORE_COLUMNS].to_numpy(dtype=np.float64)[order]
+
+    def get(self, patient_id: int) -> dict:
+        """The patient's scores, or None when the id is unknown"""
+        position = int(np.searchsorted(self.ids, patient_id))
+        if position == len(self.ids) or self.ids[position] != patient_id:
+            return None
+        values = self.scores[position]
+        return {'id': int(patient_id), **{col: (None if np.isnan(value) else float(value))
+                                          for col, value in zip(SCORE_COLUMNS, values)}}
+
+
+class ScoringHTTPServer(HTTPServer):
+    """HTTP server whose listening socket is shared by the forked workers"""
+
+    def __init__(self, address, reference_scores: ReferenceScores = None):
+        super().__init__(address, ScoringRequestHandler)
+        # Non-blocking, so a worker that loses the race for a connection goes back to polling
+        # instead of blocking in accept() while it should be stopping
+        self.socket.setblocking(False)
+        self.reference_scores = reference_scores
+        self.worker_id = None
+        self.stopping = False
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes:
+        GET  /health                        worker id, pid and model version
+        POST /score                         {"patients": [{...}, ...], "adherence_model": "formula"}
+        POST /adherence                     {"patients": [{...}, ...]}: distilled adherence only, no H2O
+        GET  /patients/<id>                 stored scores of a patient
+        GET  /patients/<id>/similar?k=10    most similar patients
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == '/health':
+                self._send_json(200, {'worker': self.server.worker_id, 'pid': os.getpid(),
+                                      'model_version': model_registry.current().version})
+                return
+
+            match = re.fullmatch(r'/patients/(\d+)(/similar)?', url.path)
+            if match is None:
+                self._send_json(404, {'error': f"Unknown path {url.path}"})
+                return
+
+            patient_id = int(match.group(1))
+            if match.group(2):
+                k = int(parse_qs(url.query).get('k', ['10'])[0])
+                similar = find_similar_patients(patient_id, k=k)
+                if similar is None:
+                    self._send_json(404, {'error': f"No patient with id {patient_id}"})
+                else:
+                    self._send_json(200, {'id': patient_id, 'similar': json.loads(similar.to_json(orient='records'))})
+                return
+
+            scores = self.server.reference_scores.get(patient_id) if self.server.reference_scores else None
+            if scores is None:
+                self._send_json(404, {'error': f"No patient with id {patient_id}"})
+            else:
+                self._send_json(200, scores)
+        except Exception as e:
+            logger.exception(f"GET {self.path} failed")
+            self._send_json(500, {'error': str(e)})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path not in ('/score', '/adherence'):
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            patients = pd.DataFrame(request.get('patients', []))
+            if patients.empty:
+                self._send_json(400, {'error': "Expected a non-empty 'patients' list"})
+                return
+            models = model_registry.current()
+            if path == '/adherence':
+                scored = predict_adherence_score_distilled(patients, models=models)
+                scored = scored[[col for col in ('id', 'adherence_score') if col in scored.columns]]
+                record_scores(scored, source="predictor", model_dir=models.path)
+            else:
+                scored = predict_all_scores(patients, adherence_model=request.get('adherence_model', 'formula'))
+            self._send_json(200, {'model_version': models.version,
+                                  'scores': json.loads(scored.to_json(orient='records'))})
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            logger.exception("POST /score failed")
+            self._send_json(500, {'error': str(e)})
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(f"worker {self.server.worker_id}: {self.address_string()} {format % args}")
+
+
+def load_shared_state(server: ScoringHTTPServer) -> str:
+    """
+    Load everything the workers read into this (the parent) process before forking.
+
+    :param server: the server whose reference tables to (re)load
+    :return: the model version now loaded
+    """
+    snapshot = model_registry.refresh()
+    student_path = os.path.join(snapshot.path, config["MODEL_NAMES"]["adherence_score_student"])
+    if os.path.exists(student_path):
+        _load_student(student_path)
+    if os.path.exists(similarity_index_path):
+        load_similarity_index()
+
+    patient_matrix = read_table_from_sqlite(sqlite_db_path=sqlite_db_path, table_name="patient_matrix")
+    server.reference_scores = ReferenceScores(patient_matrix)
+    del patient_matrix
+
+    # Objects loaded so far are never freed, so keep the collector from touching (and copying) their pages
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Loaded model version {snapshot.version} and {len(server.reference_scores.ids)} patients' scores")
+    return snapshot.version
+
+
+def patient_matrix_signature(sqlite_db_path: str = sqlite_db_path) -> tuple:
+    """
+    Cheap fingerprint of the published patient_matrix: a shadow-table swap gives the table a new
+    root page and a full reload new rowids, so either changes the signature.
+    """
+    conn = sqlite3.connect(sqlite_db_path)
+    try:
+        rootpage = conn.execute("SELECT rootpage FROM sqlite_master WHERE type = 'table' AND name = 'patient_matrix'"
+                                ).fetchone()
+        max_rowid = conn.execute('SELECT MAX(rowid) FROM "patient_matrix"').fetchone() if rootpage else None
+        return rootpage, max_rowid
+    finally:
+        conn.close()
+
+
+def _worker_main(server: ScoringHTTPServer, worker_id: int, signal_mask: set) -> None:
+    """Body of a forked worker; never returns. Starts with SUPERVISOR_SIGNALS blocked."""
+    exit_code = 0
+    try:
+        server.worker_id = worker_id
+
+        def _stop(signum, frame):
+            server.stopping = True
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C reaches the whole group; the parent stops us
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # A SIGTERM that arrived since fork() is delivered now, to the handler above
+        signal.pthread_sigmask(signal.SIG_SETMASK, signal_mask)
+
+        reconnect_h2o()
+        model_registry.pin()
+        use_worker_state(worker_id)
+        logger.info(f"Worker {worker_id} serving model version {model_registry.current().version}")
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(server, selectors.EVENT_READ)
+            while not server.stopping:
+                # Every idle worker wakes for a new connection; the ones that lose accept() just poll again
+                if selector.select(WORKER_POLL_SECS):
+                    server._handle_request_noblock()
+
+        flush_monitors()
+        h2o.connection().close()
+    except Exception:
+        logger.exception(f"Worker {worker_id} failed")
+        exit_code = 1
+    finally:
+        # Skip the parent's atexit handlers, which would close the parent's H2O session
+        os._exit(exit_code)
+
+
+class PreforkSupervisor:
+    """Forks the workers and keeps them running on the current model version"""
+
+    def __init__(self, server: ScoringHTTPServer, n_workers: int):
+        self.server = server
+        self.n_workers = n_workers
+        self.workers = {}  # pid -> worker id
+        self.started_at = {}  # pid -> time.monotonic() at fork
+        self.failed_starts = {}  # worker id -> consecutive failed starts
+        self.respawn_at = {}  # worker id -> time.monotonic() of its delayed restart
+        self.stopping = False
+        self.reload_requested = False
+
+    def _spawn(self, worker_id: int) -> None:
+        mask = signal.pthread_sigmask(signal.SIG_BLOCK, SUPERVISOR_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                _worker_main(self.server, worker_id, mask)
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        self.workers[pid] = worker_id
+        self.started_at[pid] = time.monotonic()
+
+    def _stop_workers(self, pids: list) -> None:
+        """
+        Ask workers to finish their current request and exit; the ones still running after
+        worker_stop_timeout_secs (stuck in a request or an H2O call) are killed.
+        """
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        remaining = set(pids)
+        deadline = time.monotonic() + worker_stop_timeout_secs
+        while remaining:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+            if not remaining:
+                break
+            if time.monotonic() >= deadline:
+                for pid in remaining:
+                    logger.warning(f"Worker {self.workers.get(pid)} (pid {pid}) did not stop within "
+                                   f"{worker_stop_timeout_secs}s, killing it")
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                        os.waitpid(pid, 0)
+                    except (ProcessLookupError, ChildProcessError):
+                        pass
+                break
+            time.sleep(0.05)
+
+        for pid in pids:
+            self.workers.pop(pid, None)
+            self.started_at.pop(pid, None)
+
+    def _reap(self) -> None:
+        """Restart workers that died, backing off when they keep dying right after starting"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            worker_id = self.workers.pop(pid, None)
+            uptime = time.monotonic() - self.started_at.pop(pid, time.monotonic())
+            if worker_id is None or self.stopping:
+                continue
+
+            if uptime < MIN_WORKER_UPTIME_SECS:
+                self.failed_starts[worker_id] = self.failed_starts.get(worker_id, 0) + 1
+            else:
+                self.failed_starts[worker_id] = 0
+            delay = min(2 ** self.failed_starts[worker_id] - 1, MAX_RESPAWN_DELAY_SECS)
+            logger.warning(f"Worker {worker_id} (pid {pid}) exited with status {status} after {uptime:.1f}s, "
+                           f"restarting it in {delay}s")
+            self.respawn_at[worker_id] = time.monotonic() + delay
+
+        now = time.monotonic()
+        for worker_id, respawn_at in list(self.respawn_at.items()):
+            if now >= respawn_at and not self.stopping:
+                del self.respawn_at[worker_id]
+                self._spawn(worker_id)
+
+    def _reload(self) -> None:
+        """Load the new shared state here, then replace the workers one at a time"""
+        gc.unfreeze()
+        version = load_shared_state(self.server)
+        for pid, worker_id in list(self.workers.items()):
+            self._stop_workers([pid])
+            self._spawn(worker_id)
+        logger.info(f"{self.n_workers} worker(s) now serving model version {version}")
+
+    def run(self) -> None:
+        def _stop(signum, frame):
+            self.stopping = True
+
+        def _request_reload(signum, frame):
+            self.reload_requested = True
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        signal.signal(signal.SIGHUP, _request_reload)
+
+        version = load_shared_state(self.server)
+        signature = patient_matrix_signature()
+        for worker_id in range(self.n_workers):
+            self._spawn(worker_id)
+        logger.info(f"Serving on {self.server.server_address} with {self.n_workers} worker(s), "
+                    f"model version {version}")
+
+        next_check = time.monotonic() + model_check_interval_secs
+        try:
+            while not self.stopping:
+                time.sleep(WORKER_POLL_SECS)
+                self._reap()
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + model_check_interval_secs
+                    if model_registry.current().version != version:
+                        self.reload_requested = True
+                    elif patient_matrix_signature() != signature:
+                        logger.info("patient_matrix was republished, reloading the reference scores")
+                        self.reload_requested = True
+                if self.reload_requested and not self.stopping:
+                    self.reload_requested = False
+                    signature = patient_matrix_signature()
+                    self._reload()
+                    version = model_registry.current().version
+        finally:
+            logger.info("Stopping workers")
+            self._stop_workers(list(self.workers))
+            self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve REVIQ scores from prefork workers")
+    parser.add_argument("--host", default=server_host)
+    parser.add_argument("--port", type=int, default=server_port)
+    parser.add_argument("--workers", type=int, default=server_workers, help="0: one per CPU core")
+    args = parser.parse_args()
+
+    PreforkSupervisor(ScoringHTTPServer((args.host, args.port)),
+                      n_workers=args.workers or os.cpu_count()).run()
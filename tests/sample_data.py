@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+AS_OF = pd.Timestamp("2025-06-30")
+
+
+def sample_inputs(n_patients: int = 200, n_events: int = 3000, seed: int = 7):
+    """patient_dtl, activity_log and income_range_grade frames; event times are distinct seconds"""
+    rng = np.random.default_rng(seed)
+    patients = pd.DataFrame({
+        'id': np.arange(1, n_patients + 1),
+        'age': rng.integers(18, 90, n_patients),
+        'gender': rng.choice(['Male', 'Female'], n_patients),
+        'state': rng.choice(['TX', 'CA', 'MS'], n_patients),
+        'occupation': rng.choice(['Nurse', 'Truck Driver', 'Teacher'], n_patients),
+        'patient_condition': rng.choice(['acute', 'chronic'], n_patients),
+        'annual_income_grade': rng.integers(1, 5, n_patients),
+        'no_of_dependant': rng.integers(0, 6, n_patients),
+    })
+    seconds_before = rng.choice(200 * 86400, n_events, replace=False)
+    activity = pd.DataFrame({
+        'id': [f"e{i}" for i in range(n_events)],
+        'patient_id': rng.integers(1, n_patients + 1, n_events).astype(float),
+        'event_type': rng.choice(['refill', 'reminder', 'coverage_check'], n_events),
+        'supply_days': rng.integers(5, 31, n_events),
+        'prescribed_medication_days': 30,
+        'channel': 'app',
+        'time_stamp': (AS_OF - pd.to_timedelta(seconds_before, unit='s')).strftime('%Y-%m-%d %H:%M:%S'),
+        'event_outcome': rng.choice(['success', 'failed', 'abandoned'], n_events),
+        'refill_reminder_response': rng.choice([True, False], n_events),
+        'session_duration': rng.integers(0, 600, n_events),
+        'attempt_count': rng.integers(1, 4, n_events),
+    })
+    income = pd.DataFrame({'grade': [1, 2, 3, 4], 'income_range_low': [0, 30, 60, 90],
+                           'income_range_high': [30, 60, 90, 200]})
+    return patients, activity, income
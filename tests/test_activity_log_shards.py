@@ -0,0 +1,71 @@
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+import activity_log_shards
+import behaviour_score_generator_sql
+from reviq_helper import load_df_to_sqlite, read_activity_log, split_event_timestamps
+from sample_data import AS_OF, sample_inputs
+
+
+@pytest.fixture
+def sharded_db(tmp_path, monkeypatch):
+    """Path of a database whose activity_log is configured to live in 4 shards"""
+    db_path = str(tmp_path / "sharded.db")
+    monkeypatch.setattr(activity_log_shards, "sqlite_db_path", db_path)
+    monkeypatch.setattr(activity_log_shards, "activity_log_shards", 4)
+    monkeypatch.setattr(activity_log_shards, "activity_log_shard_dir", str(tmp_path / "shards"))
+    return db_path
+
+
+def _activity():
+    patients, activity, _ = sample_inputs()
+    activity, _ = split_event_timestamps(activity)
+    return patients, activity
+
+
+def _load_in_two_batches(db_path: str, activity: pd.DataFrame) -> None:
+    half = len(activity) // 2
+    load_df_to_sqlite(df=activity.iloc[:half], table_name="activity_log", sqlite_db_path=db_path)
+    load_df_to_sqlite(df=activity.iloc[half:], table_name="activity_log", sqlite_db_path=db_path,
+                      if_exists='append')
+
+
+def _by_id(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values('id').reset_index(drop=True)
+
+
+@pytest.mark.parametrize("scheme", ["patient_id", "month"])
+def test_sharded_read_and_append_match_unsharded(tmp_path, sharded_db, monkeypatch, scheme):
+    monkeypatch.setattr(activity_log_shards, "activity_log_shard_by", scheme)
+    _, activity = _activity()
+    plain_db = str(tmp_path / "plain.db")
+    _load_in_two_batches(plain_db, activity)
+    _load_in_two_batches(sharded_db, activity)
+
+    layout = activity_log_shards.read_layout(activity_log_shards.activity_log_shard_dir)
+    assert layout["scheme"] == scheme and len(layout["shards"]) > 1
+
+    for start, end in ((None, None), ("2025-03-15", "2025-05-01"), ("2030-01-01", None)):
+        expected = read_activity_log(plain_db, start=start, end=end)
+        actual = read_activity_log(sharded_db, start=start, end=end)
+        assert list(actual.columns) == list(expected.columns)
+        pdt.assert_frame_equal(_by_id(actual), _by_id(expected), check_dtype=False)
+
+
+@pytest.mark.parametrize("scheme", ["patient_id", "month"])
+def test_sharded_sql_scores_match_unsharded(tmp_path, sharded_db, monkeypatch, scheme):
+    monkeypatch.setattr(activity_log_shards, "activity_log_shard_by", scheme)
+    patients, activity = _activity()
+    plain_db = str(tmp_path / "plain.db")
+    _load_in_two_batches(plain_db, activity)
+    _load_in_two_batches(sharded_db, activity)
+
+    expected = behaviour_score_generator_sql.score_generator(plain_db, patients, as_of_date=AS_OF, windows=(30,))
+    actual = behaviour_score_generator_sql.score_generator(sharded_db, patients, as_of_date=AS_OF, windows=(30,))
+    pdt.assert_frame_equal(_by_id(actual), _by_id(expected), check_dtype=False)
+
+
+def test_empty_shard_directory_reads_empty_activity_log(sharded_db):
+    assert list(read_activity_log(sharded_db).columns) == activity_log_shards.ACTIVITY_LOG_COLUMNS
+    partials = activity_log_shards.query_shards("SELECT patient_id, COUNT(*) AS n FROM activity_log GROUP BY 1")
+    assert partials.empty and list(partials.columns) == ['patient_id', 'n']
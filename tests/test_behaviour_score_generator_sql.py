@@ -0,0 +1,40 @@
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+import behaviour_score_generator
+import behaviour_score_generator_sql
+from reviq_helper import load_df_to_sqlite, split_event_timestamps
+from sample_data import AS_OF, sample_inputs
+
+
+def _activity_db(tmp_path, activity: pd.DataFrame) -> str:
+    db_path = str(tmp_path / "reviq.db")
+    load_df_to_sqlite(df=activity, table_name="activity_log", sqlite_db_path=db_path)
+    return db_path
+
+
+def _by_id(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    return df[columns].sort_values('id').reset_index(drop=True)
+
+
+@pytest.mark.parametrize("windows", [None, (30, 90)])
+def test_sql_engine_matches_pandas_engine(tmp_path, windows):
+    patients, activity, income = sample_inputs()
+    activity, _ = split_event_timestamps(activity)
+    db_path = _activity_db(tmp_path, activity)
+
+    expected = behaviour_score_generator.score_generator(patients, activity, income, as_of_date=AS_OF,
+                                                         windows=windows)
+    actual = behaviour_score_generator_sql.score_generator(db_path, patients, as_of_date=AS_OF, windows=windows)
+    columns = list(expected.columns)
+    pdt.assert_frame_equal(_by_id(actual, columns), _by_id(expected, columns), check_dtype=False)
+
+
+def test_sql_engine_parses_legacy_text_timestamps(tmp_path):
+    patients, activity, income = sample_inputs()
+    db_path = _activity_db(tmp_path, activity)
+
+    expected = behaviour_score_generator.score_generator(patients, activity, income, as_of_date=AS_OF)
+    actual = behaviour_score_generator_sql.score_generator(db_path, patients, as_of_date=AS_OF)
+    columns = list(expected.columns)
+    pdt.assert_frame_equal(_by_id(actual, columns), _by_id(expected, columns), check_dtype=False)
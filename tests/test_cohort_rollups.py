@@ -0,0 +1,57 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+from cohort_rollups import (MEMBERS_TABLE, ROLLUP_TABLE, SCORE_COLUMNS, TOP_PATIENTS_TABLE, build_cohort_rollups,
+                            refresh_cohort_rollups)
+from sample_data import sample_inputs
+
+SORT_KEYS = {
+    ROLLUP_TABLE: ['dimension', 'cohort'],
+    TOP_PATIENTS_TABLE: ['dimension', 'score', 'direction', 'cohort', 'rank'],
+    MEMBERS_TABLE: ['id'],
+}
+
+
+def _patient_matrix(seed: int = 3) -> pd.DataFrame:
+    patients, _, _ = sample_inputs(n_patients=300)
+    rng = np.random.default_rng(seed)
+    for score in SCORE_COLUMNS:
+        patients[score] = rng.integers(0, 101, len(patients)) / 100
+    return patients
+
+
+def _tables(db_path: str) -> dict:
+    conn = sqlite3.connect(db_path)
+    try:
+        return {table: pd.read_sql_query(f'SELECT * FROM "{table}"', conn).sort_values(keys).reset_index(drop=True)
+                for table, keys in SORT_KEYS.items()}
+    finally:
+        conn.close()
+
+
+def test_incremental_refresh_matches_full_rebuild(tmp_path):
+    before = _patient_matrix()
+    after = before.copy()
+    after.loc[:9, 'adherence_score'] = 0.01                 # scores change
+    after.loc[10:14, 'state'] = 'NY'                        # patients move to a new cohort
+    after = after.iloc[20:].reset_index(drop=True)          # patients leave
+    joined = _patient_matrix(seed=4).iloc[:5].assign(id=lambda df: df['id'] + 1000)
+    after = pd.concat([after, joined], ignore_index=True)   # patients join
+
+    incremental_db, full_db = str(tmp_path / "incremental.db"), str(tmp_path / "full.db")
+    build_cohort_rollups(before, sqlite_db_path=incremental_db)
+    counts = refresh_cohort_rollups(after, sqlite_db_path=incremental_db)
+    build_cohort_rollups(after, sqlite_db_path=full_db)
+
+    assert counts['state'] > 0
+    incremental, full = _tables(incremental_db), _tables(full_db)
+    for table in SORT_KEYS:
+        pdt.assert_frame_equal(incremental[table], full[table], check_dtype=False)
+
+
+def test_refresh_without_changes_recomputes_nothing(tmp_path):
+    db_path = str(tmp_path / "reviq.db")
+    df = _patient_matrix()
+    assert set(refresh_cohort_rollups(df, sqlite_db_path=db_path).values()) != {0}  # first call builds
+    assert set(refresh_cohort_rollups(df, sqlite_db_path=db_path).values()) == {0}
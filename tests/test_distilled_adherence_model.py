@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+from distilled_adherence_model import DistilledAdherenceModel, fidelity_report
+from sample_data import sample_inputs
+
+STATE_EFFECT = {'TX': 0.05, 'CA': -0.04, 'MS': 0.0}
+OCCUPATION_EFFECT = {'Nurse': 0.03, 'Truck Driver': -0.08, 'Teacher': 0.02}
+
+
+def _patients_and_teacher(n_patients: int = 2000, seed: int = 11):
+    """Patients and a teacher score that depends on their raw attributes only, like the served chain"""
+    patients, _, _ = sample_inputs(n_patients=n_patients, n_events=10, seed=seed)
+    rng = np.random.default_rng(seed)
+    teacher = (0.4 + 0.002 * patients['age'] - 0.02 * patients['no_of_dependant']
+               + 0.05 * patients['annual_income_grade'] + patients['state'].map(STATE_EFFECT)
+               + patients['occupation'].map(OCCUPATION_EFFECT)
+               + np.where(patients['patient_condition'] == 'chronic', -0.06, 0.0)
+               + rng.normal(0, 0.005, n_patients))
+    return patients, teacher.to_numpy()
+
+
+def test_student_tracks_teacher_on_holdout():
+    patients, teacher = _patients_and_teacher()
+    train = np.arange(len(patients)) % 5 != 0
+
+    student = DistilledAdherenceModel.fit(patients[train], teacher[train])
+    report = fidelity_report(student.predict(patients[~train]), teacher[~train])
+
+    assert report['r2'] > 0.99
+    assert report['rmse'] < 0.01
+    assert not any(col.endswith('_score') for col in student.numeric_cols)
+
+
+def test_saved_student_predicts_the_same(tmp_path):
+    patients, teacher = _patients_and_teacher(n_patients=300)
+    student = DistilledAdherenceModel.fit(patients, teacher)
+    loaded = DistilledAdherenceModel.load(student.save(str(tmp_path / "student.json")))
+    np.testing.assert_allclose(loaded.predict(patients), student.predict(patients))
+
+
+def test_unseen_levels_and_missing_values_score_like_the_training_mean():
+    patients, teacher = _patients_and_teacher(n_patients=300)
+    student = DistilledAdherenceModel.fit(patients, teacher)
+
+    odd = patients.iloc[:1].copy()
+    odd['state'] = 'unknown state'
+    odd['age'] = np.nan
+    assert np.isfinite(student.predict(odd)).all()
+
+    with pytest.raises(ValueError):
+        student.predict(patients.drop(columns=['age']))
@@ -0,0 +1,83 @@
+import os
+import pytest
+from model_store import (ModelRegistry, activate_version, publish_files, read_manifest, rollback,
+                         version_dir)
+
+
+def _write(path: str, text: str) -> str:
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+def _load_ids(model_dir: str) -> dict:
+    """Stub loader: like h2o.load_model, each file registers under the id stored in it"""
+    models = {}
+    for name in os.listdir(model_dir):
+        with open(os.path.join(model_dir, name)) as f:
+            models[name] = f.read()
+    return models
+
+
+def _registry(store_root: str, unloaded: list) -> ModelRegistry:
+    return ModelRegistry(store_root, loader=_load_ids, unloader=unloaded.extend,
+                         model_keys=lambda models: set(models.values()))
+
+
+def test_inherited_models_stay_loaded_when_their_first_version_is_evicted(tmp_path):
+    store = str(tmp_path / "store")
+    gbm = _write(tmp_path / "gbm", "GBM_model_1")
+    unloaded = []
+    registry = _registry(store, unloaded)
+
+    publish_files(store, {"gbm": gbm, "student": _write(tmp_path / "s1", "student_1")})
+    registry.refresh(force=True)
+    # Distiller-style publishes: new student, GBM binary inherited unchanged
+    for n in (2, 3):
+        publish_files(store, {"student": _write(tmp_path / f"s{n}", f"student_{n}")})
+        current = registry.refresh(force=True)
+
+    assert set(unloaded) == {"student_1"}
+    assert not set(unloaded) & set(current.models.values())
+
+
+def test_publish_rollback_and_refresh(tmp_path):
+    store = str(tmp_path / "store")
+    unloaded = []
+    registry = _registry(store, unloaded)
+
+    first = publish_files(store, {"gbm": _write(tmp_path / "g1", "GBM_1")})
+    assert registry.refresh().version == first
+    assert registry.refresh() is registry.refresh()  # unchanged manifest: same snapshot
+
+    previous = registry.current()
+    second = publish_files(store, {"gbm": _write(tmp_path / "g2", "GBM_2")})
+    current = registry.refresh(force=True)
+    assert current.version == second and current.models == {"gbm": "GBM_2"}
+    assert previous.models == {"gbm": "GBM_1"}  # a snapshot taken before the swap stays usable
+
+    assert rollback(store) == first
+    assert read_manifest(store)["active"] == first
+    # The previous version is retained, so rolling back swaps to the same snapshot without reloading
+    assert registry.refresh(force=True) is previous
+    assert unloaded == []
+
+
+def test_failed_load_keeps_serving_the_current_version(tmp_path):
+    store = str(tmp_path / "store")
+    registry = _registry(store, [])
+    first = publish_files(store, {"gbm": _write(tmp_path / "g1", "GBM_1")})
+    registry.refresh()
+
+    second = publish_files(store, {"gbm": _write(tmp_path / "g2", "GBM_2")})
+    _write(os.path.join(version_dir(store, second), "gbm"), "corrupted")
+    assert registry.refresh(force=True).version == first
+
+
+def test_unpublished_versions_cannot_be_activated(tmp_path):
+    store = str(tmp_path / "store")
+    publish_files(store, {"gbm": _write(tmp_path / "g1", "GBM_1")})
+    with pytest.raises(ValueError):
+        activate_version(store, "missing")
+    with pytest.raises(ValueError):
+        rollback(store)  # no previous version yet
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+from parallel_score_generator import parallel_score_generator, patient_shard_ids
+from sample_data import AS_OF, sample_inputs
+
+
+def test_shard_ids_ignore_other_ids_in_the_column():
+    clean = patient_shard_ids(pd.Series([1, 2, 3, 4]), 8)
+    with_nan = patient_shard_ids(pd.Series([1.0, 2.0, 3.0, 4.0, np.nan]), 8)
+    with_text = patient_shard_ids(pd.Series([1, 2, 3, 4, 'x']), 8)
+    np.testing.assert_array_equal(clean, with_nan[:4])
+    np.testing.assert_array_equal(clean, with_text[:4])
+
+
+def test_parallel_matches_serial_with_nan_patient_id():
+    patients, activity, income = sample_inputs()
+    activity.loc[0, 'patient_id'] = np.nan
+
+    serial = parallel_score_generator(patients, activity, income, n_workers=1, as_of_date=AS_OF)
+    parallel = parallel_score_generator(patients, activity, income, n_workers=4, as_of_date=AS_OF)
+    pdt.assert_frame_equal(serial, parallel, check_dtype=False)
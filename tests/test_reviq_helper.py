@@ -0,0 +1,56 @@
+import sqlite3
+import time
+import pandas as pd
+from reviq_helper import (STALE_SHADOW_AGE_SECS, load_df_to_sqlite, publish_df_to_sqlite, shadow_table_name,
+                          swap_in_table)
+
+
+def _schema(db_path: str) -> dict:
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT type, name, tbl_name FROM sqlite_master").fetchall()
+    finally:
+        conn.close()
+    return {'tables': {name for kind, name, _ in rows if kind == 'table'},
+            'indexes': {(table, name) for kind, name, table in rows if kind == 'index'}}
+
+
+def _patients(n: int) -> pd.DataFrame:
+    return pd.DataFrame({'id': range(n), 'state': 'TX', 'patient_condition': 'chronic', 'adherence_score': 0.5})
+
+
+def test_published_table_indexes_carry_the_final_table_name(tmp_path):
+    db_path = str(tmp_path / "reviq.db")
+    publish_df_to_sqlite(df=_patients(5), table_name="patient_matrix", sqlite_db_path=db_path)
+    publish_df_to_sqlite(df=_patients(7), table_name="patient_matrix", sqlite_db_path=db_path)
+
+    schema = _schema(db_path)
+    assert schema['tables'] == {'patient_matrix'}
+    assert schema['indexes'] == {('patient_matrix', 'idx_patient_matrix_id'),
+                                 ('patient_matrix', 'idx_patient_matrix_state'),
+                                 ('patient_matrix', 'idx_patient_matrix_patient_condition')}
+
+
+def test_swap_renames_indexes_built_on_the_shadow(tmp_path):
+    db_path = str(tmp_path / "reviq.db")
+    shadow_name = shadow_table_name("cohort_rollup_members")
+    load_df_to_sqlite(df=_patients(5)[['id']], table_name=shadow_name, sqlite_db_path=db_path, index_columns=['id'])
+    swap_in_table(db_path, shadow_name, "cohort_rollup_members")
+
+    assert _schema(db_path)['indexes'] == {('cohort_rollup_members', 'idx_cohort_rollup_members_id')}
+
+
+def test_swap_drops_only_stale_shadows(tmp_path):
+    db_path = str(tmp_path / "reviq.db")
+    in_progress = f"patient_matrix__shadow_{int(time.time()) - 60}_aaaaaaaa"
+    stale = f"patient_matrix__shadow_{int(time.time()) - STALE_SHADOW_AGE_SECS - 60}_bbbbbbbb"
+    legacy = "patient_matrix__shadow_1a2b3c4d"
+    conn = sqlite3.connect(db_path)
+    for name in (in_progress, stale, legacy):
+        conn.execute(f'CREATE TABLE "{name}" (id INTEGER)')
+    conn.commit()
+    conn.close()
+
+    publish_df_to_sqlite(df=_patients(5), table_name="patient_matrix", sqlite_db_path=db_path)
+
+    assert _schema(db_path)['tables'] == {'patient_matrix', in_progress}
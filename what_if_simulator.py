@@ -0,0 +1,121 @@
+import configparser
+import itertools
+import logging
+import pandas as pd
+from patient_score_lookup import PatientScoreLookup
+from reviq_score_predictor import predict_all_scores
+
+# Create a ConfigParser object
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+logger = logging.getLogger(__name__)
+
+sqlite_db_path = config["DEFAULT"]["sqlite_db_path"]
+
+# Patient attributes a what-if may change; the scores themselves are always re-predicted
+WHAT_IF_FEATURES = [
+    'age',
+    'gender',
+    'maritial_status',
+    'occupation',
+    'annual_income_grade',
+    'patient_condition',
+    'no_of_dependant',
+    'state',
+    'city',
+    'zip_code'
+]
+
+NUMERIC_WHAT_IF_FEATURES = ['age', 'annual_income_grade', 'no_of_dependant', 'zip_code']
+
+SCORE_COLUMNS = [
+    'adherence_score',
+    'refill_reminder_score',
+    'price_sensitivity_score',
+    'awareness_score',
+    'coverage_confusion_score'
+]
+
+# Upper bound on the grid size, keeps one what-if to a single modest prediction batch
+MAX_VARIANTS = 1000
+
+_patient_lookup = None
+
+
+def _resolve_value(feature: str, base_value, value):
+    """
+    Absolute value of one perturbation; '+N' / '-N' on a numeric feature is relative to the base.
+    Numeric features come back as numbers, so "0" and '-2' on a base of 2 compare equal.
+    """
+    if feature not in NUMERIC_WHAT_IF_FEATURES:
+        return value
+    if isinstance(value, str) and value.strip()[:1] in ('+', '-'):
+        base_number = pd.to_numeric(base_value, errors='coerce')
+        if pd.isna(base_number):
+            raise ValueError(f"Cannot apply the relative change {value} to {feature}: "
+                             f"the patient has no {feature} value")
+        return float(base_number) + float(value)
+    return float(pd.to_numeric(value, errors='coerce'))
+
+
+def expand_what_if_grid(base_patient: dict, perturbations: dict) -> pd.DataFrame:
+    """
+    Expand a base patient over every combination of the perturbed feature values.
+
+    :param base_patient: the patient's attributes
+    :param perturbations: {feature: [values]}, e.g. {'annual_income_grade': [3, 4], 'no_of_dependant': ['-2']}
+    :return: pd.DataFrame with the unchanged base patient as row 0 followed by one row per combination
+    """
+    unknown = [feature for feature in perturbations if feature not in WHAT_IF_FEATURES]
+    if unknown:
+        raise ValueError(f"Cannot simulate changes to {unknown}; allowed features: {WHAT_IF_FEATURES}")
+
+    features = list(perturbations)
+    # Duplicates (e.g. '-2' and 0 on a base of 2) are scored once
+    options = [list(dict.fromkeys(_resolve_value(feature, base_patient[feature], value)
+                                  for value in perturbations[feature]))
+               for feature in features]
+    n_variants = 1
+    for values in options:
+        n_variants *= len(values)
+    if n_variants > MAX_VARIANTS:
+        raise ValueError(f"{n_variants} what-if variants requested, the limit is {MAX_VARIANTS}")
+
+    base = pd.DataFrame([base_patient])
+    variants = pd.DataFrame(list(itertools.product(*options)), columns=features)
+    grid = pd.concat([base] * (len(variants) + 1), ignore_index=True)
+    for feature in features:
+        values = [base_patient[feature]] + variants[feature].tolist()
+        grid[feature] = pd.to_numeric(values, errors='coerce') if feature in NUMERIC_WHAT_IF_FEATURES else values
+    return grid
+
+
+def simulate_what_if(base_patient: dict, perturbations: dict, adherence_model: str = "formula") -> pd.DataFrame:
+    """
+    Score a base patient and all of its what-if variants in one predict_all_scores batch.
+
+    :param base_patient: the patient's attributes
+    :param perturbations: {feature: [values]} as for expand_what_if_grid
+    :param adherence_model: passed to predict_all_scores ('formula' or 'distilled')
+    :return: pd.DataFrame with a 'variant' column ('baseline' for row 0), the perturbed features,
+             the predicted scores and adherence_delta against the baseline
+    """
+    grid = expand_what_if_grid(base_patient, perturbations)
+    scored = predict_all_scores(grid.drop(columns=[col for col in SCORE_COLUMNS if col in grid.columns]),
+                                # Synthetic variants must not feed the production drift sketches
+                                adherence_model=adherence_model, monitor=False)
+    logger.info(f"Scored {len(grid) - 1} what-if variant(s) in one batch")
+
+    result = scored[list(perturbations) + SCORE_COLUMNS].copy()
+    result.insert(0, 'variant', ['baseline'] + [f"v{i}" for i in range(1, len(result))])
+    result['adherence_delta'] = (result['adherence_score'] - result['adherence_score'].iloc[0]).round(2)
+    return result
+
+
+def base_patient_from_id(patient_id: int) -> dict:
+    """The stored attributes of an existing patient from patient_matrix, or None when the id is unknown"""
+    global _patient_lookup
+    if _patient_lookup is None:
+        _patient_lookup = PatientScoreLookup(sqlite_db_path, table_name="patient_matrix", columns='*')
+    return _patient_lookup.get_patient(patient_id)